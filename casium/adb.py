@@ -3,8 +3,21 @@
 Adb command tool.
 """
 
+import atexit
+import hashlib
+import os
+import Queue
+import select
+import socket
 import tempfile
-from subprocess import check_output, CalledProcessError, call
+import threading
+import time
+import uuid
+import zlib
+from subprocess import CalledProcessError, call, Popen, PIPE
+
+from casium import trace
+from casium.adbclient import AdbClient, AdbError, SHELL_ID_STDOUT, SHELL_ID_STDERR, SHELL_ID_EXIT
 
 
 class Cmd(object):
@@ -29,6 +42,315 @@ class Cmd(object):
     ADB_COMMAND_SYNC = 'sync'
     ADB_COMMAND_VERSION = 'version'
     ADB_COMMAND_BUGREPORT = 'bugreport'
+    ADB_COMMAND_EXEC_OUT = 'exec-out'
+
+
+# Longest command line kept in a trace span.
+TRACE_CMD_SIZE = 200
+
+
+class ShellSessionError(Exception):
+    """
+    Raised when a shell session is no longer usable.
+    """
+    pass
+
+
+class ShellSession(object):
+    """
+    A long-lived 'adb shell' process which runs commands one after another.
+
+    Every command runs in its own subshell, so 'cd', 'export' or 'exit' do not change the session,
+    and it is evaluated from a quoted string, so an incomplete command like an unbalanced quote
+    fails with a syntax error instead of swallowing the rest of the script. The command is
+    followed by a sentinel line on both stdout and stderr, so the output and the return code of
+    each command can be read back from the shared pipes.
+    """
+
+    HANDSHAKE_TIMEOUT = 5.0
+    READ_SIZE = 65536
+
+    def __init__(self, udid=None):
+        self._udid = udid
+        self._sentinel = '__casium_%s__' % uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._process = None
+        self._alive = False
+        self._pid = os.getpid()
+        self._start()
+
+    @property
+    def alive(self):
+        # A forked child process must not share the pipes with its parent.
+        return self._alive and self._pid == os.getpid() and self._process.poll() is None
+
+    def _start(self):
+        if self._udid is None:
+            adb_full_cmd = [Cmd.ADB_COMMAND_PREFIX, Cmd.ADB_COMMAND_SHELL]
+        else:
+            adb_full_cmd = [Cmd.ADB_COMMAND_PREFIX, Cmd.ADB_COMMAND_ARG_ID, self._udid,
+                            Cmd.ADB_COMMAND_SHELL]
+        self._process = Popen(adb_full_cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE, bufsize=0)
+        self._alive = True
+
+        # A pty backed shell (old adb/devices) echoes the input and merges stderr into stdout,
+        # then the sentinel framing never completes and the session is refused.
+        result = self._communicate('true', self.HANDSHAKE_TIMEOUT)
+        if result != (0, ''):
+            self.close()
+            raise ShellSessionError('Unexpected shell session handshake: %r' % (result,))
+
+    def run(self, cmd):
+        """
+        Execute shell command in this session.
+        :param cmd: string shell command to execute
+        :return: tuple of return code and output like _exec_command(), None when the session is
+        busy with another thread or has died before the command is sent. Once it is sent, the
+        command is never run again elsewhere, a session dying while running it is an error.
+        """
+        if not self._lock.acquire(False):
+            return None
+        sent = False
+        try:
+            if not self.alive:
+                return None
+            with trace.span('adb session', 'adb', cmd=cmd[:TRACE_CMD_SIZE]) as s:
+                self._send(cmd)
+                sent = True
+                result = self._receive()
+                s.set('bytes_received', len(result[1]))
+            return result
+        except (ShellSessionError, IOError, OSError) as e:
+            self.close()
+            if not sent:
+                return None
+            return 1, 'adb: error: shell session failed while running the command: %s\n' % e
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """
+        Terminate the underlying adb process.
+        """
+        self._alive = False
+        if self._pid != os.getpid():
+            return
+        if self._process is not None and self._process.poll() is None:
+            try:
+                self._process.stdin.close()
+                self._process.terminate()
+                self._process.wait()
+            except (IOError, OSError):
+                pass
+
+    def _communicate(self, cmd, timeout=None):
+        self._send(cmd)
+        return self._receive(timeout)
+
+    def _send(self, cmd):
+        quoted = _quote_sentinel(self._sentinel)
+        script = "( eval '%s'\n) </dev/null\n" \
+                 '__casium_rc=$?\n' \
+                 'echo; echo %s $__casium_rc\n' \
+                 'echo >&2; echo %s >&2\n' % (cmd.replace("'", "'\\''"), quoted, quoted)
+        self._process.stdin.write(script)
+        self._process.stdin.flush()
+
+    def _receive(self, timeout=None):
+        out_marker = '\n%s ' % self._sentinel
+        err_marker = '\n%s\n' % self._sentinel
+        stdout = self._process.stdout.fileno()
+        stderr = self._process.stderr.fileno()
+        chunks = {stdout: [], stderr: []}
+        tails = {stdout: '', stderr: ''}
+        done = {stdout: False, stderr: False}
+        deadline = None if timeout is None else time.time() + timeout
+
+        while not (done[stdout] and done[stderr]):
+            wait = None if deadline is None else max(0.0, deadline - time.time())
+            readable = select.select([fd for fd in done if not done[fd]], [], [], wait)[0]
+            if not readable:
+                raise ShellSessionError('Shell session timeout.')
+            for fd in readable:
+                data = os.read(fd, self.READ_SIZE)
+                if not data:
+                    raise ShellSessionError('Shell session closed.')
+                chunks[fd].append(data)
+                tails[fd] = (tails[fd] + data)[-(len(self._sentinel) + 32):]
+                if fd == stdout:
+                    done[fd] = tails[fd].endswith('\n') and out_marker in tails[fd]
+                else:
+                    done[fd] = tails[fd].endswith(err_marker)
+
+        output = ''.join(chunks[stdout])
+        pos = output.rindex(out_marker)
+        returncode = int(output[pos + len(out_marker):].strip())
+        if returncode != 0:
+            error = ''.join(chunks[stderr])
+            return returncode, error[:len(error) - len(err_marker)]
+        return 0, output[:pos]
+
+
+class ShellStream(object):
+    """
+    Output of a running shell command which is read incrementally.
+
+    Iterate it for output lines, or use chunks() for raw data. The return code and the error
+    output are available once the output is exhausted.
+    """
+
+    MAX_ERROR_SIZE = 64 * 1024
+
+    def __init__(self, packets, closer=None):
+        """
+        :param packets: iterable of shell protocol v2 packets, tuples of packet id and data
+        :param closer: function to release the transport
+        """
+        self._packets = packets
+        self._closer = closer
+        self.returncode = None
+        self.error = ''
+
+    def chunks(self):
+        """
+        Read the standard output chunk by chunk.
+        :return: generator of string chunks
+        """
+        try:
+            for packet_id, data in self._packets:
+                if packet_id == SHELL_ID_STDOUT:
+                    yield data
+                elif packet_id == SHELL_ID_STDERR:
+                    if len(self.error) < self.MAX_ERROR_SIZE:
+                        self.error += data[:self.MAX_ERROR_SIZE - len(self.error)]
+                elif packet_id == SHELL_ID_EXIT:
+                    self.returncode = ord(data[0])
+        finally:
+            self.close()
+        if self.returncode is None:
+            self.returncode = 0
+
+    def __iter__(self):
+        rest = ''
+        for chunk in self.chunks():
+            lines = (rest + chunk).split('\n')
+            rest = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if rest:
+            yield rest
+
+    def read(self):
+        """
+        Read the whole standard output.
+        :return: tuple of return code and output like shell()
+        """
+        output = ''.join(self.chunks())
+        if self.returncode != 0:
+            return self.returncode, self.error
+        return 0, output
+
+    def close(self):
+        if self._closer is not None:
+            self._closer()
+            self._closer = None
+
+
+def _quote_sentinel(sentinel):
+    """
+    Private Function to quote a sentinel for shell scripts.
+    The sentinel is split in the script, so an echoed script can never match it.
+    :param sentinel: string sentinel
+    :return: string quoted sentinel
+    """
+    half = len(sentinel) // 2
+    return '"%s""%s"' % (sentinel[:half], sentinel[half:])
+
+
+_shell_sessions = {}
+_shell_sessions_lock = threading.Lock()
+_shell_session_enabled = os.name != 'nt'  # select() does not work on pipes on Windows.
+
+
+def enable_shell_session(enabled=True):
+    """
+    Enable or disable the persistent shell sessions used by shell()
+    :param enabled: False to always spawn a new adb process for every shell command
+    """
+    global _shell_session_enabled
+    _shell_session_enabled = enabled and os.name != 'nt'
+    if not _shell_session_enabled:
+        close_shell_sessions()
+
+
+def close_shell_sessions():
+    """
+    Close all the persistent shell sessions
+    """
+    with _shell_sessions_lock:
+        for session in _shell_sessions.values():
+            if session is not None:
+                session.close()
+        _shell_sessions.clear()
+
+
+atexit.register(close_shell_sessions)
+
+NATIVE_CLIENT_RETRY_INTERVAL = 5.0
+
+_native_client = AdbClient()
+_native_client_enabled = True
+_native_client_retry_at = 0.0
+
+
+def enable_native_client(enabled=True):
+    """
+    Enable or disable talking to the adb server directly instead of executing the adb binary
+    :param enabled: False to always execute the adb binary
+    """
+    global _native_client_enabled
+    _native_client_enabled = enabled
+
+
+def _exec_native(func, *args):
+    """
+    Private Function to run a request with the native adb client.
+    The adb binary starts the adb server on demand, so when the server is not reachable the
+    caller falls back to it and the native client is retried later.
+    :param func: AdbClient method
+    :param args: arguments of the method
+    :return: tuple of True and the method result, tuple of False and None when not reachable
+    """
+    global _native_client_retry_at
+    if not _native_client_enabled or time.time() < _native_client_retry_at:
+        return False, None
+    try:
+        with trace.span('adb native %s' % func.__name__, 'adb'):
+            return True, func(*args)
+    except socket.error:
+        _native_client_retry_at = time.time() + NATIVE_CLIENT_RETRY_INTERVAL
+        return False, None
+
+
+def _get_shell_session(udid):
+    """
+    Private Function to get the persistent shell session of the device, start it if needed.
+    A device which refused a session will not be retried until close_shell_sessions()
+    :param udid: device serial number
+    :return: ShellSession or None
+    """
+    if not _shell_session_enabled:
+        return None
+
+    with _shell_sessions_lock:
+        session = _shell_sessions.get(udid, False)
+        if session is False or (session is not None and not session.alive):
+            try:
+                session = ShellSession(udid)
+            except (ShellSessionError, IOError, OSError):
+                session = None
+            _shell_sessions[udid] = session
+        return session
 
 
 def _isDeviceAvailable():
@@ -38,7 +360,7 @@ def _isDeviceAvailable():
     :return: True or False
     """
     result = getserialno()
-    if result[1].strip() == "unknown":
+    if result[0] != 0 or result[1].strip() == "unknown":
         return False
     else:
         return True
@@ -75,26 +397,298 @@ def bugreport(dest_file="default.log"):
         return (0, "Device Not Found")
 
 
-def push(src, dest):
+def push(src, dest, udid=None):
     """
     Push object from host to target
     :param src: string path to source object on host
     :param dest: string destination path on target
+    :param udid: device serial number
     :return: result of _exec_command() execution
     """
+    start = time.time()
+    try:
+        native, result = _exec_native(_native_client.push, src, dest, udid)
+    except (AdbError, IOError, OSError) as e:
+        return 1, 'adb: error: %s\n' % e
+    if native:
+        return 0, _transfer_summary(src, 'pushed', result, time.time() - start)
+
     adb_full_cmd = [Cmd.ADB_COMMAND_PREFIX, Cmd.ADB_COMMAND_PUSH, src, dest]
-    return _exec_command(adb_full_cmd)
+    return _exec_command(_with_udid(adb_full_cmd, udid))
 
 
-def pull(src, dest):
+def pull(src, dest, udid=None):
     """
     Pull object from target to host
     :param src: string path of object on target
     :param dest: string destination path on host
+    :param udid: device serial number
     :return: result of _exec_command() execution
     """
+    start = time.time()
+    try:
+        native, result = _exec_native(_native_client.pull, src, dest, udid)
+    except (AdbError, IOError, OSError) as e:
+        return 1, 'adb: error: %s\n' % e
+    if native:
+        return 0, _transfer_summary(src, 'pulled', result, time.time() - start)
+
     adb_full_cmd = [Cmd.ADB_COMMAND_PREFIX, Cmd.ADB_COMMAND_PULL, src, dest]
-    return _exec_command(adb_full_cmd)
+    return _exec_command(_with_udid(adb_full_cmd, udid))
+
+
+TRANSFER_WORKERS = 4
+
+
+def pull_many(files, udid=None, workers=TRANSFER_WORKERS, compress=False, skip_unchanged='mtime'):
+    """
+    Pull many files from target to host in parallel, each worker keeps one sync connection
+    :param files: list of tuples of file path on target and path on host, the file is put into
+    the host path if it is an existing directory
+    :param udid: device serial number
+    :param workers: int count of parallel transfers
+    :param compress: gzip files on the device and inflate them on host, for large text files
+    like traces
+    :param skip_unchanged: 'mtime' to skip files with the same size and modification time,
+    'hash' to skip files with the same md5, None to transfer all files
+    :return: tuple of return code and the summary with throughput, failed files are listed
+    """
+    pairs = []
+    for src, dest in files:
+        if os.path.isdir(dest) or dest.endswith(os.sep):
+            dest = os.path.join(dest, src.rstrip('/').split('/')[-1])
+        pairs.append((src, dest))
+
+    infos = _remote_file_infos([src for src, _ in pairs], udid, skip_unchanged == 'hash')
+
+    def transfer(sync, src, dest):
+        info = infos.get(src)
+        if info is None:
+            raise AdbError("remote object '%s' does not exist" % src)
+        if skip_unchanged and _is_same_file(dest, info, skip_unchanged):
+            return None
+        parent = os.path.dirname(dest)
+        if parent and not os.path.isdir(parent):
+            os.makedirs(parent)
+        if sync is None and not compress:
+            result = pull(src, dest, udid)
+            if result[0] != 0:
+                raise AdbError(result[1].strip())
+            size = os.path.getsize(dest)
+        else:
+            # Write and rename, so a failed transfer does not destroy the previous copy.
+            fd, temp_file = tempfile.mkstemp(dir=parent or None)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    if compress:
+                        size = _pull_compressed(src, f, udid, sync is not None)
+                    else:
+                        size = sync.recv(src, f)
+                os.rename(temp_file, dest)
+            except:
+                os.remove(temp_file)
+                raise
+        # Keep the device modification time, so the next pull can skip the file.
+        os.utime(dest, (info[1], info[1]))
+        return size
+
+    return _transfer_many(pairs, transfer, 'pulled', udid, workers)
+
+
+def push_many(files, udid=None, workers=TRANSFER_WORKERS, skip_unchanged='mtime'):
+    """
+    Push many files from host to target in parallel, each worker keeps one sync connection
+    :param files: list of tuples of file path on host and path on target, the file is put into
+    the target path if it ends with '/'
+    :param udid: device serial number
+    :param workers: int count of parallel transfers
+    :param skip_unchanged: 'mtime' to skip files with the same size and modification time,
+    'hash' to skip files with the same md5, None to transfer all files
+    :return: tuple of return code and the summary with throughput, failed files are listed
+    """
+    pairs = []
+    for src, dest in files:
+        if dest.endswith('/'):
+            dest = dest + os.path.basename(src)
+        pairs.append((src, dest))
+
+    infos = {}
+    if skip_unchanged:
+        infos = _remote_file_infos([dest for _, dest in pairs], udid, skip_unchanged == 'hash')
+
+    def transfer(sync, src, dest):
+        info = infos.get(dest)
+        if info is not None and _is_same_file(src, info, skip_unchanged):
+            return None
+        if sync is not None:
+            st = os.stat(src)
+            with open(src, 'rb') as f:
+                return sync.send(f, dest, st.st_mode & 0777, st.st_mtime)
+        result = push(src, dest, udid)
+        if result[0] != 0:
+            raise AdbError(result[1].strip())
+        return os.path.getsize(src)
+
+    return _transfer_many(pairs, transfer, 'pushed', udid, workers)
+
+
+def _transfer_many(pairs, transfer, action, udid, workers):
+    """
+    Private Function to run file transfers in worker threads
+    :param pairs: list of tuples of source and destination path
+    :param transfer: function of sync connection, source and destination, returns the bytes
+    transferred or None if skipped. The connection is None when the adb server is not reachable.
+    :param action: 'pulled' or 'pushed'
+    :param udid: device serial number
+    :param workers: int count of worker threads
+    :return: tuple of return code and summary
+    """
+    start = time.time()
+    try:
+        native = _exec_native(_native_client.features, udid)[0]
+    except AdbError as e:
+        return 1, 'adb: error: %s\n' % e
+    queue = Queue.Queue()
+    for pair in pairs:
+        queue.put(pair)
+    results = []
+
+    def work():
+        sync = None
+        while True:
+            try:
+                src, dest = queue.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                if native and sync is None:
+                    sync = _native_client.sync(udid)
+                results.append((src, transfer(sync, src, dest), None))
+            except (AdbError, IOError, OSError, socket.error, zlib.error) as e:
+                results.append((src, None, e))
+                # The device closes the sync connection after a failure.
+                if sync is not None:
+                    _quit_sync(sync)
+                    sync = None
+        if sync is not None:
+            _quit_sync(sync)
+
+    threads = [threading.Thread(target=work) for _ in range(min(workers, len(pairs)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    seconds = time.time() - start
+    files = len([r for r in results if r[1] is not None])
+    size = sum(r[1] for r in results if r[1] is not None)
+    skipped = len([r for r in results if r[1] is None and r[2] is None])
+    errors = ['adb: error: %s: %s\n' % (src, e) for src, _, e in results if e is not None]
+    rate = size / seconds / 1024 / 1024 if seconds > 0 else 0
+    summary = '%d file%s %s, %d skipped. %.1f MB/s (%d bytes in %.3fs)\n' % (
+        files, '' if files == 1 else 's', action, skipped, rate, size, seconds)
+    return (1 if errors else 0), ''.join(errors) + summary
+
+
+def _quit_sync(sync):
+    """
+    Private Function to close a sync connection which may be broken already
+    :param sync: sync connection of the native client
+    """
+    try:
+        sync.quit()
+    except (AdbError, IOError, OSError, socket.error):
+        pass
+
+
+def _remote_file_infos(paths, udid, with_hash):
+    """
+    Private Function to get size, modification time and optionally md5 of files on target in
+    one shell invocation
+    :param paths: list of string file paths on target
+    :param udid: device serial number
+    :param with_hash: bool also compute md5
+    :return: dict of path to tuple of size, mtime and md5 or None, missing files are absent
+    """
+    cmds = []
+    for path in paths:
+        cmd = "stat -c '%%s %%Y' %s" % _quote_arg(path)
+        if with_hash:
+            cmd = '%s && md5sum %s' % (cmd, _quote_arg(path))
+        cmds.append(cmd)
+
+    infos = {}
+    for path, (returncode, output) in zip(paths, shell_batch(cmds, udid)):
+        words = output.split()
+        if returncode != 0 or len(words) < 2:
+            continue
+        infos[path] = (int(words[0]), int(words[1]), words[2] if with_hash else None)
+    return infos
+
+
+def _is_same_file(path, info, skip_unchanged):
+    """
+    Private Function to compare a host file with the stat of a target file
+    :param path: file path on host
+    :param info: tuple of size, mtime and md5 from _remote_file_infos()
+    :param skip_unchanged: 'mtime' or 'hash'
+    :return: bool
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    if st.st_size != info[0]:
+        return False
+    if skip_unchanged == 'hash':
+        md5 = hashlib.md5()
+        with open(path, 'rb') as f:
+            for data in iter(lambda: f.read(ShellSession.READ_SIZE), ''):
+                md5.update(data)
+        return md5.hexdigest() == info[2]
+    return int(st.st_mtime) == info[1]
+
+
+def _pull_compressed(src, stream, udid, native):
+    """
+    Private Function to pull a file gzipped by the device shell
+    :param src: file path on target
+    :param stream: writable file object on host
+    :param udid: device serial number
+    :param native: bool use the adb server connection, otherwise the adb binary
+    :return: int compressed bytes transferred
+    """
+    cmd = 'gzip -c %s' % _quote_arg(src)
+    if native:
+        conn = _native_client.open_service('exec:%s' % cmd, udid)
+        read, close = lambda: conn.socket.recv(ShellSession.READ_SIZE), conn.close
+    else:
+        adb_full_cmd = [Cmd.ADB_COMMAND_PREFIX, Cmd.ADB_COMMAND_EXEC_OUT, cmd]
+        process = Popen(_with_udid(adb_full_cmd, udid), stdout=PIPE)
+        read = lambda: os.read(process.stdout.fileno(), ShellSession.READ_SIZE)
+        close = _process_closer(process, tempfile.TemporaryFile())
+
+    size = 0
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        for data in iter(read, ''):
+            size += len(data)
+            stream.write(inflater.decompress(data))
+        stream.write(inflater.flush())
+    finally:
+        close()
+    if size == 0 or inflater.unused_data:
+        raise AdbError('gzip failed on the device')
+    return size
+
+
+def _quote_arg(arg):
+    """
+    Private Function to quote an argument for the device shell
+    :param arg: string argument
+    :return: string single quoted argument
+    """
+    return "'%s'" % arg.replace("'", "'\\''")
 
 
 def devices(opts=[]):
@@ -103,6 +697,14 @@ def devices(opts=[]):
     :param opts: list command options (e.g. ["-r", "-a"])
     :return: result of _exec_command() execution
     """
+    if opts in ([], ['-l']):
+        try:
+            native, result = _exec_native(_native_client.devices, opts == ['-l'])
+        except AdbError as e:
+            return 1, str(e)
+        if native:
+            return 0, 'List of devices attached\n%s\n' % result
+
     adb_full_cmd = [Cmd.ADB_COMMAND_PREFIX, Cmd.ADB_COMMAND_DEVICES, _convert_opts(opts)]
     return _exec_command(adb_full_cmd)
 
@@ -114,6 +716,19 @@ def shell(cmd, udid=None):
     :param udid: device serial number
     :return: result of _exec_command() execution
     """
+    session = _get_shell_session(udid)
+    if session is not None:
+        result = session.run(cmd)
+        if result is not None:
+            return result
+
+    try:
+        native, result = _exec_native(_native_client.shell, cmd, udid)
+    except AdbError as e:
+        return 1, str(e)
+    if native:
+        return result
+
     if udid is None:
         adb_full_cmd = [Cmd.ADB_COMMAND_PREFIX, Cmd.ADB_COMMAND_SHELL, cmd]
     else:
@@ -122,6 +737,144 @@ def shell(cmd, udid=None):
     return _exec_command(adb_full_cmd)
 
 
+def shell_stream(cmd, udid=None):
+    """
+    Execute shell command on target and read the output while it is arriving
+    :param cmd: string shell command to execute
+    :param udid: device serial number
+    :return: ShellStream
+    """
+    try:
+        native, result = _exec_native(_native_client.open_shell, cmd, udid)
+    except AdbError as e:
+        return ShellStream([(SHELL_ID_STDERR, str(e)), (SHELL_ID_EXIT, chr(1))])
+    if native:
+        conn, packets = result
+        return ShellStream(packets, conn.close)
+
+    adb_full_cmd = [Cmd.ADB_COMMAND_PREFIX, Cmd.ADB_COMMAND_SHELL, cmd]
+    t = tempfile.TemporaryFile()
+    process = Popen(_with_udid(adb_full_cmd, udid), stdout=PIPE, stderr=t)
+    return ShellStream(_process_packets(process, t), _process_closer(process, t))
+
+
+def _process_packets(process, stderr):
+    """
+    Private Function to read the output of an adb process as shell protocol v2 packets
+    :param process: Popen object with piped stdout
+    :param stderr: file which the process stderr is redirected to
+    :return: generator of tuples of packet id and data
+    """
+    while True:
+        data = os.read(process.stdout.fileno(), ShellSession.READ_SIZE)
+        if not data:
+            break
+        yield SHELL_ID_STDOUT, data
+    returncode = process.wait()
+    stderr.seek(0)
+    yield SHELL_ID_STDERR, stderr.read(ShellStream.MAX_ERROR_SIZE)
+    yield SHELL_ID_EXIT, chr(returncode & 0xff)
+
+
+def _process_closer(process, stderr):
+    def close():
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        stderr.close()
+    return close
+
+
+def shell_batch(cmds, udid=None):
+    """
+    Execute several shell commands on target in a single shell invocation
+    :param cmds: list of string shell commands to execute in order
+    :param udid: device serial number
+    :return: list of shell() results, one for each command. The commands are never run again, if
+    the batch stops early the commands which did not complete have an error.
+    """
+    if len(cmds) == 0:
+        return []
+    if len(cmds) == 1:
+        return [shell(cmds[0], udid)]
+
+    script, sentinel = _batch_script(cmds)
+    return _batch_results(shell(script, udid), sentinel, cmds)
+
+
+def _batch_script(cmds):
+    """
+    Private Function to build the shell_batch() script
+    :param cmds: list of string shell commands
+    :return: tuple of string script and the sentinel between commands
+    """
+    sentinel = '__casium_%s__' % uuid.uuid4().hex
+    quoted = _quote_sentinel(sentinel)
+    script = []
+    for cmd in cmds:
+        # stdout is written through fd 3 while stderr is kept for the failed commands. Like
+        # ShellSession every command is evaluated in its own subshell.
+        script.append("{ __casium_err=$( { ( eval '%s'\n) </dev/null 2>&1 1>&3 3>&-; } ); } 3>&1\n"
+                      '__casium_rc=$?\n'
+                      'echo; echo %s $__casium_rc\n'
+                      '[ $__casium_rc -ne 0 ] && printf "%%s\\n" "$__casium_err"\n'
+                      'echo; echo %s\n' % (cmd.replace("'", "'\\''"), quoted, quoted))
+    return ''.join(script), sentinel
+
+
+def _batch_results(result, sentinel, cmds):
+    """
+    Private Function to read the results of the shell_batch() script
+    :param result: shell() result of the script
+    :param sentinel: string sentinel between commands
+    :param cmds: list of string shell commands of the script
+    :return: list of results, an error for every command which did not complete
+    """
+    results, pos = _parse_batch_output(result[1], sentinel, len(cmds))
+    # The batch stopped early, the commands may have already changed the device, so they are
+    # never run again. The output left belongs to the first command which did not complete.
+    error = result[1][pos:]
+    for cmd in cmds[len(results):]:
+        results.append((result[0] or 1, '%sadb: error: shell batch stopped before the command '
+                                         'completed: %s\n' % (error, cmd)))
+        error = ''
+    return results
+
+
+def _parse_batch_output(output, sentinel, count):
+    """
+    Private Function to split the output of shell_batch() script
+    :param output: string output of the whole script
+    :param sentinel: string sentinel between commands
+    :param count: commands count
+    :return: tuple of the list of results of the well framed commands and the end position of
+    their output
+    """
+    rc_marker = '\n%s ' % sentinel
+    end_marker = '\n%s\n' % sentinel
+    results = []
+    pos = 0
+    for i in range(count):
+        rc_pos = output.find(rc_marker, pos)
+        if rc_pos == -1:
+            break
+        rc_end = output.find('\n', rc_pos + len(rc_marker))
+        end_pos = output.find(end_marker, rc_end)
+        if rc_end == -1 or end_pos == -1:
+            break
+        try:
+            returncode = int(output[rc_pos + len(rc_marker):rc_end])
+        except ValueError:
+            break
+        if returncode == 0:
+            results.append((0, output[pos:rc_pos]))
+        else:
+            results.append((returncode, output[rc_end + 1:end_pos]))
+        pos = end_pos + len(end_marker)
+    return results, pos
+
+
 def connect(ip):
     """
     Connect adb to specified ip and port 
@@ -157,11 +910,36 @@ def uninstall(app, opts=[]):
     return _exec_command(adb_full_cmd)
 
 
+def exec_out(cmd, udid=None):
+    """
+    Execute command on target without pty, the output is binary safe
+    :param cmd: string command to execute
+    :param udid: device serial number
+    :return: result of _exec_command() execution
+    """
+    try:
+        native, result = _exec_native(_native_client.exec_out, cmd, udid)
+    except AdbError as e:
+        return 1, str(e)
+    if native:
+        return 0, result
+
+    adb_full_cmd = [Cmd.ADB_COMMAND_PREFIX, Cmd.ADB_COMMAND_EXEC_OUT, cmd]
+    return _exec_command(_with_udid(adb_full_cmd, udid))
+
+
 def getserialno():
     """
     Get serial number for all available target devices
     :return: result of _exec_command() execution
     """
+    try:
+        native, result = _exec_native(_native_client.get_serialno)
+    except AdbError as e:
+        return 1, str(e)
+    if native:
+        return 0, result
+
     adb_full_cmd = [Cmd.ADB_COMMAND_PREFIX, Cmd.ADB_COMMAND_GETSERIALNO]
     return _exec_command(adb_full_cmd)
 
@@ -211,6 +989,33 @@ def get_state():
     return _exec_command(adb_full_cmd)
 
 
+def _with_udid(adb_cmd, udid):
+    """
+    Insert the device serial number argument into adb command
+    :param adb_cmd: list adb command starts with the adb executable
+    :param udid: device serial number, None to leave the command unchanged
+    :return: list adb command
+    """
+    if udid is None:
+        return adb_cmd
+    return adb_cmd[:1] + [Cmd.ADB_COMMAND_ARG_ID, udid] + adb_cmd[1:]
+
+
+def _transfer_summary(src, action, result, seconds):
+    """
+    Format the summary line of a native file transfer like the adb binary
+    :param src: string source path
+    :param action: 'pulled' or 'pushed'
+    :param result: tuple of files count and bytes count
+    :param seconds: float transfer time
+    :return: string summary
+    """
+    files, size = result
+    rate = size / seconds / 1024 / 1024 if seconds > 0 else 0
+    return '%s: %d file%s %s. %.1f MB/s (%d bytes in %.3fs)\n' % (
+        src, files, '' if files == 1 else 's', action, rate, size, seconds)
+
+
 def _convert_opts(opts):
     """
     Convert list with command options to single string value
@@ -236,14 +1041,21 @@ def _exec_command(adb_cmd):
             # contain extra spaces
     # print('\n*** Executing ' + ' '.join(adb_cmd) + ' ' + 'command')
 
-    try:
-        output = check_output(final_adb_cmd, stderr=t)
-    except CalledProcessError as e:
-        t.seek(0)
-        result = e.returncode, t.read()
-    else:
-        result = 0, output
-        # print('\n' + result[1])
+    args = final_adb_cmd[1:]
+    if args[:1] == [Cmd.ADB_COMMAND_ARG_ID]:
+        args = args[2:]
+    with trace.span('adb %s' % (args[0] if args else ''), 'adb',
+                    cmd=' '.join(final_adb_cmd)[:TRACE_CMD_SIZE]) as s:
+        start = time.time()
+        process = Popen(final_adb_cmd, stdout=PIPE, stderr=t)
+        s.set('spawn', time.time() - start)
+        output = process.communicate()[0]
+        if process.returncode != 0:
+            t.seek(0)
+            result = process.returncode, t.read()
+        else:
+            result = 0, output
+        s.set('bytes_received', len(result[1]))
 
     return result
 
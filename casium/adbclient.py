@@ -0,0 +1,483 @@
+# -*- coding: utf-8 -*-
+"""
+Pure python client of the adb server wire protocol.
+
+It talks to the adb server on localhost:5037 directly, which is much cheaper than executing the
+adb binary for every request. See SERVICES.TXT and SYNC.TXT in the adb sources for the protocol.
+"""
+
+import os
+import socket
+import stat
+import struct
+import tempfile
+import time
+
+from casium import trace
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 5037
+
+SYNC_DATA_MAX = 64 * 1024
+
+# Shell protocol v2 packet ids.
+SHELL_ID_STDIN = 0
+SHELL_ID_STDOUT = 1
+SHELL_ID_STDERR = 2
+SHELL_ID_EXIT = 3
+SHELL_ID_CLOSE_STDIN = 4
+
+
+class AdbError(Exception):
+    """
+    Raised when the adb server or the device answers a request with FAIL.
+    """
+    pass
+
+
+def _recv_exactly(sock, size, allow_eof=False):
+    chunks = []
+    while size > 0:
+        data = sock.recv(min(size, SYNC_DATA_MAX))
+        if not data:
+            if allow_eof and not chunks:
+                return ''
+            raise AdbError('Connection closed by adb server.')
+        chunks.append(data)
+        size -= len(data)
+    return ''.join(chunks)
+
+
+def _recv_all(sock):
+    chunks = []
+    while True:
+        data = sock.recv(SYNC_DATA_MAX)
+        if not data:
+            break
+        chunks.append(data)
+    return ''.join(chunks)
+
+
+class AdbConnection(object):
+    """
+    A single connection to the adb server. Each connection serves exactly one service.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=None):
+        self._sock = socket.create_connection((host, port), timeout)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    @property
+    def socket(self):
+        return self._sock
+
+    def send(self, data):
+        self._sock.sendall(data)
+        self.bytes_sent += len(data)
+        trace.add_bytes(sent=len(data))
+
+    def recv(self, size, allow_eof=False):
+        data = _recv_exactly(self._sock, size, allow_eof)
+        self.bytes_received += len(data)
+        trace.add_bytes(received=len(data))
+        return data
+
+    def recv_all(self):
+        data = _recv_all(self._sock)
+        self.bytes_received += len(data)
+        trace.add_bytes(received=len(data))
+        return data
+
+    def request(self, service):
+        """
+        Send a service request and check the OKAY/FAIL status.
+        :param service: service name, like 'host:version' or 'shell:ls'
+        """
+        self.send('%04x%s' % (len(service), service))
+        self.check_status()
+
+    def check_status(self):
+        status = self.recv(4)
+        if status == 'OKAY':
+            return
+        if status == 'FAIL':
+            raise AdbError(self.recv_string())
+        raise AdbError('Unexpected adb status: %r' % status)
+
+    def recv_string(self):
+        return self.recv(int(self.recv(4), 16))
+
+    def close(self):
+        try:
+            self._sock.close()
+        except socket.error:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class SyncConnection(object):
+    """
+    A connection switched into the 'sync:' file transfer mode.
+    """
+
+    def __init__(self, connection):
+        self._conn = connection
+
+    @property
+    def bytes_sent(self):
+        return self._conn.bytes_sent
+
+    @property
+    def bytes_received(self):
+        return self._conn.bytes_received
+
+    def _send_request(self, request_id, data):
+        self._conn.send(request_id + struct.pack('<I', len(data)) + data)
+
+    def _recv_header(self):
+        header = self._conn.recv(8)
+        return header[:4], struct.unpack('<I', header[4:])[0]
+
+    def stat(self, remote):
+        """
+        Stat a path on the device.
+        :param remote: path on the device
+        :return: tuple of mode, size and mtime. Mode is 0 if path does not exist.
+        """
+        self._send_request('STAT', remote)
+        response = self._conn.recv(16)
+        if response[:4] != 'STAT':
+            raise AdbError('Unexpected sync response: %r' % response[:4])
+        return struct.unpack('<III', response[4:])
+
+    def list(self, remote):
+        """
+        List a directory on the device.
+        :param remote: directory path on the device
+        :return: list of tuples of name, mode, size and mtime
+        """
+        self._send_request('LIST', remote)
+        entries = []
+        while True:
+            response = self._conn.recv(4)
+            if response == 'DONE':
+                self._conn.recv(16)
+                break
+            if response != 'DENT':
+                raise AdbError('Unexpected sync response: %r' % response)
+            mode, size, mtime, name_len = struct.unpack('<IIII', self._conn.recv(16))
+            name = self._conn.recv(name_len)
+            if name not in ('.', '..'):
+                entries.append((name, mode, size, mtime))
+        return entries
+
+    def recv(self, remote, stream):
+        """
+        Receive a file from the device.
+        :param remote: file path on the device
+        :param stream: writable file object on host
+        :return: bytes received
+        """
+        self._send_request('RECV', remote)
+        size = 0
+        while True:
+            request_id, length = self._recv_header()
+            if request_id == 'DATA':
+                stream.write(self._conn.recv(length))
+                size += length
+            elif request_id == 'DONE':
+                return size
+            elif request_id == 'FAIL':
+                raise AdbError(self._conn.recv(length))
+            else:
+                raise AdbError('Unexpected sync response: %r' % request_id)
+
+    def send(self, stream, remote, mode=0644, mtime=None):
+        """
+        Send a file to the device.
+        :param stream: readable file object on host
+        :param remote: file path on the device
+        :param mode: file permission on the device
+        :param mtime: modification time, default is now
+        :return: bytes sent
+        """
+        self._send_request('SEND', '%s,%d' % (remote, stat.S_IFREG | mode))
+        size = 0
+        while True:
+            data = stream.read(SYNC_DATA_MAX)
+            if not data:
+                break
+            self._send_request('DATA', data)
+            size += len(data)
+        if mtime is None:
+            mtime = time.time()
+        self._conn.send('DONE' + struct.pack('<I', int(mtime)))
+        request_id, length = self._recv_header()
+        if request_id == 'FAIL':
+            raise AdbError(self._conn.recv(length))
+        if request_id != 'OKAY':
+            raise AdbError('Unexpected sync response: %r' % request_id)
+        return size
+
+    def quit(self):
+        self._send_request('QUIT', '')
+        self._conn.close()
+
+
+class AdbClient(object):
+    """
+    Client of the adb server, every method opens a new connection to the server.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=None):
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+        self._features = {}
+
+    def connect(self):
+        """
+        Open a new connection to the adb server.
+        :return: AdbConnection
+        """
+        return AdbConnection(self._host, self._port, self._timeout)
+
+    def host_request(self, service):
+        """
+        Execute a host service which replies with a length prefixed string.
+        :param service: host service, like 'host:version'
+        :return: the reply string
+        """
+        with self.connect() as conn:
+            conn.request(service)
+            return conn.recv_string()
+
+    def version(self):
+        return int(self.host_request('host:version'), 16)
+
+    def devices(self, long_format=False):
+        """
+        List the attached devices.
+        :param long_format: True to list device qualifiers as 'adb devices -l'
+        :return: the same text as 'adb devices' prints without the heading line
+        """
+        if long_format:
+            return self.host_request('host:devices-l')
+        return self.host_request('host:devices')
+
+    def get_serialno(self, udid=None):
+        return self.host_request(self._host_prefix(udid) + 'get-serialno')
+
+    def get_state(self, udid=None):
+        return self.host_request(self._host_prefix(udid) + 'get-state')
+
+    def features(self, udid=None):
+        """
+        Get the features supported by both the adb server and the device, cached per device.
+        :param udid: device serial number
+        :return: set of feature names
+        """
+        if udid not in self._features:
+            reply = self.host_request(self._host_prefix(udid) + 'features')
+            self._features[udid] = set(reply.split(','))
+        return self._features[udid]
+
+    def transport(self, udid=None):
+        """
+        Open a connection which is switched to the device.
+        :param udid: device serial number, None to use the only attached device
+        :return: AdbConnection
+        """
+        conn = self.connect()
+        try:
+            if udid is None:
+                conn.request('host:transport-any')
+            else:
+                conn.request('host:transport:%s' % udid)
+        except:
+            conn.close()
+            raise
+        return conn
+
+    def open_service(self, service, udid=None):
+        """
+        Open a device service, like 'shell:ls' or 'exec:screencap'.
+        :param service: the device service
+        :param udid: device serial number
+        :return: AdbConnection streaming the service
+        """
+        conn = self.transport(udid)
+        try:
+            conn.request(service)
+        except:
+            conn.close()
+            raise
+        return conn
+
+    def shell(self, cmd, udid=None):
+        """
+        Execute shell command on target.
+        :param cmd: string shell command to execute
+        :param udid: device serial number
+        :return: tuple of return code and output, output is stderr when return code is not 0.
+        Device without shell protocol v2 always return 0 and the merged output.
+        """
+        conn, packets = self.open_shell(cmd, udid)
+        with conn:
+            stdout, stderr = [], []
+            returncode = 0
+            for packet_id, data in packets:
+                if packet_id == SHELL_ID_STDOUT:
+                    stdout.append(data)
+                elif packet_id == SHELL_ID_STDERR:
+                    stderr.append(data)
+                elif packet_id == SHELL_ID_EXIT:
+                    returncode = ord(data[0])
+        if returncode != 0:
+            return returncode, ''.join(stderr)
+        return 0, ''.join(stdout)
+
+    def open_shell(self, cmd, udid=None):
+        """
+        Start shell command on target and read its output incrementally.
+        :param cmd: string shell command to execute
+        :param udid: device serial number
+        :return: tuple of AdbConnection and generator of shell protocol v2 packets, which are
+        emulated for devices without shell protocol v2
+        """
+        if 'shell_v2' in self.features(udid):
+            conn = self.open_service('shell,v2,raw:%s' % cmd, udid)
+            return conn, self.shell_packets(conn)
+        conn = self.open_service('shell:%s' % cmd, udid)
+        return conn, self._legacy_shell_packets(conn)
+
+    @staticmethod
+    def shell_packets(conn):
+        """
+        Iterate shell protocol v2 packets of a connection until the exit packet.
+        :param conn: AdbConnection of a 'shell,v2:' service
+        :return: generator of tuples of packet id and data
+        """
+        while True:
+            header = conn.recv(5, allow_eof=True)
+            if not header:
+                return
+            packet_id, length = struct.unpack('<BI', header)
+            data = conn.recv(length)
+            yield packet_id, data
+            if packet_id == SHELL_ID_EXIT:
+                return
+
+    @staticmethod
+    def _legacy_shell_packets(conn):
+        while True:
+            data = conn.socket.recv(SYNC_DATA_MAX)
+            if not data:
+                break
+            conn.bytes_received += len(data)
+            yield SHELL_ID_STDOUT, data
+        yield SHELL_ID_EXIT, chr(0)
+
+    def exec_out(self, cmd, udid=None):
+        """
+        Execute a command on target without pty and stderr, the output is binary safe.
+        :param cmd: string command to execute
+        :param udid: device serial number
+        :return: the raw standard output
+        """
+        with self.open_service('exec:%s' % cmd, udid) as conn:
+            return conn.recv_all()
+
+    def sync(self, udid=None):
+        """
+        Open a file transfer connection.
+        :param udid: device serial number
+        :return: SyncConnection
+        """
+        return SyncConnection(self.open_service('sync:', udid))
+
+    def pull(self, src, dest, udid=None):
+        """
+        Pull a file or a directory from target to host.
+        :param src: path on target
+        :param dest: path on host, files are put into it if it is an existing directory
+        :param udid: device serial number
+        :return: tuple of files count and bytes count transferred
+        """
+        sync = self.sync(udid)
+        try:
+            mode = sync.stat(src)[0]
+            if mode == 0:
+                raise AdbError("remote object '%s' does not exist" % src)
+            if os.path.isdir(dest):
+                dest = os.path.join(dest, os.path.basename(src.rstrip('/')))
+            return self._pull_path(sync, src, dest, mode)
+        finally:
+            sync.quit()
+
+    def _pull_path(self, sync, src, dest, mode):
+        if stat.S_ISDIR(mode):
+            if not os.path.isdir(dest):
+                os.makedirs(dest)
+            files, size = 0, 0
+            for name, child_mode, _, _ in sync.list(src):
+                result = self._pull_path(sync, '%s/%s' % (src.rstrip('/'), name),
+                                         os.path.join(dest, name), child_mode)
+                files += result[0]
+                size += result[1]
+            return files, size
+
+        # Write and rename, so a failed pull does not destroy the previous copy.
+        fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(dest) or None)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                size = sync.recv(src, f)
+            os.rename(temp_file, dest)
+        except:
+            os.remove(temp_file)
+            raise
+        return 1, size
+
+    def push(self, src, dest, udid=None):
+        """
+        Push a file or a directory from host to target.
+        :param src: path on host
+        :param dest: path on target, files are put into it if it is an existing directory
+        :param udid: device serial number
+        :return: tuple of files count and bytes count transferred
+        """
+        sync = self.sync(udid)
+        try:
+            if stat.S_ISDIR(sync.stat(dest)[0]):
+                dest = '%s/%s' % (dest.rstrip('/'), os.path.basename(src.rstrip(os.sep)))
+            if not os.path.isdir(src):
+                return 1, self._push_file(sync, src, dest)
+
+            files, size = 0, 0
+            for root, _, names in os.walk(src):
+                relative = os.path.relpath(root, src).replace(os.sep, '/')
+                for name in names:
+                    remote = '/'.join(p for p in (dest.rstrip('/'), relative, name) if p != '.')
+                    size += self._push_file(sync, os.path.join(root, name), remote)
+                    files += 1
+            return files, size
+        finally:
+            sync.quit()
+
+    @staticmethod
+    def _push_file(sync, src, dest):
+        st = os.stat(src)
+        with open(src, 'rb') as f:
+            return sync.send(f, dest, stat.S_IMODE(st.st_mode), st.st_mtime)
+
+    @staticmethod
+    def _host_prefix(udid):
+        if udid is None:
+            return 'host:'
+        return 'host-serial:%s:' % udid
@@ -0,0 +1,1031 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous adb and Device operations driven by a single threaded event loop.
+
+Python 2 has no asyncio, so this module brings a small select() based event loop with generator
+coroutines. A coroutine yields futures (or lists of futures) and returns its result by raising
+Return. The adb operations use non-blocking sockets to the adb server, and non-blocking pipes of
+the adb binary when the server is not reachable.
+
+Example::
+    @aio.coroutine
+    def scenario(device):
+        yield device.click('50%', '50%')
+        rc, output = yield aio.shell('dumpsys gfxinfo', device.udid)
+
+    aio.run(aio.gather(*[scenario(AsyncDevice(d)) for d in devices]))
+"""
+
+import collections
+import errno
+import fcntl
+import functools
+import heapq
+import itertools
+import os
+import Queue
+import select
+import socket
+import stat
+import struct
+import sys
+import threading
+import time
+import types
+from subprocess import Popen, PIPE
+
+from casium import adb
+from casium.adbclient import AdbError, DEFAULT_HOST, DEFAULT_PORT, SYNC_DATA_MAX, \
+    SHELL_ID_STDOUT, SHELL_ID_STDERR, SHELL_ID_EXIT
+from casium.device import Metrics, PAGE_FLIP_COUNT_COMMAND, IDLE_POLL_INTERVAL, \
+    _parse_page_flip_count
+from casium.focus import _parse_activity_name
+from casium.screencap import SCREENCAP_COMMAND, parse_screencap, write_png
+
+EXECUTOR_WORKERS = 4
+NATIVE_CLIENT_RETRY_INTERVAL = 5.0
+
+
+class Return(Exception):
+    """
+    Raise it in a coroutine to return a value.
+    """
+
+    def __init__(self, value=None):
+        Exception.__init__(self)
+        self.value = value
+
+
+class Future(object):
+    """
+    The result of an asynchronous operation.
+    """
+
+    def __init__(self, loop=None):
+        self._loop = loop or get_event_loop()
+        self._done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def result(self):
+        if not self._done:
+            raise RuntimeError('Future is not done.')
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self):
+        if self._exc_info is None:
+            return None
+        return self._exc_info[1]
+
+    def set_result(self, result):
+        self._result = result
+        self._set_done()
+
+    def set_exception(self, exception, traceback=None):
+        self._exc_info = (type(exception), exception, traceback)
+        self._set_done()
+
+    def set_exc_info(self, exc_info):
+        self._exc_info = exc_info
+        self._set_done()
+
+    def add_done_callback(self, callback):
+        """
+        :param callback: function called with this future in the event loop once it is done
+        """
+        if self._done:
+            self._loop.call_soon(callback, self)
+        else:
+            self._callbacks.append(callback)
+
+    def _set_done(self):
+        if self._done:
+            raise RuntimeError('Future is already done.')
+        self._done = True
+        for callback in self._callbacks:
+            self._loop.call_soon(callback, self)
+        self._callbacks = []
+
+
+class Task(Future):
+    """
+    A future which runs a generator coroutine in the event loop.
+    """
+
+    def __init__(self, generator, loop=None):
+        Future.__init__(self, loop)
+        self._generator = generator
+        self._loop.call_soon(self._step, None, None)
+
+    def _step(self, value, exc_info):
+        try:
+            if exc_info is not None:
+                yielded = self._generator.throw(*exc_info)
+            else:
+                yielded = self._generator.send(value)
+        except StopIteration:
+            self.set_result(None)
+            return
+        except Return as e:
+            self.set_result(e.value)
+            return
+        except Exception:
+            self.set_exc_info(sys.exc_info())
+            return
+
+        if yielded is None:
+            self._loop.call_soon(self._step, None, None)
+            return
+        if isinstance(yielded, (list, tuple)):
+            yielded = gather(*yielded)
+        if not isinstance(yielded, Future):
+            error = TypeError('Coroutine yielded %r which is not a future.' % (yielded,))
+            self._loop.call_soon(self._step, None, (TypeError, error, None))
+            return
+        yielded.add_done_callback(self._wakeup)
+
+    def _wakeup(self, future):
+        if future._exc_info is not None:
+            self._step(None, future._exc_info)
+        else:
+            self._step(future._result, None)
+
+
+def coroutine(func):
+    """
+    Decorator of generator coroutines. Calling the decorated function schedules it as a Task.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            result = func(*args, **kwargs)
+        except Return as e:
+            result = e.value
+        if isinstance(result, types.GeneratorType):
+            return Task(result)
+        if isinstance(result, Future):
+            return result
+        future = Future()
+        future.set_result(result)
+        return future
+
+    return wrapper
+
+
+class _Executor(object):
+    """
+    A small thread pool shared by the event loop for calls which can only block.
+    """
+
+    def __init__(self, loop, workers):
+        self._loop = loop
+        self._queue = Queue.Queue()
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, func, *args):
+        future = Future(self._loop)
+        self._queue.put((future, func, args))
+        return future
+
+    def shutdown(self):
+        for _ in self._threads:
+            self._queue.put(None)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, func, args = item
+            try:
+                result = func(*args)
+            except Exception:
+                self._loop.call_soon_threadsafe(future.set_exc_info, sys.exc_info())
+            else:
+                self._loop.call_soon_threadsafe(future.set_result, result)
+
+
+class EventLoop(object):
+    """
+    A select() based event loop.
+    """
+
+    def __init__(self, executor_workers=EXECUTOR_WORKERS):
+        self._ready = collections.deque()
+        self._timers = []
+        self._counter = itertools.count()
+        self._readers = {}
+        self._writers = {}
+        self._lock = threading.Lock()
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        self._executor_workers = executor_workers
+        self._executor = None
+
+    def time(self):
+        return time.time()
+
+    def call_soon(self, callback, *args):
+        self._ready.append((callback, args))
+
+    def call_later(self, delay, callback, *args):
+        heapq.heappush(self._timers, (self.time() + delay, next(self._counter), callback, args))
+
+    def call_soon_threadsafe(self, callback, *args):
+        with self._lock:
+            self._ready.append((callback, args))
+        os.write(self._wakeup_write, 'x')
+
+    def add_reader(self, fd, callback, *args):
+        self._readers[fd] = (callback, args)
+
+    def remove_reader(self, fd):
+        self._readers.pop(fd, None)
+
+    def add_writer(self, fd, callback, *args):
+        self._writers[fd] = (callback, args)
+
+    def remove_writer(self, fd):
+        self._writers.pop(fd, None)
+
+    def run_in_executor(self, func, *args):
+        """
+        Run a blocking function in the shared thread pool.
+        :return: Future of the function return value
+        """
+        if self._executor is None:
+            self._executor = _Executor(self, self._executor_workers)
+        return self._executor.submit(func, *args)
+
+    def run_until_complete(self, future):
+        """
+        Run the event loop until the future is done.
+        :param future: Future, or a generator to run as a Task
+        :return: the future result
+        """
+        if isinstance(future, types.GeneratorType):
+            future = Task(future, self)
+        while not future.done():
+            self._run_once()
+        return future.result()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        os.close(self._wakeup_read)
+        os.close(self._wakeup_write)
+
+    def _run_once(self):
+        timeout = None
+        if self._ready:
+            timeout = 0
+        elif self._timers:
+            timeout = max(0, self._timers[0][0] - self.time())
+
+        readers = list(self._readers.keys()) + [self._wakeup_read]
+        writers = list(self._writers.keys())
+        try:
+            readable, writable, _ = select.select(readers, writers, [], timeout)
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            readable, writable = [], []
+
+        for fd in readable:
+            if fd == self._wakeup_read:
+                os.read(self._wakeup_read, 4096)
+            elif fd in self._readers:
+                callback, args = self._readers[fd]
+                self._ready.append((callback, args))
+        for fd in writable:
+            if fd in self._writers:
+                callback, args = self._writers[fd]
+                self._ready.append((callback, args))
+
+        now = self.time()
+        while self._timers and self._timers[0][0] <= now:
+            _, _, callback, args = heapq.heappop(self._timers)
+            self._ready.append((callback, args))
+
+        with self._lock:
+            count = len(self._ready)
+        for _ in range(count):
+            with self._lock:
+                callback, args = self._ready.popleft()
+            callback(*args)
+
+
+_loops = threading.local()
+
+
+def get_event_loop():
+    """
+    Get the event loop of current thread, create it if needed.
+    """
+    loop = getattr(_loops, 'loop', None)
+    if loop is None:
+        loop = EventLoop()
+        _loops.loop = loop
+    return loop
+
+
+def run(future):
+    """
+    Run the event loop of current thread until the future is done.
+    :param future: Future, or a generator to run as a Task
+    :return: the future result
+    """
+    return get_event_loop().run_until_complete(future)
+
+
+def sleep(seconds):
+    """
+    :return: Future done after the seconds
+    """
+    future = Future()
+    future._loop.call_later(seconds, future.set_result, None)
+    return future
+
+
+def gather(*futures):
+    """
+    :return: Future of the list of all the results, or the first exception
+    """
+    result = Future()
+    if not futures:
+        result.set_result([])
+        return result
+
+    pending = [len(futures)]
+
+    def on_done(_):
+        if result.done():
+            return
+        pending[0] -= 1
+        for future in futures:
+            if future.done() and future.exception() is not None:
+                result.set_exc_info(future._exc_info)
+                return
+        if pending[0] == 0:
+            result.set_result([future.result() for future in futures])
+
+    for future in futures:
+        future.add_done_callback(on_done)
+    return result
+
+
+def run_in_executor(func, *args):
+    return get_event_loop().run_in_executor(func, *args)
+
+
+def _wait_fd(fd, write=False):
+    loop = get_event_loop()
+    future = Future(loop)
+
+    def ready():
+        if write:
+            loop.remove_writer(fd)
+        else:
+            loop.remove_reader(fd)
+        future.set_result(None)
+
+    if write:
+        loop.add_writer(fd, ready)
+    else:
+        loop.add_reader(fd, ready)
+    return future
+
+
+def _wait_any_readable(fds):
+    loop = get_event_loop()
+    future = Future(loop)
+
+    def ready(fd):
+        for f in fds:
+            loop.remove_reader(f)
+        if not future.done():
+            future.set_result(fd)
+
+    for fd in fds:
+        loop.add_reader(fd, ready, fd)
+    return future
+
+
+class AsyncAdbConnection(object):
+    """
+    A non-blocking connection to the adb server, see adbclient.AdbConnection.
+    """
+
+    def __init__(self, sock):
+        self._sock = sock
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    @classmethod
+    @coroutine
+    def open(cls, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(0)
+        code = sock.connect_ex((host, port))
+        if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sock.close()
+            raise socket.error(code, os.strerror(code))
+        yield _wait_fd(sock.fileno(), True)
+        code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if code != 0:
+            sock.close()
+            raise socket.error(code, os.strerror(code))
+        raise Return(cls(sock))
+
+    @coroutine
+    def send(self, data):
+        view = memoryview(data)
+        while len(view) > 0:
+            try:
+                sent = self._sock.send(view)
+            except socket.error as e:
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                sent = 0
+            self.bytes_sent += sent
+            view = view[sent:]
+            if len(view) > 0:
+                yield _wait_fd(self._sock.fileno(), True)
+
+    @coroutine
+    def recv_some(self, size=SYNC_DATA_MAX):
+        """
+        :return: Future of received data, empty when the connection is closed
+        """
+        while True:
+            try:
+                data = self._sock.recv(size)
+            except socket.error as e:
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+            else:
+                self.bytes_received += len(data)
+                raise Return(data)
+            yield _wait_fd(self._sock.fileno())
+
+    @coroutine
+    def recv(self, size, allow_eof=False):
+        chunks = []
+        while size > 0:
+            data = yield self.recv_some(min(size, SYNC_DATA_MAX))
+            if not data:
+                if allow_eof and not chunks:
+                    raise Return('')
+                raise AdbError('Connection closed by adb server.')
+            chunks.append(data)
+            size -= len(data)
+        raise Return(''.join(chunks))
+
+    @coroutine
+    def recv_all(self):
+        chunks = []
+        while True:
+            data = yield self.recv_some()
+            if not data:
+                raise Return(''.join(chunks))
+            chunks.append(data)
+
+    @coroutine
+    def request(self, service):
+        yield self.send('%04x%s' % (len(service), service))
+        status = yield self.recv(4)
+        if status == 'FAIL':
+            raise AdbError((yield self.recv_string()))
+        if status != 'OKAY':
+            raise AdbError('Unexpected adb status: %r' % status)
+
+    @coroutine
+    def recv_string(self):
+        length = yield self.recv(4)
+        raise Return((yield self.recv(int(length, 16))))
+
+    def close(self):
+        try:
+            self._sock.close()
+        except socket.error:
+            pass
+
+
+class AsyncAdbClient(object):
+    """
+    Non-blocking client of the adb server, see adbclient.AdbClient.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self._host = host
+        self._port = port
+        self._features = {}
+
+    @coroutine
+    def host_request(self, service):
+        conn = yield AsyncAdbConnection.open(self._host, self._port)
+        try:
+            yield conn.request(service)
+            raise Return((yield conn.recv_string()))
+        finally:
+            conn.close()
+
+    @coroutine
+    def devices(self, long_format=False):
+        if long_format:
+            raise Return((yield self.host_request('host:devices-l')))
+        raise Return((yield self.host_request('host:devices')))
+
+    @coroutine
+    def features(self, udid=None):
+        if udid not in self._features:
+            prefix = 'host:' if udid is None else 'host-serial:%s:' % udid
+            reply = yield self.host_request(prefix + 'features')
+            self._features[udid] = set(reply.split(','))
+        raise Return(self._features[udid])
+
+    @coroutine
+    def open_service(self, service, udid=None):
+        conn = yield AsyncAdbConnection.open(self._host, self._port)
+        try:
+            if udid is None:
+                yield conn.request('host:transport-any')
+            else:
+                yield conn.request('host:transport:%s' % udid)
+            yield conn.request(service)
+        except:
+            conn.close()
+            raise
+        raise Return(conn)
+
+    @coroutine
+    def shell(self, cmd, udid=None):
+        features = yield self.features(udid)
+        if 'shell_v2' not in features:
+            conn = yield self.open_service('shell:%s' % cmd, udid)
+            try:
+                raise Return((0, (yield conn.recv_all())))
+            finally:
+                conn.close()
+
+        conn = yield self.open_service('shell,v2,raw:%s' % cmd, udid)
+        stdout, stderr = [], []
+        returncode = 0
+        try:
+            while True:
+                header = yield conn.recv(5, allow_eof=True)
+                if not header:
+                    break
+                packet_id, length = struct.unpack('<BI', header)
+                data = yield conn.recv(length)
+                if packet_id == SHELL_ID_STDOUT:
+                    stdout.append(data)
+                elif packet_id == SHELL_ID_STDERR:
+                    stderr.append(data)
+                elif packet_id == SHELL_ID_EXIT:
+                    returncode = ord(data[0])
+                    break
+        finally:
+            conn.close()
+        if returncode != 0:
+            raise Return((returncode, ''.join(stderr)))
+        raise Return((0, ''.join(stdout)))
+
+    @coroutine
+    def exec_out(self, cmd, udid=None):
+        conn = yield self.open_service('exec:%s' % cmd, udid)
+        try:
+            raise Return((yield conn.recv_all()))
+        finally:
+            conn.close()
+
+    @coroutine
+    def pull(self, src, dest, udid=None):
+        """
+        Pull a file from target to host.
+        :return: Future of bytes count transferred
+        """
+        conn = yield self.open_service('sync:', udid)
+        size = 0
+        # dest is created at the first response, a failed pull like a directory leaves no file.
+        f = None
+        try:
+            yield conn.send('RECV' + struct.pack('<I', len(src)) + src)
+            while True:
+                header = yield conn.recv(8)
+                request_id, length = header[:4], struct.unpack('<I', header[4:])[0]
+                if request_id in ('DATA', 'DONE') and f is None:
+                    f = open(dest, 'wb')
+                if request_id == 'DATA':
+                    f.write((yield conn.recv(length)))
+                    size += length
+                elif request_id == 'DONE':
+                    break
+                elif request_id == 'FAIL':
+                    raise AdbError((yield conn.recv(length)))
+                else:
+                    raise AdbError('Unexpected sync response: %r' % request_id)
+        except BaseException:
+            if f is not None:
+                f.close()
+                os.remove(dest)
+                f = None
+            raise
+        finally:
+            if f is not None:
+                f.close()
+            conn.close()
+        raise Return(size)
+
+    @coroutine
+    def push(self, src, dest, udid=None):
+        """
+        Push a file from host to target.
+        :return: Future of bytes count transferred
+        """
+        st = os.stat(src)
+        target = '%s,%d' % (dest, stat.S_IFREG | stat.S_IMODE(st.st_mode))
+        conn = yield self.open_service('sync:', udid)
+        size = 0
+        try:
+            yield conn.send('SEND' + struct.pack('<I', len(target)) + target)
+            with open(src, 'rb') as f:
+                while True:
+                    data = f.read(SYNC_DATA_MAX)
+                    if not data:
+                        break
+                    yield conn.send('DATA' + struct.pack('<I', len(data)) + data)
+                    size += len(data)
+            yield conn.send('DONE' + struct.pack('<I', int(st.st_mtime)))
+            header = yield conn.recv(8)
+            if header[:4] == 'FAIL':
+                raise AdbError((yield conn.recv(struct.unpack('<I', header[4:])[0])))
+            if header[:4] != 'OKAY':
+                raise AdbError('Unexpected sync response: %r' % header[:4])
+        finally:
+            conn.close()
+        raise Return(size)
+
+
+_native_client = AsyncAdbClient()
+_native_client_retry_at = [0.0]
+
+
+@coroutine
+def _exec_native(name, *args):
+    """
+    Private coroutine to run a request with the native adb client.
+    :return: Future of tuple of True and the request result, or False and None when the adb
+    server is not reachable
+    """
+    if time.time() < _native_client_retry_at[0]:
+        raise Return((False, None))
+    try:
+        result = yield getattr(_native_client, name)(*args)
+    except socket.error:
+        _native_client_retry_at[0] = time.time() + NATIVE_CLIENT_RETRY_INTERVAL
+        raise Return((False, None))
+    raise Return((True, result))
+
+
+@coroutine
+def _exec_command(adb_cmd):
+    """
+    Private coroutine to execute the adb binary with non-blocking pipes, like
+    adb._exec_command()
+    :param adb_cmd: list adb command to execute
+    :return: Future of tuple of return code and output, output is stderr on failure
+    """
+    process = Popen([e for e in adb_cmd if e != ''], stdout=PIPE, stderr=PIPE)
+    outputs = {}
+    for pipe in (process.stdout, process.stderr):
+        flags = fcntl.fcntl(pipe.fileno(), fcntl.F_GETFL)
+        fcntl.fcntl(pipe.fileno(), fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        outputs[pipe] = []
+
+    try:
+        pending = list(outputs.keys())
+        while pending:
+            yield _wait_any_readable([pipe.fileno() for pipe in pending])
+            for pipe in list(pending):
+                try:
+                    data = os.read(pipe.fileno(), SYNC_DATA_MAX)
+                except OSError as e:
+                    if e.errno != errno.EAGAIN:
+                        raise
+                    continue
+                if data:
+                    outputs[pipe].append(data)
+                else:
+                    pending.remove(pipe)
+    finally:
+        process.stdout.close()
+        process.stderr.close()
+
+    returncode = process.wait()
+    if returncode != 0:
+        raise Return((returncode, ''.join(outputs[process.stderr])))
+    raise Return((0, ''.join(outputs[process.stdout])))
+
+
+@coroutine
+def shell(cmd, udid=None):
+    """
+    Coroutine version of adb.shell()
+    """
+    try:
+        native, result = yield _exec_native('shell', cmd, udid)
+    except AdbError as e:
+        raise Return((1, str(e)))
+    if native:
+        raise Return(result)
+
+    adb_full_cmd = [adb.Cmd.ADB_COMMAND_PREFIX, adb.Cmd.ADB_COMMAND_SHELL, cmd]
+    raise Return((yield _exec_command(adb._with_udid(adb_full_cmd, udid))))
+
+
+@coroutine
+def shell_batch(cmds, udid=None):
+    """
+    Coroutine version of adb.shell_batch()
+    """
+    if len(cmds) == 0:
+        raise Return([])
+    if len(cmds) == 1:
+        raise Return([(yield shell(cmds[0], udid))])
+
+    script, sentinel = adb._batch_script(cmds)
+    result = yield shell(script, udid)
+    raise Return(adb._batch_results(result, sentinel, cmds))
+
+
+@coroutine
+def exec_out(cmd, udid=None):
+    """
+    Coroutine version of adb.exec_out()
+    """
+    try:
+        native, result = yield _exec_native('exec_out', cmd, udid)
+    except AdbError as e:
+        raise Return((1, str(e)))
+    if native:
+        raise Return((0, result))
+
+    adb_full_cmd = [adb.Cmd.ADB_COMMAND_PREFIX, adb.Cmd.ADB_COMMAND_EXEC_OUT, cmd]
+    raise Return((yield _exec_command(adb._with_udid(adb_full_cmd, udid))))
+
+
+@coroutine
+def devices(opts=[]):
+    """
+    Coroutine version of adb.devices()
+    """
+    if opts in ([], ['-l']):
+        try:
+            native, result = yield _exec_native('devices', opts == ['-l'])
+        except AdbError as e:
+            raise Return((1, str(e)))
+        if native:
+            raise Return((0, 'List of devices attached\n%s\n' % result))
+
+    adb_full_cmd = [adb.Cmd.ADB_COMMAND_PREFIX, adb.Cmd.ADB_COMMAND_DEVICES] + list(opts)
+    raise Return((yield _exec_command(adb_full_cmd)))
+
+
+@coroutine
+def pull(src, dest, udid=None):
+    """
+    Coroutine version of adb.pull(), directories are pulled by the adb binary
+    """
+    if os.path.isdir(dest):
+        dest = os.path.join(dest, os.path.basename(src.rstrip('/')))
+    start = time.time()
+    try:
+        native, result = yield _exec_native('pull', src, dest, udid)
+    except (AdbError, IOError, OSError):
+        # Let the adb binary pull directories and report errors.
+        native, result = False, None
+    if native:
+        raise Return((0, adb._transfer_summary(src, 'pulled', (1, result), time.time() - start)))
+
+    adb_full_cmd = [adb.Cmd.ADB_COMMAND_PREFIX, adb.Cmd.ADB_COMMAND_PULL, src, dest]
+    raise Return((yield _exec_command(adb._with_udid(adb_full_cmd, udid))))
+
+
+@coroutine
+def push(src, dest, udid=None):
+    """
+    Coroutine version of adb.push(), directories are pushed by the adb binary
+    """
+    if os.path.isdir(src):
+        adb_full_cmd = [adb.Cmd.ADB_COMMAND_PREFIX, adb.Cmd.ADB_COMMAND_PUSH, src, dest]
+        raise Return((yield _exec_command(adb._with_udid(adb_full_cmd, udid))))
+
+    start = time.time()
+    try:
+        native, result = yield _exec_native('push', src, dest, udid)
+    except (AdbError, IOError, OSError) as e:
+        raise Return((1, 'adb: error: %s\n' % e))
+    if native:
+        raise Return((0, adb._transfer_summary(src, 'pushed', (1, result), time.time() - start)))
+
+    adb_full_cmd = [adb.Cmd.ADB_COMMAND_PREFIX, adb.Cmd.ADB_COMMAND_PUSH, src, dest]
+    raise Return((yield _exec_command(adb._with_udid(adb_full_cmd, udid))))
+
+
+class AsyncDevice(object):
+    """
+    Coroutine wrapper of Device.
+
+    The WebDriver requests can only block, they run in the shared thread pool of the event loop,
+    while the auto wait after actions and all the adb commands are non-blocking.
+    """
+
+    def __init__(self, device):
+        self._device = device
+
+    @property
+    def device(self):
+        return self._device
+
+    @property
+    def udid(self):
+        return self._device._udid
+
+    @coroutine
+    def _action(self, name, *args):
+        yield run_in_executor(self._device._call_without_auto_wait, name, *args)
+        if self._device._idle_time is None:
+            yield sleep(self._device._wait_time)
+        else:
+            yield self._wait_for_idle(self._device._wait_time, self._device._idle_time)
+        raise Return(self)
+
+    @coroutine
+    def _wait_for_idle(self, timeout, idle_time):
+        """
+        Coroutine version of Device._wait_for_idle()
+        """
+        deadline = time.time() + timeout
+        count = _parse_page_flip_count((yield shell(PAGE_FLIP_COUNT_COMMAND, self.udid))[1])
+        if count is None:
+            yield sleep(timeout)
+            raise Return(False)
+
+        changed_at = time.time()
+        while True:
+            now = time.time()
+            if now - changed_at >= idle_time:
+                raise Return(True)
+            if now >= deadline:
+                raise Return(False)
+            yield sleep(min(IDLE_POLL_INTERVAL, deadline - now))
+            new_count = _parse_page_flip_count((yield shell(PAGE_FLIP_COUNT_COMMAND,
+                                                            self.udid))[1])
+            if new_count != count:
+                count = new_count
+                changed_at = time.time()
+
+    def wait(self, ms):
+        return sleep(ms / 1000.0)
+
+    def press_power(self):
+        return self._action('press_power')
+
+    def press_menu(self):
+        return self._action('press_menu')
+
+    def press_back(self):
+        return self._action('press_back')
+
+    def press_home(self):
+        return self._action('press_home')
+
+    def press_search(self):
+        return self._action('press_search')
+
+    def press_enter(self):
+        return self._action('press_enter')
+
+    def press_delete(self):
+        return self._action('press_delete')
+
+    def press_keycode(self, keycode, metastate=None):
+        return self._action('press_keycode', keycode, metastate)
+
+    def open_notification(self):
+        return self._action('open_notification')
+
+    def click(self, x_coord, y_coord):
+        return self._action('click', x_coord, y_coord)
+
+    def long_click(self, x_coord, y_coord):
+        return self._action('long_click', x_coord, y_coord)
+
+    def swipe(self, start_x, start_y, end_x, end_y, duration=None, speed=1000):
+        return self._action('swipe', start_x, start_y, end_x, end_y, duration, speed)
+
+    def drag(self, start_x, start_y, end_x, end_y, duration=None, speed=1000):
+        return self._action('drag', start_x, start_y, end_x, end_y, duration, speed)
+
+    def find_element(self, by_selector, parent=None):
+        return run_in_executor(self._device.find_element, by_selector, parent)
+
+    def find_elements(self, by_selector, parent=None):
+        return run_in_executor(self._device.find_elements, by_selector, parent)
+
+    def take_screen_shot(self, filename=None):
+        return run_in_executor(self._device.take_screen_shot, filename)
+
+    @coroutine
+    def screenshot(self, filename=None):
+        result = yield exec_out(SCREENCAP_COMMAND, self.udid)
+        if result[0] != 0:
+            raise Exception('Failed to take screenshot: %s' % result[1])
+        image = parse_screencap(result[1])
+        if filename is not None:
+            yield run_in_executor(write_png, filename, image)
+        raise Return(image)
+
+    @coroutine
+    def adb_command(self, cmd):
+        result = yield shell(cmd, self.udid)
+        raise Return(result[1])
+
+    @coroutine
+    def current_activity_name(self):
+        activity_name = self._device.focus_tracker.peek()
+        if activity_name is not None:
+            raise Return(activity_name)
+        output = yield self.adb_command('dumpsys window windows')
+        raise Return(_parse_activity_name(output))
+
+    @coroutine
+    def current_package_name(self):
+        activity_name = yield self.current_activity_name()
+        raise Return(activity_name.split('/')[0])
+
+    @coroutine
+    def start_profiling(self, *metrics):
+        """
+        Coroutine version of Device.start_profiling()
+        """
+        device = self._device
+        if device._is_profiling:
+            return
+
+        test_package = None
+        if device._needs_test_package(metrics):
+            test_package = yield self.current_package_name()
+            if device.jump_package is not None:
+                test_package = device.jump_package
+
+        device._create_profilings(metrics, test_package)
+        yield self._trace_batch(True)
+        device._is_profiling = True
+
+    @coroutine
+    def pause_profiling(self):
+        """
+        Coroutine version of Device.pause_profiling()
+        """
+        if not self._device._is_profiling:
+            return
+
+        yield self._trace_batch(False)
+        self._device._is_profiling = False
+
+    @coroutine
+    def end_profiling(self):
+        """
+        Coroutine version of Device.end_profiling()
+        """
+        device = self._device
+        metrics = Metrics(device)
+        if device._is_profiling:
+            yield self._trace_batch(False)
+        for profiling in device._profiling.values():
+            if profiling is not None:
+                profiling.dump_to_metrics(metrics)
+        device._is_profiling = False
+        raise Return(metrics)
+
+    @coroutine
+    def _trace_batch(self, begin):
+        profilings, commands = self._device._trace_commands(begin)
+        results = yield shell_batch(sum(commands, []), self.udid)
+        # Profilings may stream or join threads when tracing ends.
+        yield run_in_executor(self._device._trace_dispatch, begin, profilings, commands, results)
+
@@ -10,29 +10,75 @@ TODO: assert with metrics.
 """
 
 import math
+import re
+import sys
+import threading
 import time
 from collections import OrderedDict
 
 from appium import webdriver
 from appium.webdriver.common.touch_action import TouchAction
 from cached_property import cached_property
+from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException
 
-from casium import adb
+from casium import adb, trace
+from casium.deviceinfo import DeviceProfile, parse_wm_size, parse_wm_density
+from casium.focus import FocusTracker
+from casium.framestats import FrameStatsInfo
+from casium.gesture import GestureResult, trajectory
 from casium.gfxinfo import GfxInfo2, GfxInfo
+from casium.hierarchy import Hierarchy, node_attributes
+from casium.input import SendEventInput, LONG_PRESS_TIME
 from casium.responseinfo import ResponseInfo
+from casium.screencap import ScreenCapture, DEFAULT_CAPTURE_FRAMES, screenshot, write_png
+from casium.visualinfo import VisualInfo
+
+
+class _ui_property(object):
+    """
+    A cached property of Element which is only valid in the UI generation it was read in.
+    The element is revalidated when it is read in a newer generation.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+        self.__name__ = func.__name__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        obj._check_generation()
+        if self.__name__ not in obj._cache:
+            obj._cache[self.__name__] = self.func(obj)
+        return obj._cache[self.__name__]
 
 
 class Element(object):
     """
     Represents a UI element.
-    Try to obtain a new element if the UI changed significantly.
+
+    The attributes are cached until the next action of the device, which starts a new UI
+    generation. An element read in a newer generation is revalidated against the page source
+    snapshot of that generation if there is one: when it is still at the same bounds, the
+    cached attributes are kept, otherwise they are read again. Use Device.revalidate() to
+    revalidate many elements with one page source.
     """
 
-    def __init__(self, element, device):
+    # The cached properties which find_elements() can prefetch.
+    PREFETCH_ATTRIBUTES = ('text', 'location', 'size', 'center', 'description')
+
+    def __init__(self, element, device, node=None, snapshot=None):
         self._element = element
         self._device = device
-
-    @cached_property
+        self._node = node
+        self._snapshot = snapshot
+        self._cache = {}
+        self._generation = device.generation
+        if node is not None:
+            self._prefetch_node(node)
+
+    @_ui_property
     def text(self):
         """
         Returns the text value of this element.
@@ -41,7 +87,7 @@ class Element(object):
         """
         return self._element.text
 
-    @cached_property
+    @_ui_property
     def location(self):
         """
         Returns the left-top position of this element in current window.
@@ -50,7 +96,7 @@ class Element(object):
         """
         return self._element.location['x'], self._element.location['y']
 
-    @cached_property
+    @_ui_property
     def size(self):
         """
         Returns the with and height of this element.
@@ -59,7 +105,7 @@ class Element(object):
         """
         return self._element.size['width'], self._element.size['height']
 
-    @cached_property
+    @_ui_property
     def center(self):
         """
         Returns the center position of this element in current window.
@@ -68,7 +114,7 @@ class Element(object):
         """
         return self.location[0] + 0.5 * self.size[0], self.location[1] + 0.5 * self.size[1]
 
-    @cached_property
+    @_ui_property
     def description(self):
         """
         Returns the content description of this element.
@@ -89,7 +135,7 @@ class Element(object):
         """
         self._device.long_click(self.center[0], self.center[1])
 
-    def drag(self, end_x, end_y, duration=None, speed=1000):
+    def drag(self, end_x, end_y, duration=None, speed=1000, profile='linear'):
         """
         Drag the element to position(x, y). The start point is the center of this element.
         The 'drag' operation will do long-click then move to the target position.
@@ -109,10 +155,11 @@ class Element(object):
         :param end_y: The end y position in current window.
         :param duration: The duration for the dragging in millisecond.
         :param speed: The speed of dragging in pixels/second, ignored when duration is not None.
+        :param profile: The velocity profile, see Device.swipe().
         """
-        self._device.drag(self.center[0], self.center[1], end_x, end_y, duration, speed)
+        self._device.drag(self.center[0], self.center[1], end_x, end_y, duration, speed, profile)
 
-    def drag_to(self, element, duration=None, speed=1000):
+    def drag_to(self, element, duration=None, speed=1000, profile='linear'):
         """
         Drag the element to another element center position. The start point is the center of 
         this element.
@@ -124,10 +171,11 @@ class Element(object):
         :param element: The dragging target element.
         :param duration: The duration for the dragging in millisecond.
         :param speed: The speed of dragging in pixels/second, ignored when duration is not None.
+        :param profile: The velocity profile, see Device.swipe().
         """
-        self.drag(element.center[0], element.center[1], duration, speed)
+        self.drag(element.center[0], element.center[1], duration, speed, profile)
 
-    def swipe(self, end_x, end_y, duration=None, speed=1000):
+    def swipe(self, end_x, end_y, duration=None, speed=1000, profile='linear'):
         """
         Swipe from the center of this element to position(x, y).
 
@@ -146,10 +194,11 @@ class Element(object):
         :param end_y: The end y position in current window.
         :param duration: The duration for the swiping in millisecond.
         :param speed: The speed of swiping in pixels/second, ignored when duration is not None.
+        :param profile: The velocity profile, see Device.swipe().
         """
-        self._device.swipe(self.center[0], self.center[1], end_x, end_y, duration, speed)
+        self._device.swipe(self.center[0], self.center[1], end_x, end_y, duration, speed, profile)
 
-    def swipe_to(self, element, duration=None, speed=1000):
+    def swipe_to(self, element, duration=None, speed=1000, profile='linear'):
         """
         Swipe from the center of this element to another element's center.
 
@@ -159,8 +208,9 @@ class Element(object):
         :param element: The swiping target element.
         :param duration: The duration for the swiping in millisecond.
         :param speed: The speed of swiping in pixels/second, ignored when duration is not None.
+        :param profile: The velocity profile, see Device.swipe().
         """
-        self.swipe(element.center[0], element.center[1], duration, speed)
+        self.swipe(element.center[0], element.center[1], duration, speed, profile)
 
     def find_element(self, by_selector):
         """
@@ -171,21 +221,90 @@ class Element(object):
         """
         return self._device.find_element(by_selector, self)
 
-    def find_elements(self, by_selector):
+    def find_elements(self, by_selector, attributes=None):
         """
         Find and return all the  elements under this element.
         
         :param by_selector: By selector, see class By.
+        :param attributes: Attributes to prefetch, see Device.find_elements().
         :return: Children elements list. Return empty list if not found.
         """
-        return self._device.find_elements(by_selector, self)
+        return self._device.find_elements(by_selector, self, attributes)
+
+    def _prefetch(self, node, attributes):
+        """
+        Fill the cached properties from a hierarchy node.
+        """
+        values = node_attributes(node)
+        for name in attributes:
+            if name == 'center':
+                self._cache.setdefault('location', values['location'])
+                self._cache.setdefault('size', values['size'])
+            elif name in values:
+                self._cache[name] = values[name]
+
+    def _prefetch_node(self, node):
+        self._prefetch(node, self.PREFETCH_ATTRIBUTES)
+        self._cache.setdefault('description', node.get('content-desc', ''))
+
+    def _check_generation(self):
+        """
+        Revalidate the cached properties if the UI changed since they were read.
+        """
+        generation = self._device.generation
+        if self._generation == generation:
+            return
+        snapshot = self._device._snapshot
+        if snapshot is None and self._element is None:
+            snapshot = self._device.snapshot
+        if snapshot is None or not self._revalidate(snapshot):
+            if self._element is None:
+                raise StaleElementReferenceException('The snapshot element is not found in '
+                                                     'the current UI.')
+            self._cache = {}
+        self._generation = generation
+
+    def _revalidate(self, snapshot):
+        """
+        Find this element in a newer snapshot by its bounds.
+
+        :param snapshot: Hierarchy of the current UI generation.
+        :return: True if this element is still there, the cache is valid then.
+        """
+        if not self._cache and self._node is None:
+            return True
+        if 'location' not in self._cache or 'size' not in self._cache:
+            return False
+        nodes = snapshot.find_by_bounds(self._cache['location'], self._cache['size'])
+        if self._node is not None:
+            # A snapshot element keeps its class and resource id, other attributes are
+            # read from the new node.
+            nodes = [n for n in nodes if n.get('class') == self._node.get('class') and
+                     n.get('resource-id') == self._node.get('resource-id')]
+            if not nodes:
+                return False
+            self._node = nodes[0]
+            self._snapshot = snapshot
+            self._cache = {}
+            self._prefetch_node(self._node)
+            return True
+        # An appium element matches nodes by bounds only, so only the attributes which are
+        # compared can be kept.
+        if 'text' in self._cache:
+            nodes = [n for n in nodes if n.get('text', '') == self._cache['text']]
+        if not nodes:
+            return False
+        for name in list(self._cache):
+            if name not in ('location', 'size', 'center', 'text'):
+                del self._cache[name]
+        return True
 
     @property
     def appium_element(self):
         """
         Return the wrapped appium element.
         
-        :return: Appium Element
+        :return: Appium Element. None if this element is found in a snapshot.
         """
         return self._element
 
@@ -452,6 +571,45 @@ class By(object):
         return uiautomator_value
 
 
+class _Background(object):
+    """
+    Run a function in a background thread, the result is waited when it is taken.
+    """
+
+    def __init__(self, func, *args):
+        self._result = None
+        self._exc_info = None
+        self._thread = threading.Thread(target=self._run, args=(func, args))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, func, args):
+        try:
+            self._result = func(*args)
+        except Exception:
+            self._exc_info = sys.exc_info()
+
+    def join(self):
+        self._thread.join()
+
+    def result(self):
+        self.join()
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
+# The SurfaceFlinger transaction which returns the count of composited frames.
+PAGE_FLIP_COUNT_COMMAND = 'service call SurfaceFlinger 1013'
+IDLE_POLL_INTERVAL = 0.1
+
+# The reply is the count only, without a status word.
+_PARCEL_PATTERN = re.compile(r'Parcel\(\s*([0-9a-fA-F]{8})\b')
+
+# Actions called through Device._call_without_auto_wait() skip the wait in that thread.
+_auto_wait_suppressed = threading.local()
+
+
 def _cmd_list_devices():
     return adb.devices(['-l'])[1].split('\n')[1:]
 
@@ -460,10 +618,17 @@ def _cmd_get_prop(name, udid):
     return adb.shell('getprop %s' % name, udid)[1]
 
 
-def _extract_string(string, start_string, end_string='\n'):
-    s = string.index(start_string)
-    e = string.index(end_string, s)
-    return string[s + len(start_string): e].strip()
+def _parse_page_flip_count(output):
+    """
+    Parse the reply of PAGE_FLIP_COUNT_COMMAND.
+
+    :param output: like "Result: Parcel(0000a1b2    '....')"
+    :return: the frame count, None if the transaction is not supported.
+    """
+    match = _PARCEL_PATTERN.search(output)
+    if match is None:
+        return None
+    return int(match.group(1), 16)
 
 
 class Device(object):
@@ -473,13 +638,16 @@ class Device(object):
     such as pressing the d-pad or pressing the Home and Menu buttons.
     """
 
+    @trace.traced('device')
     def __init__(self, device=None, apk=None, package=None, activity=None, auto_reset=False,
                  auto_wait=3000, wifi_mode=False, remote='http://localhost:4723/wd/hub',
-                 jump_package=None):
+                 jump_package=None, capabilities=None, lazy=False, snapshot_mode=False,
+                 idle_wait=None, input_backend='appium', gfx_streaming=False,
+                 gfx_snapshot_interval=None):
         """
         Create a device object which connected with a physics device.
         
-        :param device: Could be prodcut name, model name, device name. 
+        :param device: Could be serial number, prodcut name, model name, device name. 
         Fuzzy much with any key word.
         :param apk: APK file which will be installed at the very beginning.
         :param package: Test target package name.
@@ -487,16 +655,32 @@ class Device(object):
         :param auto_reset: Auto reset the package before testing.
         :param auto_wait: Auto wait between operations, millisecond time.
         :param remote: Remove appium server address.
+        :param capabilities: Extra appium desired capabilities, like 'systemPort'.
+        :param lazy: Return before the appium session and the device profile are ready, they
+        are waited on first use and their errors are raised there.
+        :param snapshot_mode: Find elements in a snapshot of the page source, see
+        set_snapshot_mode().
+        :param idle_wait: Finish the auto wait once no frame is drawn for this millisecond time
+        after the action drew a frame, auto_wait is still the longest wait. None to always wait
+        for auto_wait.
+        :param input_backend: 'appium' to click and swipe with appium, 'sendevent' to inject the
+        touch events over adb with precise timing, see casium.input.
+        :param gfx_streaming: Keep the 'gfx' frames of Android before M in fixed memory sketches
+        instead of lists, for profiling hours long, see casium.gfxinfo.GfxData2.
+        :param gfx_snapshot_interval: Summarize the 'gfx' frames of Android before M every this
+        second time while profiling, None for no snapshot.
         """
         self._udid = None
         if device is not None:
+            devices = _cmd_list_devices()
+            target_device = [d.split(' ')[0] for d in devices if d.split(' ')[0] == device]
+
             device = device.replace('_', ' ')
             device = device.replace('-', ' ')
             model_words = [word.lower() for word in device.split(' ')]
-
-            devices = _cmd_list_devices()
-            target_device = [d.split(' ')[0] for d in devices if
-                             self._device_word_match(model_words, d)]
+            if len(target_device) < 1:
+                target_device = [d.split(' ')[0] for d in devices if
+                                 self._device_word_match(model_words, d)]
             if len(target_device) < 1:
                 raise Exception('Can not find suitable device.')
             self._udid = target_device[0]
@@ -506,20 +690,84 @@ class Device(object):
 
         if apk is None and package is None:
             raise Exception('Must specified either "apk_path" or "target_package"')
+        if input_backend not in ('appium', 'sendevent'):
+            raise Exception('Unknown input backend "%s"' % input_backend)
 
         if package is not None and activity is not None:
             if activity not in package and activity[0] != '.':
                 activity = '.%s' % activity
 
-        self._driver = self._create_driver(apk, package, activity, auto_reset,
-                                           remote)
-        self._display_size = self._cmd_wm_size()
-        self._display_density = self._cmd_wm_density()
-        self._density_scale = self._display_density / 160.0
+        self._package = package
+        self._activity = activity
+
+        # The appium session creation is the slowest step, overlap it with the adb queries.
+        self._pending_driver = _Background(self._create_driver, apk, package, activity,
+                                           auto_reset, remote, capabilities)
+        self._pending_profile = _Background(DeviceProfile.load, self._udid)
         self._wait_time = auto_wait / 1000.0
-        self._profiling = dict.fromkeys(['gfx', 'input', 'cpu', 'memory', 'response'], None)
+        self._idle_time = None if idle_wait is None else idle_wait / 1000.0
+        self._profiling = dict.fromkeys(['gfx', 'input', 'cpu', 'memory', 'response', 'visual',
+                                         'framestats'], None)
         self._is_profiling = False
+        self._gfx_streaming = gfx_streaming
+        self._gfx_snapshot_interval = gfx_snapshot_interval
         self.jump_package = jump_package
+        self._snapshot_mode = snapshot_mode
+        self._snapshot = None
+        self._input_backend_name = input_backend
+        self._input = None
+        self.last_gesture = None
+        self._screen_capture = None
+        self._focus_tracker = None
+        self._generation = 0
+
+        if not lazy:
+            self.wait_ready()
+
+    def wait_ready(self):
+        """
+        Wait until the appium session and the device profile are ready.
+        Raise the error of creating them if any.
+        """
+        self._pending_driver.join()
+        self._pending_profile.join()
+        return self._driver is not None and self._device_profile is not None
+
+    @property
+    def _driver(self):
+        driver = self.__dict__.get('_driver_instance')
+        if driver is None:
+            driver = self._pending_driver.result()
+            self._driver_instance = driver
+        return driver
+
+    @_driver.setter
+    def _driver(self, driver):
+        self._driver_instance = driver
+
+    @property
+    def _device_profile(self):
+        profile = self.__dict__.get('_device_profile_instance')
+        if profile is None:
+            profile = self._pending_profile.result()
+            self._device_profile_instance = profile
+        return profile
+
+    @_device_profile.setter
+    def _device_profile(self, profile):
+        self._device_profile_instance = profile
+
+    @property
+    def _display_size(self):
+        return self._device_profile.display_size
+
+    @property
+    def _display_density(self):
+        return self._device_profile.display_density
+
+    @property
+    def _density_scale(self):
+        return self._device_profile.display_density / 160.0
 
     def _connect_with_wifi(self):
         interface = adb.shell('ifconfig wlan0', self._udid)[1]
@@ -551,7 +799,7 @@ class Device(object):
         if not found:
             raise Exception('Failed to connect device though wifi.')
 
-    def _create_driver(self, apk, package, activity, auto_reset, remote):
+    def _create_driver(self, apk, package, activity, auto_reset, remote, capabilities=None):
         desired_caps = {
             'platformName': 'Android',
             'deviceName': 'IGNORED',
@@ -572,14 +820,35 @@ class Device(object):
 
         desired_caps['noReset'] = not auto_reset
 
-        return webdriver.Remote(remote, desired_caps)
+        if capabilities is not None:
+            desired_caps.update(capabilities)
+
+        return trace.instrument_webdriver(webdriver.Remote(remote, desired_caps))
 
     def disconnect(self):
         """
         Close the connection with the device.
         """
+        if self._input is not None:
+            self._input.close()
+            self._input = None
+        if self._screen_capture is not None:
+            self._screen_capture.stop()
+        if self._focus_tracker is not None:
+            self._focus_tracker.stop()
         self._driver.quit()
 
+    @property
+    def input_backend(self):
+        """
+        The adb input backend, which reports the injection latency with stats().
+
+        :return: SendEventInput. None if the input backend is 'appium'.
+        """
+        if self._input is None and self._input_backend_name == 'sendevent':
+            self._input = SendEventInput(self._udid, self._display_size)
+        return self._input
+
     @cached_property
     def display_size_dp(self):
         """
@@ -605,7 +874,7 @@ class Device(object):
         """
         return self._display_size
 
-    @cached_property
+    @property
     def product_name(self):
         """
         Retrieves the product name of the device.
@@ -615,9 +884,9 @@ class Device(object):
         
         :return: product name of the device
         """
-        return _cmd_get_prop('ro.product.name', self._udid)
+        return self._device_profile.product_name
 
-    @cached_property
+    @property
     def product_model(self):
         """
         Retrieves the model name of the device.
@@ -627,9 +896,9 @@ class Device(object):
         
         :return: model name of the device
         """
-        return _cmd_get_prop('ro.product.model', self._udid)
+        return self._device_profile.product_model
 
-    @cached_property
+    @property
     def android_version(self):
         """
         Retrieves the android version number of the device.
@@ -639,7 +908,7 @@ class Device(object):
         
         :return: android version number of the device.
         """
-        return int(_cmd_get_prop('ro.build.version.sdk', self._udid))
+        return self._device_profile.android_version
 
     @property
     def current_package_name(self):
@@ -652,129 +921,194 @@ class Device(object):
         return activity_name.split('/')[0]
 
     @property
+    @trace.traced('device')
     def current_activity_name(self):
         """
         Retrieves the current activity name.
+        The focus is followed in background by focus_tracker, so it does not query the device.
         
         :return: activity name
         """
-        output = self.adb_command('dumpsys window windows')
-        win_info = _extract_string(output, 'mFocusedApp')
-        activity_info = _extract_string(win_info, 'ActivityRecord', '}')
-        component = activity_info.split(' ')[2]
-        return component
+        return self.focus_tracker.current
+
+    @property
+    def focus_tracker(self):
+        """
+        The tracker of the focused activity, which keeps the history of the focus changes.
+        It is started at the first use, and not started again once the event log turns out to
+        be unavailable on the device.
 
+        :return: casium.focus.FocusTracker
+        """
+        if self._focus_tracker is None:
+            self._focus_tracker = FocusTracker(self._udid)
+        if not self._focus_tracker.alive and self._focus_tracker.available:
+            self._focus_tracker.start()
+        return self._focus_tracker
+
+    @trace.traced('device')
     def reset(self):
         """
         Reset the current application
         """
         self._driver.reset()
-        time.sleep(self._wait_time)
+        self._auto_wait()
+
+    @trace.traced('device')
+    def restart_app(self, clear_data=False):
+        """
+        Restart the test target package through adb, which is much cheaper than a new appium
+        session or reset().
+
+        :param clear_data: Clear the package data before starting it again.
+        """
+        if self._package is None:
+            raise Exception('Can not restart app without "target_package"')
+
+        cmds = ['am force-stop %s' % self._package]
+        if clear_data:
+            cmds.append('pm clear %s' % self._package)
+        if self._activity is not None:
+            cmds.append('am start -W -n %s/%s' % (self._package, self._activity))
+        else:
+            cmds.append('monkey -p %s -c android.intent.category.LAUNCHER 1' % self._package)
+
+        for cmd, (returncode, output) in zip(cmds, adb.shell_batch(cmds, self._udid)):
+            if returncode != 0:
+                raise Exception('Failed to restart app, "%s": %s' % (cmd, output.strip()))
+        self._auto_wait()
 
     def wait(self, ms):
         """
-        Wait for a time.
+        Wait for a time. The UI may change meanwhile, so it starts a new UI generation like
+        invalidate_snapshot().
         
         :param ms: millisecond.
         """
         time.sleep(ms / 1000.0)
+        self.invalidate_snapshot()
 
+    @trace.traced('device')
     def press_power(self):
         """
         Simulates a short press on the POWER button.
         """
+        self._mark_input()
         self._driver.press_keycode(26)
-        time.sleep(self._wait_time)
+        self._auto_wait()
         return self
 
+    @trace.traced('device')
     def press_menu(self):
         """
         Simulates a short press on the MENU button.
         """
+        self._mark_input()
         self._driver.press_keycode(82)
-        time.sleep(self._wait_time)
+        self._auto_wait()
         return self
 
+    @trace.traced('device')
     def press_back(self):
         """
         Simulates a short press on the BACK button.
         """
+        self._mark_input()
         self._driver.press_keycode(4)
-        time.sleep(self._wait_time)
+        self._auto_wait()
         return self
 
+    @trace.traced('device')
     def press_home(self):
         """
         Simulates a short press on the HOME button.
         """
+        self._mark_input()
         self._driver.press_keycode(3)
-        time.sleep(self._wait_time)
+        self._auto_wait()
         return self
 
+    @trace.traced('device')
     def press_search(self):
         """
         Simulates a short press on the SEARCH button.
         """
+        self._mark_input()
         self._driver.press_keycode(84)
-        time.sleep(self._wait_time)
+        self._auto_wait()
         return self
 
+    @trace.traced('device')
     def press_dpad_center(self):
         """
         Simulates a short press on the CENTER button.
         """
+        self._mark_input()
         self._driver.press_keycode(23)
-        time.sleep(self._wait_time)
+        self._auto_wait()
         return self
 
+    @trace.traced('device')
     def press_dpad_down(self):
         """
         Simulates a short press on the DOWN button.
         """
+        self._mark_input()
         self._driver.press_keycode(20)
-        time.sleep(self._wait_time)
+        self._auto_wait()
         return self
 
+    @trace.traced('device')
     def press_dpad_up(self):
         """
         Simulates a short press on the UP button.
         """
+        self._mark_input()
         self._driver.press_keycode(19)
-        time.sleep(self._wait_time)
+        self._auto_wait()
         return self
 
+    @trace.traced('device')
     def press_dpad_left(self):
         """
         Simulates a short press on the LEFT button.
         """
+        self._mark_input()
         self._driver.press_keycode(21)
-        time.sleep(self._wait_time)
+        self._auto_wait()
         return self
 
+    @trace.traced('device')
     def press_dpad_right(self):
         """
         Simulates a short press on the RIGHT button.
         """
+        self._mark_input()
         self._driver.press_keycode(22)
-        time.sleep(self._wait_time)
+        self._auto_wait()
         return self
 
+    @trace.traced('device')
     def press_delete(self):
         """
         Simulates a short press on the DELETE button.
         """
+        self._mark_input()
         self._driver.press_keycode(27)
-        time.sleep(self._wait_time)
+        self._auto_wait()
         return self
 
+    @trace.traced('device')
     def press_enter(self):
         """
         Simulates a short press on the ENTER button.
         """
+        self._mark_input()
         self._driver.press_keycode(66)
-        time.sleep(self._wait_time)
+        self._auto_wait()
         return self
 
+    @trace.traced('device')
     def press_keycode(self, keycode, metastate=None):
         """
         Simulates a short press using a key code.
@@ -782,18 +1116,22 @@ class Device(object):
         :param keycode: the key code of the event. See android KeyEvent.java.
         :param metastate: an integer in which each bit set to 1 represents a pressed meta key.
         """
+        self._mark_input()
         self._driver.press_keycode(keycode, metastate)
-        time.sleep(self._wait_time)
+        self._auto_wait()
         return self
 
+    @trace.traced('device')
     def open_notification(self):
         """
         Opens the notification shade.
         """
+        self._mark_input()
         self._driver.open_notifications()
-        time.sleep(self._wait_time)
+        self._auto_wait()
         return self
 
+    @trace.traced('device')
     def click(self, x_coord, y_coord):
         """
         Perform a click at arbitrary coordinates specified by the user.
@@ -812,11 +1150,17 @@ class Device(object):
         :param x_coord: coordinate
         :param y_coord: coordinate
         """
-        action = TouchAction(self._driver)
-        action.press(None, self._pixel(x_coord, 'x'), self._pixel(y_coord, 'y')).release().perform()
-        time.sleep(self._wait_time)
+        self._mark_input()
+        if self.input_backend is not None:
+            self.input_backend.tap(self._pixel(x_coord, 'x'), self._pixel(y_coord, 'y'))
+        else:
+            action = TouchAction(self._driver)
+            action.press(None, self._pixel(x_coord, 'x'), self._pixel(y_coord, 'y')).release(). \
+                perform()
+        self._auto_wait()
         return self
 
+    @trace.traced('device')
     def long_click(self, x_coord, y_coord):
         """
         Perform a long click at arbitrary coordinates specified by the user.
@@ -835,13 +1179,18 @@ class Device(object):
         :param x_coord: coordinate
         :param y_coord: coordinate
         """
-        action = TouchAction(self._driver)
-        action.long_press(None, self._pixel(x_coord, 'x'), self._pixel(y_coord, 'y')). \
-            release().perform()
-        time.sleep(self._wait_time)
+        self._mark_input()
+        if self.input_backend is not None:
+            self.input_backend.long_press(self._pixel(x_coord, 'x'), self._pixel(y_coord, 'y'))
+        else:
+            action = TouchAction(self._driver)
+            action.long_press(None, self._pixel(x_coord, 'x'), self._pixel(y_coord, 'y')). \
+                release().perform()
+        self._auto_wait()
         return self
 
-    def swipe(self, start_x, start_y, end_x, end_y, duration=None, speed=1000):
+    @trace.traced('device')
+    def swipe(self, start_x, start_y, end_x, end_y, duration=None, speed=1000, profile='linear'):
         """
         Performs a swipe from one coordinate to another using duration or speed to control
         the speed.
@@ -860,12 +1209,18 @@ class Device(object):
         You can specified duration or speed to control the swiping speed. When specified both
         this method will ignore speed argument.
 
+        The profile selects the velocity during the swipe, see casium.gesture. 'linear' swipes at
+        a constant speed, 'ease_out' stops at the end, 'fling' accelerates to the speed at the
+        release. Other profiles than 'linear' are replayed as a timed trajectory, see gesture().
+
         :param start_x: start coordinate
         :param start_y: start coordinate
         :param end_x: end coordinate
         :param end_y: end coordinate
         :param duration: The duration for the swiping in millisecond.
         :param speed: The speed of swiping in pixels/second, ignored when duration is not None.
+        For 'fling' it is the release speed.
+        :param profile: 'linear', 'ease_out' or 'fling'
         """
         start_x_px = self._pixel(start_x, 'x')
         start_y_px = self._pixel(start_y, 'y')
@@ -887,13 +1242,21 @@ class Device(object):
         if dur <= 0:
             raise Exception("Drag with negative duration: %s" % dur)
 
-        steps = round(dur / 16.667)
-        magic_dur = int(round(steps / 7.0 * 250))
-        self._driver.swipe(start_x_px, start_y_px, end_x_px, end_y_px, magic_dur)
-        time.sleep(self._wait_time)
+        if profile == 'fling' and duration is None:
+            dur = None
+        self._mark_input()
+        if self.input_backend is not None or profile != 'linear':
+            self._play(trajectory((start_x_px, start_y_px), (end_x_px, end_y_px), dur, profile,
+                                  speed_px))
+        else:
+            steps = round(dur / 16.667)
+            magic_dur = int(round(steps / 7.0 * 250))
+            self._driver.swipe(start_x_px, start_y_px, end_x_px, end_y_px, magic_dur)
+        self._auto_wait()
         return self
 
-    def drag(self, start_x, start_y, end_x, end_y, duration=None, speed=1000):
+    @trace.traced('device')
+    def drag(self, start_x, start_y, end_x, end_y, duration=None, speed=1000, profile='linear'):
         """
         Performs a drag from one coordinate to another using duration or speed to control
         the speed.
@@ -918,6 +1281,7 @@ class Device(object):
         :param end_y: end coordinate
         :param duration: The duration for the dragging in millisecond.
         :param speed: The speed of dragging in pixels/second, ignored when duration is not None.
+        :param profile: The velocity profile of the move, see swipe().
         """
         start_x_px = self._pixel(start_x, 'x')
         start_y_px = self._pixel(start_y, 'y')
@@ -939,16 +1303,66 @@ class Device(object):
         if dur <= 0:
             raise Exception("Drag with negative duration: %s" % dur)
 
-        action = TouchAction(self._driver)
-        action.long_press(None, start_x_px, start_y_px)
-        frame_time = 16.667
-        steps = dur // frame_time
-        for i in range(int(steps)):
-            action.move_to(None, diff_x / steps, diff_y / steps)
-        action.release().perform()
-        time.sleep(self._wait_time)
+        if profile == 'fling' and duration is None:
+            dur = None
+        self._mark_input()
+        if self.input_backend is not None or profile != 'linear':
+            self._play(trajectory((start_x_px, start_y_px), (end_x_px, end_y_px), dur, profile,
+                                  speed_px, hold=LONG_PRESS_TIME * 1000))
+        else:
+            action = TouchAction(self._driver)
+            action.long_press(None, start_x_px, start_y_px)
+            frame_time = 16.667
+            steps = dur // frame_time
+            for i in range(int(steps)):
+                action.move_to(None, diff_x / steps, diff_y / steps)
+            action.release().perform()
+        self._auto_wait()
         return self
 
+    @trace.traced('device')
+    def gesture(self, gesture_trajectory):
+        """
+        Replay a touch trajectory at its timestamps.
+
+        The achieved duration is measured on host, with the appium backend it includes the
+        WebDriver request, with the sendevent backend the events are injected at their time.
+        Example::
+            from casium.gesture import trajectory
+            result = d.gesture(trajectory((900, 1000), (100, 1000), profile='fling',
+                                          velocity=4000))
+            print result.requested, result.achieved
+
+        :param gesture_trajectory: casium.gesture.Trajectory in pixel.
+        :return: casium.gesture.GestureResult, also kept as last_gesture.
+        """
+        result = self._play(gesture_trajectory)
+        self._auto_wait()
+        return result
+
+    def _play(self, gesture_trajectory):
+        points = gesture_trajectory.points
+        self._mark_input()
+        if self.input_backend is not None:
+            requested, achieved = self.input_backend.play(points)
+        else:
+            action = TouchAction(self._driver)
+            action.press(None, points[0][1], points[0][2])
+            for (t0, x0, y0), (t1, x1, y1) in zip(points, points[1:]):
+                action.wait(int(round((t1 - t0) * 1000))).move_to(None, x1 - x0, y1 - y0)
+            action.release()
+            start = time.time()
+            action.perform()
+            requested, achieved = points[-1][0] - points[0][0], time.time() - start
+        self.last_gesture = GestureResult(gesture_trajectory, requested * 1000.0,
+                                          achieved * 1000.0)
+        trace_span = trace.current()
+        if trace_span is not None:
+            trace_span.set('gesture_requested', self.last_gesture.requested)
+            trace_span.set('gesture_achieved', self.last_gesture.achieved)
+        return self.last_gesture
+
+    @trace.traced('device')
     def take_screen_shot(self, filename=None):
         """
         Take a screenshot of current window and store it as PNG.
@@ -965,6 +1379,153 @@ class Device(object):
                 pass
         return png
 
+    @trace.traced('device')
+    def screenshot(self, filename=None):
+        """
+        Take a screenshot from the raw framebuffer, faster than take_screen_shot() which encodes
+        a PNG on the device and transfers it through appium.
+
+        :param filename: where the PNG should be written to, None to skip the PNG encoding.
+        :return: uint8 numpy array of height x width x channels, see casium.screencap.
+        """
+        image = screenshot(self._udid)
+        if filename is not None:
+            write_png(filename, image)
+        return image
+
+    def start_screen_capture(self, frames=DEFAULT_CAPTURE_FRAMES, interval=0):
+        """
+        Capture raw screenshots continuously in background, the last frames are kept.
+
+        :param frames: the number of the last frames to keep.
+        :param interval: the minimal time between two captures in second.
+        :return: casium.screencap.ScreenCapture, its frames() and latest() can be read while
+        capturing.
+        """
+        if self._screen_capture is not None:
+            self._screen_capture.stop()
+        self._screen_capture = ScreenCapture(self._udid, frames, interval).start()
+        return self._screen_capture
+
+    def stop_screen_capture(self):
+        """
+        Stop the continuous capture.
+
+        :return: list of tuples of the capture time and numpy array, the oldest first.
+        """
+        if self._screen_capture is None:
+            return []
+        frames = self._screen_capture.stop()
+        self._screen_capture = None
+        return frames
+
+    def set_snapshot_mode(self, enabled=True):
+        """
+        Find elements in a snapshot of the page source instead of asking appium every time.
+
+        The snapshot is dumped at the first search and reused until the next action of this
+        device, like click() or press_back(). The found elements have no appium element, their
+        attributes are read from the snapshot. Selectors which can not be evaluated on host,
+        like xpath functions without lxml, are still sent to appium.
+        Call invalidate_snapshot() after the UI changes by other means, like adb_command().
+
+        :param enabled: False to always ask appium.
+        """
+        self._snapshot_mode = enabled
+        self._snapshot = None
+
+    def invalidate_snapshot(self):
+        """
+        Drop the page source snapshot, the next search dumps a new one. It also starts a new UI
+        generation, so the cached attributes of elements are revalidated.
+        """
+        self._snapshot = None
+        self._generation += 1
+
+    @property
+    def generation(self):
+        """
+        The UI generation, which increases with every action of this device, like click() or
+        press_back(). Element attributes are cached within one generation.
+
+        :return: int generation
+        """
+        return self._generation
+
+    def revalidate(self, elements):
+        """
+        Revalidate the cached attributes of elements found in earlier UI generations with one
+        page source, instead of reading them again one request per element.
+
+        :param elements: list of Element
+        :return: list of bool, False for the elements which are not found by their bounds, their
+        attributes are read again from appium when used.
+        """
+        valid = []
+        snapshot = self.snapshot
+        for element in elements:
+            if element._generation == self._generation or element._revalidate(snapshot):
+                element._generation = self._generation
+                valid.append(True)
+                continue
+            # A snapshot element stays stale, reading it raises StaleElementReferenceException.
+            if element.appium_element is not None:
+                element._cache = {}
+                element._generation = self._generation
+            valid.append(False)
+        return valid
+
+    @property
+    def snapshot(self):
+        """
+        The current page source snapshot, dumped if there is none.
+
+        :return: Hierarchy
+        """
+        if self._snapshot is None:
+            self._snapshot = Hierarchy(self._driver.page_source)
+        return self._snapshot
+
+    def _page_source_selector(self, by_selector):
+        """
+        The selector for searching the page source, with the same class rewrite as
+        find_elements(), the page source of Android before L has no ViewGroup.
+
+        :return: By
+        """
+        if self.android_version >= 21:
+            return by_selector
+        rules = dict(by_selector._rules)
+        for rule in ('clazz', 'xpath'):
+            if rules[rule] is not None:
+                rules[rule] = rules[rule].replace('android.view.ViewGroup', 'android.view.View')
+        selector = By()
+        selector._rules = rules
+        return selector
+
+    def _find_in_snapshot(self, by_selector, parent):
+        """
+        Find elements in the snapshot.
+
+        :return: list of Element. None if the selector can not be evaluated on host.
+        """
+        snapshot = self.snapshot
+        by_selector = self._page_source_selector(by_selector)
+        parents = None
+        if parent is not None:
+            if parent._snapshot is snapshot:
+                parents = [parent._node]
+            else:
+                parents = snapshot.find_by_bounds(parent.location, parent.size)
+        nodes = snapshot.find(by_selector, parents)
+        if nodes is None:
+            if parent is not None and parent.appium_element is None:
+                raise Exception('Can not search in a snapshot element with %s.' %
+                                (by_selector.resolve_rules(),))
+            return None
+        return [Element(None, self, node, snapshot) for node in nodes]
+
+    @trace.traced('device')
     def find_element(self, by_selector, parent=None):
         """
         Find and return the first element under the parent.
@@ -973,6 +1534,14 @@ class Device(object):
         :param parent: Parent element which searching starts.
         :return: Element. None if not found.
         """
+        if self._snapshot_mode:
+            elements = self._find_in_snapshot(by_selector, parent)
+            if elements is not None:
+                if not elements:
+                    raise NoSuchElementException('No element matches %s in the snapshot.' %
+                                                 (by_selector.resolve_rules(),))
+                return elements[0]
+
         root = self._driver
         if parent is not None:
             root = parent.appium_element
@@ -993,14 +1562,29 @@ class Device(object):
 
         return None
 
-    def find_elements(self, by_selector, parent=None):
+    @trace.traced('device')
+    def find_elements(self, by_selector, parent=None, attributes=None):
         """
         Find and return all the elements under the parent.
-        
+
+        Reading an attribute of an element is one request per element. Specify attributes to
+        read them for all the found elements from one page source request.
+
+        Example::
+            apps = d.find_elements(By().clazz('.TextView'), attributes=['center', 'text'])
+
         :param by_selector: By selector, see class By.
         :param parent: Parent element which searching starts.
+        :param attributes: Names of Element attributes to prefetch, see
+        Element.PREFETCH_ATTRIBUTES. The attributes are read lazily as usual if the page source
+        does not match the search result.
         :return: Children elements list. Return empty list if not found.
         """
+        if self._snapshot_mode:
+            elements = self._find_in_snapshot(by_selector, parent)
+            if elements is not None:
+                return elements
+
         root = self._driver
         if parent is not None:
             root = parent.appium_element
@@ -1026,8 +1610,44 @@ class Device(object):
                 xpath = xpath.replace('android.view.ViewGroup', 'android.view.View')
             els = root.find_elements_by_xpath(xpath)
 
-        return [Element(el, self) for el in els]
+        elements = [Element(el, self) for el in els]
+        if attributes and elements:
+            self._prefetch(elements, by_selector, parent, attributes)
+        return elements
+
+    def _prefetch(self, elements, by_selector, parent, attributes):
+        """
+        Fill the attributes of found elements from the page source.
+        """
+        hierarchy = Hierarchy(self._driver.page_source)
+        # It is the same UI generation, keep it to revalidate elements.
+        self._snapshot = hierarchy
+        parents = None
+        if parent is not None:
+            parents = hierarchy.find_by_bounds(parent.location, parent.size)
+        nodes = hierarchy.find(self._page_source_selector(by_selector), parents)
+        # The search runs on device and the page source is another request, the UI could
+        # change between them. Only trust the page source when it gives the same elements,
+        # the same count and the same bounds of the first and the last element.
+        if nodes is None or len(nodes) != len(elements):
+            return
+        for i in set([0, len(elements) - 1]):
+            values = node_attributes(nodes[i])
+            if (elements[i].location, elements[i].size) != (values['location'], values['size']):
+                return
+        for element, node in zip(elements, nodes):
+            element._prefetch(node, attributes)
+
+    def get_prop(self, name):
+        """
+        Retrieves a system property of the device from the cached device profile.
+        
+        :param name: the property name, like 'ro.build.fingerprint'.
+        :return: the property value, empty string if not exists.
+        """
+        return self._device_profile.prop(name)
 
+    @trace.traced('device')
     def adb_command(self, cmd):
         """
         Executes an adb shell command, and return the standard output in string.
@@ -1036,11 +1656,16 @@ class Device(object):
             d = Device()
             d.adb_command('dumpsys meminfo')
         
+        A command which changes the UI, like 'input tap' or 'am start', does not start a new UI
+        generation, call invalidate_snapshot() after it so the cached element attributes and the
+        snapshot are not used.
+        
         :param cmd: the command to run
         :return the standard output of the command
         """
         return adb.shell(cmd, self._udid)[1]
 
+    @trace.traced('device')
     def start_profiling(self, *metrics):
         """
         Start or resume recording some performance.
@@ -1049,32 +1674,50 @@ class Device(object):
         Use 'input' to profiling input response latency.
         Use 'cpu' to profiling cpu usage.
         Use 'memory' to profiling memory cost.
+        Use 'visual' to profiling the response time from the screen content, see
+        casium.visualinfo.
+        Use 'framestats' to profiling the timestamps of every frame, see casium.framestats.
         
         :param metrics:  a list contains metric items
         """
         if self._is_profiling:
             return
 
-        test_package = self.current_package_name
-        if self.jump_package is not None:
-            test_package = self.jump_package
+        test_package = None
+        if self._needs_test_package(metrics):
+            test_package = self.current_package_name
+            if self.jump_package is not None:
+                test_package = self.jump_package
 
+        self._create_profilings(metrics, test_package)
+        self._trace_batch(True)
+        self._is_profiling = True
+
+    def _needs_test_package(self, metrics):
+        for metric in ['gfx', 'response', 'framestats']:
+            if metric in metrics and self._profiling[metric] is None:
+                return True
+        return False
+
+    def _create_profilings(self, metrics, test_package):
         if 'gfx' in metrics and self._profiling['gfx'] is None:
             if self.android_version >= 23:
                 gfx = GfxInfo(test_package)
             else:
-                gfx = GfxInfo2(test_package)
+                gfx = GfxInfo2(test_package, self._gfx_streaming, self._gfx_snapshot_interval)
             self._profiling['gfx'] = gfx
 
         if 'response' in metrics and self._profiling['response'] is None:
             response = ResponseInfo(test_package)
             self._profiling['response'] = response
 
-        for profiling in self._profiling.values():
-            if profiling is not None:
-                profiling.trace_begin(self._udid)
-        self._is_profiling = True
+        if 'visual' in metrics and self._profiling['visual'] is None:
+            self._profiling['visual'] = VisualInfo()
+
+        if 'framestats' in metrics and self._profiling['framestats'] is None:
+            self._profiling['framestats'] = FrameStatsInfo(test_package)
 
+    @trace.traced('device')
     def pause_profiling(self):
         """
         Pause recorded performance profiling.
@@ -1083,11 +1726,10 @@ class Device(object):
         if not self._is_profiling:
             return
 
-        for profiling in self._profiling.values():
-            if profiling is not None:
-                profiling.trace_end(self._udid)
+        self._trace_batch(False)
         self._is_profiling = False
 
+    @trace.traced('device')
     def end_profiling(self):
         """
         Stop and process recorded performance data. 
@@ -1095,15 +1737,117 @@ class Device(object):
         :return: performance data
         """
         metrics = Metrics(self)
+        if self._is_profiling:
+            self._trace_batch(False)
         for profiling in self._profiling.values():
             if profiling is not None:
-                if self._is_profiling:
-                    profiling.trace_end(self._udid)
                 profiling.dump_to_metrics(metrics)
         self._profiling.fromkeys(self._profiling, None)  # Reset all to None.
         self._is_profiling = False
         return metrics
 
+    def _trace_batch(self, begin):
+        """
+        Begin or end tracing of all the profiling with one batch of adb commands.
+        
+        :param begin: True to begin tracing, False to end tracing.
+        """
+        profilings, commands = self._trace_commands(begin)
+        results = adb.shell_batch(sum(commands, []), self._udid)
+        self._trace_dispatch(begin, profilings, commands, results)
+
+    def _trace_commands(self, begin):
+        """
+        Collect the adb commands to begin or end tracing.
+        
+        :param begin: True to begin tracing, False to end tracing.
+        :return: A tuple of the active profiling list and the command list of each profiling.
+        """
+        profilings = [p for p in self._profiling.values() if p is not None]
+        if begin:
+            commands = [p.begin_commands() for p in profilings]
+        else:
+            commands = [p.end_commands() for p in profilings]
+        return profilings, commands
+
+    def _trace_dispatch(self, begin, profilings, commands, results):
+        """
+        Hand the results of the batched commands to each profiling.
+        """
+        for profiling, cmds in zip(profilings, commands):
+            profiling_results, results = results[:len(cmds)], results[len(cmds):]
+            if begin:
+                profiling.trace_begin(self._udid, profiling_results)
+            else:
+                profiling.trace_end(self._udid, profiling_results)
+
+    def _mark_input(self):
+        """
+        Tell the visual profiling the time of an input.
+        """
+        if self._is_profiling and self._profiling['visual'] is not None:
+            self._profiling['visual'].mark_input()
+
+    def _auto_wait(self):
+        """
+        Wait for the auto_wait time after an action, which starts a new UI generation.
+        """
+        self._snapshot = None
+        self._generation += 1
+        if getattr(_auto_wait_suppressed, 'value', False):
+            return
+        with trace.span('auto_wait', 'wait') as s:
+            if self._idle_time is None:
+                time.sleep(self._wait_time)
+            else:
+                s.set('idle', self._wait_for_idle(self._wait_time, self._idle_time))
+
+    def _wait_for_idle(self, timeout, idle_time):
+        """
+        Wait until the SurfaceFlinger frame count stops increasing for idle_time after it
+        increased at least once, an app which is slow to draw the first frame is not idle.
+        Sleep for the timeout if the frame count is not available.
+
+        :param timeout: The longest wait in second.
+        :param idle_time: The time without new frame in second.
+        :return: True if the screen becomes idle before timeout.
+        """
+        deadline = time.time() + timeout
+        count = _parse_page_flip_count(self.adb_command(PAGE_FLIP_COUNT_COMMAND))
+        if count is None:
+            time.sleep(timeout)
+            return False
+
+        changed_at = None
+        while True:
+            now = time.time()
+            if changed_at is not None and now - changed_at >= idle_time:
+                return True
+            if now >= deadline:
+                return False
+            time.sleep(min(IDLE_POLL_INTERVAL, deadline - now))
+            new_count = _parse_page_flip_count(self.adb_command(PAGE_FLIP_COUNT_COMMAND))
+            if new_count is None:
+                time.sleep(max(deadline - time.time(), 0))
+                return False
+            if new_count != count:
+                count = new_count
+                changed_at = time.time()
+
+    def _call_without_auto_wait(self, name, *args):
+        """
+        Call a method in current thread without the auto wait after actions.
+        
+        :param name: The method name.
+        :param args: The method arguments.
+        :return: The method return value.
+        """
+        _auto_wait_suppressed.value = True
+        try:
+            return getattr(self, name)(*args)
+        finally:
+            _auto_wait_suppressed.value = False
+
     def _pixel(self, dimen, axis=None):
         if isinstance(dimen, str):
             if dimen.endswith('%w'):
@@ -1120,13 +1864,10 @@ class Device(object):
         return dimen
 
     def _cmd_wm_size(self):
-        wxh = adb.shell('wm size', self._udid)[1].split(':')[1].split('x')
-        width = int(wxh[0])
-        height = int(wxh[1])
-        return width, height
+        return parse_wm_size(adb.shell('wm size', self._udid)[1])
 
     def _cmd_wm_density(self):
-        return int(adb.shell('wm density', self._udid)[1].split(':')[1])
+        return parse_wm_density(adb.shell('wm density', self._udid)[1])
 
     @staticmethod
     def _device_word_match(words, info):
@@ -1147,6 +1888,36 @@ class Metrics(object):
         self._row_data = {}
         self._device = device
 
+    @property
+    def express(self):
+        """
+        Returns the express profiling results.
+        
+        :return: OrderedDict of metric name to OrderedDict of item to (mean, sd) tuple.
+        """
+        return self._express
+
+    @property
+    def histograms(self):
+        """
+        Returns the frame histograms of the profiling results which keep them, like 'gfx'.
+
+        :return: dict of metric name to the merged Histogram of all iterations.
+        """
+        return dict((name, row_data.histogram) for name, row_data in self._row_data.items()
+                    if hasattr(row_data, 'histogram'))
+
+    @property
+    def snapshots(self):
+        """
+        Returns the periodic snapshots of the profiling results which take them, like 'gfx' of
+        Android before M with gfx_snapshot_interval.
+
+        :return: dict of metric name to the list of snapshots of all iterations.
+        """
+        return dict((name, row_data.snapshots) for name, row_data in self._row_data.items()
+                    if hasattr(row_data, 'snapshots'))
+
     def add(self, name, express, row_data):
         """
         Add a new profiling item.
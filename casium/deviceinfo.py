@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Static device facts cached on disk.
+
+The whole 'getprop' dump and the display metrics are cached per serial number and invalidated
+when the build fingerprint changes, so a new Device only needs one cheap adb round trip.
+"""
+
+import json
+import os
+import re
+import tempfile
+
+from casium import adb
+
+CACHE_FILE = os.path.join(os.path.expanduser('~'), '.casium', 'device_profiles.json')
+
+_PROP_PATTERN = re.compile(r'^\[(.*?)\]: \[(.*)\]$')
+
+
+def parse_getprop(output):
+    """
+    Parse the output of 'getprop' without argument.
+
+    :param output: lines like '[ro.product.model]: [Pixel]'
+    :return: dict of property name to value
+    """
+    props = {}
+    for line in output.splitlines():
+        match = _PROP_PATTERN.match(line.strip())
+        if match:
+            props[match.group(1)] = match.group(2)
+    return props
+
+
+def parse_wm_size(output):
+    wxh = output.split(':')[1].split('x')
+    return int(wxh[0]), int(wxh[1])
+
+
+def parse_wm_density(output):
+    return int(output.split(':')[1])
+
+
+def _encode_strings(obj):
+    # json decodes every string to unicode, the queried props are str.
+    return dict((k.encode('utf-8') if isinstance(k, unicode) else k,
+                 v.encode('utf-8') if isinstance(v, unicode) else v) for k, v in obj.items())
+
+
+def _read_cache(cache_file):
+    try:
+        with open(cache_file) as f:
+            return json.load(f, object_hook=_encode_strings)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _write_cache(cache_file, cache):
+    # Write and rename, so concurrent readers never see a partial file.
+    directory = os.path.dirname(cache_file)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, temp_file = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+        os.rename(temp_file, cache_file)
+    except (IOError, OSError):
+        pass
+
+
+class DeviceProfile(object):
+    """
+    The system properties and the display metrics of a device.
+    """
+
+    def __init__(self, serial, fingerprint, props, display_size, display_density):
+        self.serial = serial
+        self.fingerprint = fingerprint
+        self.props = props
+        self.display_size = tuple(display_size)
+        self.display_density = display_density
+
+    @classmethod
+    def load(cls, udid=None, cache_file=CACHE_FILE):
+        """
+        Load the profile of a device from cache, query and cache it if the cached profile is
+        missing or the build fingerprint changed.
+
+        :param udid: device serial number
+        :param cache_file: the cache file path, None to disable the cache
+        :return: DeviceProfile
+        """
+        results = adb.shell_batch(['getprop ro.serialno', 'getprop ro.build.fingerprint'], udid)
+        serial = results[0][1].strip() or udid
+        fingerprint = results[1][1].strip()
+
+        cache = {}
+        if cache_file is not None:
+            cache = _read_cache(cache_file)
+            entry = cache.get(serial)
+            if entry is not None and entry.get('fingerprint') == fingerprint:
+                return cls(serial, fingerprint, entry['props'], entry['display_size'],
+                           entry['display_density'])
+
+        profile = cls.query(udid, serial, fingerprint)
+        if cache_file is not None:
+            cache[serial] = profile.to_dict()
+            _write_cache(cache_file, cache)
+        return profile
+
+    @classmethod
+    def query(cls, udid=None, serial=None, fingerprint=None):
+        """
+        Query the profile from the device without cache.
+
+        :param udid: device serial number
+        :return: DeviceProfile
+        """
+        results = adb.shell_batch(['getprop', 'wm size', 'wm density'], udid)
+        props = parse_getprop(results[0][1])
+        if serial is None:
+            serial = props.get('ro.serialno') or udid
+        if fingerprint is None:
+            fingerprint = props.get('ro.build.fingerprint', '')
+        return cls(serial, fingerprint, props, parse_wm_size(results[1][1]),
+                   parse_wm_density(results[2][1]))
+
+    @staticmethod
+    def invalidate(serial=None, cache_file=CACHE_FILE):
+        """
+        Remove the cached profile of a device.
+
+        :param serial: device serial number, None to remove all
+        :param cache_file: the cache file path
+        """
+        cache = {}
+        if serial is not None:
+            cache = _read_cache(cache_file)
+            cache.pop(serial, None)
+        _write_cache(cache_file, cache)
+
+    def to_dict(self):
+        return {'fingerprint': self.fingerprint,
+                'props': self.props,
+                'display_size': list(self.display_size),
+                'display_density': self.display_density}
+
+    def prop(self, name, default=''):
+        """
+        :param name: system property name, like 'ro.product.model'
+        :return: the property value
+        """
+        return self.props.get(name, default)
+
+    @property
+    def product_name(self):
+        return self.prop('ro.product.name')
+
+    @property
+    def product_model(self):
+        return self.prop('ro.product.model')
+
+    @property
+    def android_version(self):
+        return int(self.prop('ro.build.version.sdk', '0'))
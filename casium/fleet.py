@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Run one test scenario on all the attached devices in parallel.
+
+Every device is driven by its own worker process with its own appium server port and
+uiautomator2 system port. The profiling results of all the devices are merged by device model.
+
+Example::
+    def scenario(device):
+        device.start_profiling('gfx')
+        device.swipe('90%', '50%', '10%', '50%', duration=100)
+        device.pause_profiling()
+
+    result = Fleet(scenario, package='com.android.launcher3', activity='Launcher').run()
+    print result
+"""
+
+import multiprocessing
+import os
+import Queue
+import socket
+import subprocess
+import time
+import traceback
+from collections import OrderedDict
+
+import numpy
+
+from casium import adb
+from casium.device import Device
+from casium.gfxinfo import PERCENTILES
+from casium.stats import merge_histograms
+
+APPIUM_BASE_PORT = 4723
+SYSTEM_BASE_PORT = 8200
+APPIUM_START_TIMEOUT = 60
+
+
+def list_devices():
+    """
+    List the attached devices which are ready for testing.
+
+    :return: list of dict with 'udid', 'state' and the qualifiers like 'model', 'product'.
+    """
+    result = []
+    for line in adb.devices(['-l'])[1].split('\n')[1:]:
+        words = line.split()
+        if len(words) < 2 or words[1] != 'device':
+            continue
+        info = {'udid': words[0], 'state': words[1]}
+        for word in words[2:]:
+            key, _, value = word.partition(':')
+            info[key] = value
+        result.append(info)
+    return result
+
+
+def _wait_for_port(port, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return True
+        except socket.error:
+            time.sleep(0.5)
+    return False
+
+
+def _start_appium(port):
+    process = subprocess.Popen(['appium', '-p', str(port)], stdout=open(os.devnull, 'w'),
+                               stderr=subprocess.STDOUT)
+    if not _wait_for_port(port, APPIUM_START_TIMEOUT):
+        process.terminate()
+        raise Exception('Appium server does not start on port %s.' % port)
+    return process
+
+
+def _run_worker(queue, scenario, udid, index, start_appium, device_kwargs):
+    """
+    Worker process entry, run the scenario on one device and put the result into queue.
+    """
+    appium = None
+    model = udid
+    express = None
+    histograms = None
+    error = None
+    try:
+        appium_port = APPIUM_BASE_PORT + index
+        if start_appium:
+            appium = _start_appium(appium_port)
+
+        kwargs = dict(device_kwargs)
+        kwargs['remote'] = 'http://localhost:%s/wd/hub' % appium_port
+        capabilities = dict(kwargs.get('capabilities') or {})
+        capabilities['systemPort'] = SYSTEM_BASE_PORT + index
+        kwargs['capabilities'] = capabilities
+
+        device = Device(device=udid, **kwargs)
+        try:
+            model = device.product_model.strip()
+            metrics = scenario(device)
+            if metrics is None:
+                metrics = device.end_profiling()
+            express = metrics.express
+            histograms = metrics.histograms
+        finally:
+            device.disconnect()
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        if appium is not None:
+            appium.terminate()
+            appium.wait()
+    queue.put((udid, model, express, error, histograms))
+
+
+class FleetResult(object):
+    """
+    The profiling results of all devices in a fleet run.
+    """
+
+    def __init__(self):
+        self.devices = OrderedDict()
+
+    def add(self, udid, model, express, error=None, histograms=None):
+        """
+        Add the result of one device.
+
+        :param udid: the device serial number.
+        :param model: the device model name.
+        :param express: the Metrics express values, None if failed.
+        :param error: the traceback string if failed.
+        :param histograms: the Metrics histograms, None if failed.
+        """
+        self.devices[udid] = {'model': model, 'express': express, 'error': error,
+                              'histograms': histograms or {}}
+
+    @property
+    def errors(self):
+        """
+        :return: dict of device serial number to traceback string of the failed devices.
+        """
+        return dict((udid, r['error']) for udid, r in self.devices.items() if r['error'])
+
+    def by_model(self):
+        """
+        Merge the results of devices with the same model, the values are averaged. The
+        percentiles of the metrics with histograms are read from the merged histograms of the
+        devices, and their dispersions are averaged.
+
+        :return: OrderedDict of model name to the merged Metrics express values.
+        """
+        groups = OrderedDict()
+        histograms = {}
+        for result in self.devices.values():
+            if result['express'] is not None:
+                groups.setdefault(result['model'], []).append(result['express'])
+                for metric, histogram in result['histograms'].items():
+                    histograms.setdefault((result['model'], metric), []).append(histogram)
+
+        merged = OrderedDict()
+        for model, expresses in groups.items():
+            model_express = OrderedDict()
+            for express in expresses:
+                for metric, values in express.items():
+                    items = model_express.setdefault(metric, OrderedDict())
+                    for item, value in values.items():
+                        items.setdefault(item, []).append(value)
+            for metric, items in model_express.items():
+                for item, values in items.items():
+                    items[item] = (numpy.mean([v[0] for v in values]),
+                                   numpy.mean([v[1] for v in values]))
+                if (model, metric) in histograms:
+                    histogram = merge_histograms(histograms[(model, metric)])
+                    for item, q in PERCENTILES.items():
+                        if item in items:
+                            items[item] = (histogram.percentile(q), items[item][1])
+            merged[model] = model_express
+        return merged
+
+    def __str__(self):
+        output = ''
+        for model, express in self.by_model().items():
+            output = ''.join([output, '[%s]\n' % model])
+            for e in express:
+                output = ''.join([output, ('%s:\n' % e).capitalize()])
+                for m in express[e]:
+                    row = '  %-16s: %s+%s\n' % (m, express[e][m][0], express[e][m][1])
+                    output = ''.join([output, row])
+        for udid, error in self.errors.items():
+            output = ''.join([output, '[%s] failed:\n%s' % (udid, error)])
+        return output
+
+
+class Fleet(object):
+    """
+    Run a scenario on several devices in parallel, one worker process per device.
+    """
+
+    def __init__(self, scenario, udids=None, start_appium=False, **device_kwargs):
+        """
+        :param scenario: callable with a Device argument. It may return the Metrics, otherwise
+        device.end_profiling() is used.
+        :param udids: serial numbers of devices to run on, default is all the attached devices.
+        :param start_appium: start an appium server for every worker, otherwise the servers must
+        listen on ports from APPIUM_BASE_PORT in the order of devices.
+        :param device_kwargs: arguments to create Device, like package and activity.
+        """
+        self._scenario = scenario
+        self._udids = udids
+        self._start_appium = start_appium
+        self._device_kwargs = device_kwargs
+
+    def run(self):
+        """
+        Run the scenario and wait for all the devices.
+
+        :return: FleetResult
+        """
+        udids = self._udids
+        if udids is None:
+            udids = [d['udid'] for d in list_devices()]
+
+        queue = multiprocessing.Queue()
+        workers = OrderedDict()
+        for index, udid in enumerate(udids):
+            worker = multiprocessing.Process(target=_run_worker,
+                                             args=(queue, self._scenario, udid, index,
+                                                   self._start_appium, self._device_kwargs))
+            worker.start()
+            workers[udid] = worker
+
+        # Drain the queue before joining, a worker does not exit until its result is consumed.
+        results = {}
+        while len(results) < len(workers):
+            try:
+                result = queue.get(timeout=1)
+                results[result[0]] = result
+            except Queue.Empty:
+                for udid, worker in workers.items():
+                    if udid not in results and not worker.is_alive() and queue.empty():
+                        results[udid] = (udid, udid, None,
+                                         'Worker exited with code %s.' % worker.exitcode)
+        for worker in workers.values():
+            worker.join()
+
+        fleet_result = FleetResult()
+        for udid in udids:
+            fleet_result.add(*results[udid])
+        return fleet_result
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Focused activity tracking from the event log.
+
+A background thread follows the activity focus and resume events of 'logcat -b events', so the
+current activity is known without a 'dumpsys window windows' for every query. The focus is read
+once with dumpsys when the tracking starts, and every query falls back to dumpsys when the event
+log is not available, like before Android N whose logcat has no epoch format.
+
+Example::
+    print d.current_activity_name
+    for timestamp, activity, event in d.focus_tracker.history():
+        print timestamp, activity, event
+"""
+
+import re
+import threading
+import time
+
+from casium import adb
+
+FOCUS_EVENTS = ('am_focused_activity', 'am_set_resumed_activity', 'wm_set_resumed_activity')
+# The device time is printed first, the last event before it is printed by logcat and skipped.
+FOCUS_LOGCAT_COMMAND = 'date +%%s; logcat -b events -v epoch -T 1 -s %s' % ' '.join(FOCUS_EVENTS)
+FOCUS_DUMPSYS_COMMAND = 'dumpsys window windows'
+
+# Time to wait for the initial focus of a starting tracker before querying it directly.
+INITIAL_FOCUS_TIMEOUT = 5.0
+MAX_HISTORY = 1000
+
+# Like '1539248512.123  1000  1622 I am_focused_activity: [0,com.android.launcher3/.Launcher]'
+_EVENT_PATTERN = re.compile(r'^\s*(\d+\.\d+)?.*?\b(%s)\s*:\s*\[\d+,([^,\]]+)' %
+                            '|'.join(FOCUS_EVENTS))
+
+
+def _parse_activity_name(output):
+    win_info = _extract_string(output, 'mFocusedApp')
+    activity_info = _extract_string(win_info, 'ActivityRecord', '}')
+    return activity_info.split(' ')[2]
+
+
+def _extract_string(string, start_string, end_string='\n'):
+    s = string.index(start_string)
+    e = string.index(end_string, s)
+    return string[s + len(start_string): e].strip()
+
+
+def parse_focus_event(line):
+    """
+    Parse a focus event line of the event log.
+
+    :param line: logcat line in epoch format
+    :return: tuple of timestamp in second, activity name like 'com.android.launcher3/.Launcher'
+    and event name. None if the line is not a focus event. The timestamp is None without the
+    epoch format.
+    """
+    match = _EVENT_PATTERN.match(line)
+    if match is None:
+        return None
+    timestamp = float(match.group(1)) if match.group(1) else None
+    return timestamp, match.group(3).strip(), match.group(2)
+
+
+def query_focused_activity(udid=None):
+    """
+    Query the focused activity with dumpsys.
+
+    :param udid: device serial number
+    :return: activity name like 'com.android.launcher3/.Launcher'
+    """
+    result = adb.shell(FOCUS_DUMPSYS_COMMAND, udid)
+    if result[0] != 0:
+        raise Exception('Failed to query focused activity: %s' % result[1])
+    return _parse_activity_name(result[1])
+
+
+class FocusTracker(object):
+    """
+    Follow the focused activity of a device in a background thread.
+    """
+
+    def __init__(self, udid=None):
+        """
+        :param udid: device serial number
+        """
+        self._udid = udid
+        self._condition = threading.Condition()
+        self._history = []
+        self._stream = None
+        self._thread = None
+        self._alive = False
+        self._available = True
+
+    @property
+    def alive(self):
+        """
+        :return: True while the event log is followed.
+        """
+        return self._alive
+
+    @property
+    def available(self):
+        """
+        :return: False once the event log failed before any event, the tracker is not started
+        again and every query uses dumpsys.
+        """
+        return self._available
+
+    def start(self):
+        """
+        Start following the event log, it returns without waiting for the initial focus.
+        """
+        with self._condition:
+            if self._alive or not self._available:
+                return self
+            self._stream = adb.shell_stream(FOCUS_LOGCAT_COMMAND, self._udid)
+            self._alive = True
+        self._thread = threading.Thread(target=self._run, name='focus-tracker-%s' % self._udid)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._condition:
+            stream, self._stream = self._stream, None
+        if stream is not None:
+            stream.close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def current(self):
+        """
+        The focused activity, from the event log while it is followed, otherwise from dumpsys.
+
+        :return: activity name like 'com.android.launcher3/.Launcher'
+        """
+        with self._condition:
+            deadline = time.time() + INITIAL_FOCUS_TIMEOUT
+            while self._alive and not self._history and time.time() < deadline:
+                self._condition.wait(deadline - time.time())
+            if self._alive and self._history:
+                return self._history[-1][1]
+        activity = query_focused_activity(self._udid)
+        self._record(time.time(), activity, 'dumpsys')
+        return activity
+
+    def peek(self):
+        """
+        :return: the focused activity from the event log, None if it is not known without
+        querying the device.
+        """
+        with self._condition:
+            if self._alive and self._history:
+                return self._history[-1][1]
+        return None
+
+    def history(self):
+        """
+        :return: list of tuples of timestamp in second, activity name and the event name, or
+        'dumpsys' for the queried focus, the oldest first. The events have the time of the
+        device clock, the queried focus has the time of the host clock.
+        """
+        with self._condition:
+            return list(self._history)
+
+    def wait_for(self, activity, timeout=10.0):
+        """
+        Wait until an activity is focused.
+
+        :param activity: activity name, or a package name to wait for any of its activities.
+        :param timeout: timeout in second
+        :return: True if it is focused in time.
+        """
+        deadline = time.time() + timeout
+        with self._condition:
+            while self._alive:
+                if self._history and self._matches(self._history[-1][1], activity):
+                    return True
+                if time.time() >= deadline:
+                    return False
+                self._condition.wait(deadline - time.time())
+        while True:
+            if self._matches(self.current, activity):
+                return True
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.5)
+
+    @staticmethod
+    def _matches(current, activity):
+        return current == activity or current.split('/')[0] == activity
+
+    def _record(self, timestamp, activity, event):
+        with self._condition:
+            if self._history and self._history[-1][1] == activity and event == 'dumpsys':
+                return
+            self._history.append((timestamp, activity, event))
+            del self._history[:-MAX_HISTORY]
+            self._condition.notify_all()
+
+    def _run(self):
+        stream = self._stream
+        events = 0
+        try:
+            # The events only tell the changes, the focus before them is queried once.
+            try:
+                self._record(time.time(), query_focused_activity(self._udid), 'dumpsys')
+            except Exception:
+                pass
+            lines = iter(stream)
+            started = float(next(lines, '0').strip() or 0)
+            for line in lines:
+                event = parse_focus_event(line)
+                if event is None:
+                    continue
+                events += 1
+                timestamp, activity, name = event
+                if timestamp is None:
+                    self._record(time.time(), activity, name)
+                elif timestamp >= started:
+                    self._record(timestamp, activity, name)
+        except Exception:
+            pass
+        finally:
+            with self._condition:
+                # Ended without being stopped, like logcat refusing the options.
+                if self._stream is stream and events == 0:
+                    self._available = False
+                self._alive = False
+                self._condition.notify_all()
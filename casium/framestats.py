@@ -0,0 +1,271 @@
+"""
+Per frame timestamps from 'dumpsys gfxinfo <package> framestats'.
+
+Every dump has the timestamps of the last 120 frames of every window in device monotonic
+nanoseconds. The dumps are taken periodically while profiling, the overlapping frames are
+deduplicated and only the frames which started between the begin and the end of the profiling
+iteration are kept, so the frames of an action can be told apart from the frames around it.
+
+Example::
+    d.start_profiling('framestats')
+    d.swipe('90%', '50%', '10%', '50%')
+    d.pause_profiling()
+    frames = d.end_profiling()  # Metrics, see FrameStatsInfo.datas for the frames.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from os import path
+
+import numpy
+from openpyxl import load_workbook, Workbook
+from openpyxl.styles import Font
+from openpyxl.styles.numbers import FORMAT_PERCENTAGE_00, FORMAT_NUMBER_00
+from openpyxl.utils import get_column_letter
+
+from casium import adb
+from casium.stats import Sample, trim_mean_sd
+
+PROFILE_DATA_MARK = '---PROFILEDATA---'
+JANK_THRESHOLD_MS = 16.666
+# Framestats keeps 120 frames of every window, which is one second at 120 fps.
+POLL_INTERVAL = 0.5
+
+# Field names of the frame array to the column names of framestats, the columns vary between
+# Android versions and missing ones are 0.
+FRAME_COLUMNS = OrderedDict([('flags', 'Flags'),
+                             ('frame_id', 'FrameTimelineVsyncId'),
+                             ('intended_vsync', 'IntendedVsync'),
+                             ('vsync', 'Vsync'),
+                             ('handle_input_start', 'HandleInputStart'),
+                             ('animation_start', 'AnimationStart'),
+                             ('perform_traversals_start', 'PerformTraversalsStart'),
+                             ('draw_start', 'DrawStart'),
+                             ('sync_queued', 'SyncQueued'),
+                             ('sync_start', 'SyncStart'),
+                             ('issue_draw_commands_start', 'IssueDrawCommandsStart'),
+                             ('swap_buffers', 'SwapBuffers'),
+                             ('frame_completed', 'FrameCompleted')])
+FRAME_DTYPE = numpy.dtype([(name, numpy.int64) for name in FRAME_COLUMNS])
+
+
+def framestats_command(package_name):
+    return 'dumpsys gfxinfo %s framestats' % package_name
+
+
+def parse_framestats(row_data):
+    """
+    Parse the output of 'dumpsys gfxinfo <package> framestats'.
+
+    :param row_data: the output, either a string or an iterable of lines like adb.ShellStream.
+    :return: tuple of the device uptime of the dump in nanosecond, None if it is not printed,
+    and numpy structured array of FRAME_DTYPE. The frame_id is the intended vsync before
+    Android S, which has no frame timeline id.
+    """
+    if isinstance(row_data, basestring):
+        row_data = row_data.split('\n')
+    uptime = None
+    rows = []
+    indexes = None
+    in_profile_data = False
+    for line in row_data:
+        line = line.strip()
+        if line == PROFILE_DATA_MARK:
+            in_profile_data = not in_profile_data
+            indexes = None
+            continue
+        if not in_profile_data:
+            if line.startswith('Uptime:') and uptime is None:
+                uptime = int(line.split()[1]) * 1000000
+            continue
+        values = line.rstrip(',').split(',')
+        if indexes is None:
+            indexes = [values.index(c) if c in values else None for c in FRAME_COLUMNS.values()]
+            if indexes[1] is None:
+                indexes[1] = indexes[2]
+            continue
+        if len(values) < len(indexes):
+            continue
+        rows.append(tuple(int(values[i]) if i is not None else 0 for i in indexes))
+    return uptime, numpy.array(rows, dtype=FRAME_DTYPE)
+
+
+def dedupe_frames(frames):
+    """
+    Drop the frames which are in more than one dump.
+
+    :param frames: numpy array of FRAME_DTYPE
+    :return: numpy array of the unique frames sorted by intended vsync. Frames of different
+    windows in the same vsync are told apart by their completion time.
+    """
+    if len(frames) == 0:
+        return frames
+    frames = frames[numpy.lexsort((frames['frame_completed'], frames['frame_id']))]
+    unique = numpy.ones(len(frames), dtype=bool)
+    unique[1:] = (frames['frame_id'][1:] != frames['frame_id'][:-1]) | \
+                 (frames['frame_completed'][1:] != frames['frame_completed'][:-1])
+    frames = frames[unique]
+    return frames[numpy.argsort(frames['intended_vsync'], kind='mergesort')]
+
+
+def clip_frames(frames, begin_ns=None, end_ns=None):
+    """
+    Keep the frames which started in a time window.
+
+    :param frames: numpy array of FRAME_DTYPE
+    :param begin_ns: device monotonic time in nanosecond, None for no lower bound.
+    :param end_ns: device monotonic time in nanosecond, None for no upper bound.
+    :return: numpy array of the frames whose intended vsync is in the window.
+    """
+    keep = numpy.ones(len(frames), dtype=bool)
+    if begin_ns is not None:
+        keep &= frames['intended_vsync'] >= begin_ns
+    if end_ns is not None:
+        keep &= frames['intended_vsync'] <= end_ns
+    return frames[keep]
+
+
+class FrameStatsData(object):
+    def __init__(self, frames, begin_ns=None, end_ns=None):
+        """
+        :param frames: numpy array of FRAME_DTYPE of all the dumps
+        :param begin_ns: device monotonic time of the iteration begin in nanosecond
+        :param end_ns: device monotonic time of the iteration end in nanosecond
+        """
+        self.begin_ns = begin_ns
+        self.end_ns = end_ns
+        self.frames = clip_frames(dedupe_frames(frames), begin_ns, end_ns)
+        # Frames with flags, like the first frame of a window, are not regular frames.
+        valid = self.frames[self.frames['flags'] == 0]
+        self.frame_ms = (valid['frame_completed'] - valid['intended_vsync']) / 1e6
+        self.total_frames = len(self.frame_ms)
+        self.janky_frames = int((self.frame_ms > JANK_THRESHOLD_MS).sum())
+        self.janky_rate = float(self.janky_frames) / self.total_frames if self.total_frames \
+            else 0.0
+        self.percentile_50th, self.percentile_90th, self.percentile_95th, \
+            self.percentile_99th = Sample(self.frame_ms).percentiles([50, 90, 95, 99])
+
+
+class FrameStatsThread(threading.Thread):
+    def __init__(self, framestats_info):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._framestats_info = framestats_info
+
+    def run(self):
+        self._framestats_info.run_framestats_trace()
+
+
+class FrameStatsInfo(object):
+    def __init__(self, package_name):
+        self._package_name = package_name
+        self._udid = None
+        self._continue_trace = False
+        self._trace_thread = None
+        self._begin_ns = None
+        self._frames = []
+        self._lock = threading.Lock()
+        self.datas = []
+
+    def begin_commands(self):
+        return [framestats_command(self._package_name)]
+
+    def end_commands(self):
+        return [framestats_command(self._package_name)]
+
+    def trace_begin(self, udid, results=None):
+        if results is None:
+            results = adb.shell_batch(self.begin_commands(), udid)
+        # The begin dump only tells the begin time, its frames are before the iteration.
+        self._begin_ns = parse_framestats(results[0][1])[0]
+        self._frames = []
+        self._udid = udid
+        self._continue_trace = True
+        self._trace_thread = FrameStatsThread(self)
+        self._trace_thread.start()
+
+    def trace_end(self, udid, results=None):
+        self._continue_trace = False
+        self._trace_thread.join()
+        if results is None:
+            results = adb.shell_batch(self.end_commands(), udid)
+        end_ns, frames = parse_framestats(results[0][1])
+        self._add_frames(frames)
+        self.datas += [FrameStatsData(numpy.concatenate(self._frames), self._begin_ns, end_ns)]
+        self._frames = []
+
+    def run_framestats_trace(self):
+        while self._continue_trace:
+            stream = adb.shell_stream(framestats_command(self._package_name), self._udid)
+            self._add_frames(parse_framestats(stream)[1])
+            time.sleep(POLL_INTERVAL)
+
+    def _add_frames(self, frames):
+        with self._lock:
+            # Deduplicate while tracing to keep one copy of the frames of long iterations.
+            self._frames = [dedupe_frames(numpy.concatenate(self._frames + [frames]))]
+
+    def dump_to_metrics(self, metrics):
+        MetricsWriter(metrics, self.datas, self).dump()
+
+    def write_to_excel(self, name, device=None):
+        ExcelWriter(name, self.datas).dump()
+
+
+class MetricsWriter(object):
+    def __init__(self, metrics, datas, framestats_info):
+        self._metrics = metrics
+        self._datas = datas
+        self._framestats_info = framestats_info
+
+    def dump(self):
+        values = OrderedDict()
+        for title, prop in [('Janky Rate', 'janky_rate'),
+                            ('50th Percentile', 'percentile_50th'),
+                            ('90th Percentile', 'percentile_90th'),
+                            ('95th Percentile', 'percentile_95th'),
+                            ('99th Percentile', 'percentile_99th'),
+                            ('Total Frames', 'total_frames')]:
+            values[title] = trim_mean_sd([getattr(d, prop) for d in self._datas], 0.1)
+        self._metrics.add('framestats', values, self._framestats_info)
+
+
+class ExcelWriter(object):
+    def __init__(self, name, datas):
+        self._file_name = 'framestats.xlsx'
+        self._name = name
+        self._datas = datas
+
+    def dump(self):
+        col_titles = OrderedDict([('total_frames', 'Total Frames'),
+                                  ('janky_frames', 'Janky Frames'),
+                                  ('janky_rate', 'Janky Rate'),
+                                  ('percentile_50th', '50th Percentile(ms)'),
+                                  ('percentile_90th', '90th Percentile(ms)'),
+                                  ('percentile_95th', '95th Percentile(ms)'),
+                                  ('percentile_99th', '99th Percentile(ms)')])
+
+        if path.isfile(self._file_name):
+            wb = load_workbook(self._file_name)
+        else:
+            wb = Workbook()
+        ws = wb.create_sheet(title=self._name)
+
+        ft_bold = Font(bold=True)
+        for col, name in enumerate(col_titles.values()):
+            col_letter = get_column_letter(col + 1)
+            ws['%s%s' % (col_letter, 1)] = name
+            ws['%s%s' % (col_letter, 1)].font = ft_bold
+            ws.column_dimensions[col_letter].width = len(name) + 4
+
+        for row, data in enumerate(self._datas):
+            for col, prop in enumerate(col_titles.keys()):
+                cell = ws['%s%s' % (get_column_letter(col + 1), row + 2)]
+                cell.value = getattr(data, prop)
+                if col == 2:
+                    cell.number_format = FORMAT_PERCENTAGE_00
+                elif col > 2:
+                    cell.number_format = FORMAT_NUMBER_00
+
+        wb.save(self._file_name)
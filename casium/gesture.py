@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Timestamped touch trajectories with selectable velocity profiles.
+
+A trajectory is sampled at a fixed rate from a position profile, so the real velocity of a
+gesture is known in advance instead of depending on how the touch steps are scheduled.
+
+Profiles:
+    'linear': constant velocity.
+    'ease_out': decelerate to zero velocity at the end, the content stops with the finger.
+    'fling': accelerate to a target velocity at the release, the content keeps flinging.
+
+Example::
+    t = trajectory((900, 1000), (100, 1000), profile='fling', velocity=4000)
+    result = d.gesture(t)
+    print result
+"""
+
+DEFAULT_SAMPLE_RATE = 60
+
+PROFILES = {
+    'linear': lambda u: u,
+    'ease_out': lambda u: 1 - (1 - u) ** 3,
+    'fling': lambda u: u * u
+}
+
+
+class Trajectory(object):
+    """
+    Touch positions with their time.
+    """
+
+    def __init__(self, points, profile):
+        """
+        :param points: list of tuples of time in second from the touch down, x and y in pixel
+        :param profile: the velocity profile name
+        """
+        self.points = points
+        self.profile = profile
+
+    @property
+    def duration(self):
+        """
+        :return: the time from touch down to touch up in millisecond.
+        """
+        return (self.points[-1][0] - self.points[0][0]) * 1000.0
+
+    @property
+    def release_velocity(self):
+        """
+        :return: the velocity of the last sample before touch up in pixel/second.
+        """
+        if len(self.points) < 2:
+            return 0.0
+        (t0, x0, y0), (t1, x1, y1) = self.points[-2:]
+        if t1 <= t0:
+            return 0.0
+        return ((x1 - x0) ** 2 + (y1 - y0) ** 2) ** 0.5 / (t1 - t0)
+
+
+class GestureResult(object):
+    """
+    The requested and achieved duration of a replayed gesture.
+    """
+
+    def __init__(self, trajectory, requested, achieved):
+        """
+        :param trajectory: the replayed Trajectory
+        :param requested: requested duration in millisecond
+        :param achieved: achieved duration in millisecond
+        """
+        self.trajectory = trajectory
+        self.requested = requested
+        self.achieved = achieved
+
+    @property
+    def error(self):
+        """
+        :return: achieved minus requested duration in millisecond.
+        """
+        return self.achieved - self.requested
+
+    def __str__(self):
+        return '%s gesture: requested %.1fms, achieved %.1fms (%+.1fms)' % (
+            self.trajectory.profile, self.requested, self.achieved, self.error)
+
+
+def trajectory(start, end, duration=None, profile='linear', velocity=None,
+               sample_rate=DEFAULT_SAMPLE_RATE, hold=0):
+    """
+    Generate a straight touch trajectory.
+
+    :param start: tuple of start x and y in pixel
+    :param end: tuple of end x and y in pixel
+    :param duration: the move duration in millisecond, None for 'fling' to derive it from the
+    velocity.
+    :param profile: 'linear', 'ease_out' or 'fling'
+    :param velocity: the release velocity in pixel/second for 'fling', the duration is derived
+    from it and the distance when duration is None.
+    :param sample_rate: touch samples per second
+    :param hold: time in millisecond to hold at the start before moving, like a long press
+    :return: Trajectory
+    """
+    if profile not in PROFILES:
+        raise Exception('Unknown gesture profile "%s"' % profile)
+    distance = ((end[0] - start[0]) ** 2 + (end[1] - start[1]) ** 2) ** 0.5
+    if profile == 'fling' and duration is None and velocity is not None:
+        if velocity <= 0:
+            raise Exception('Fling with non-positive velocity: %s' % velocity)
+        # Constant acceleration from zero to the velocity over the distance.
+        duration = 2000.0 * distance / velocity
+    if duration is None or duration <= 0:
+        raise Exception('Gesture with non-positive duration: %s' % duration)
+
+    position = PROFILES[profile]
+    seconds = duration / 1000.0
+    hold_seconds = hold / 1000.0
+    steps = max(int(round(seconds * sample_rate)), 1)
+    points = [(0.0, start[0], start[1])] if hold > 0 else []
+    for i in range(steps + 1):
+        u = position(float(i) / steps)
+        points.append((hold_seconds + seconds * i / steps,
+                       start[0] + (end[0] - start[0]) * u,
+                       start[1] + (end[1] - start[1]) * u))
+    return Trajectory(points, profile)
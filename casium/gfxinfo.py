@@ -10,53 +10,85 @@ from openpyxl.styles.numbers import FORMAT_PERCENTAGE_00, FORMAT_NUMBER_00
 from openpyxl.utils import get_column_letter
 
 from casium import adb
+from casium.stats import Histogram, Moments, Sample, merge_histograms, trimsd, \
+    weighted_trimmean, weighted_trimsd
 
+JANK_THRESHOLD_MS = 16.666
+# Metric item names to the percentiles reported from the merged histograms of all iterations.
+PERCENTILES = OrderedDict([('50th Percentile', 50),
+                           ('90th Percentile', 90),
+                           ('95th Percentile', 95),
+                           ('99th Percentile', 99)])
+# Metric item names to the running moments of GfxData2 for the frame and its rendering stages.
+STAGES = OrderedDict([('Frame', 'frame_moments'),
+                      ('Draw', 'ui_draw_moments'),
+                      ('Prepare', 'prepare_moments'),
+                      ('Process', 'process_moments'),
+                      ('Execute', 'execute_moments')])
 
-def trimmean(arr, percent):
-    if len(arr) == 0:
-        return 0
 
-    sorted_arr = sorted(arr)
-    n = len(sorted_arr)
-    k = int(round(n * percent))
-    return numpy.mean(sorted_arr[k:n - k])
+def reset_gfx_info_command(package_name):
+    return 'dumpsys gfxinfo %s reset' % package_name
 
 
-def trimsd(arr, percent):
-    if len(arr) == 0:
-        return 0
-
-    sorted_arr = sorted(arr)
-    n = len(sorted_arr)
-    k = int(round(n * percent))
-    trim_arr = sorted_arr[k:n - k]
-
-    mean = trimmean(arr, percent)
-    deviation_arr = [(v - mean) * (v - mean) for v in trim_arr]
-    return numpy.sqrt(numpy.mean(deviation_arr))
-
-
-def trimmax(arr, percent):
-    if len(arr) == 0:
-        return 0
-
-    sorted_arr = sorted(arr)
-    n = len(sorted_arr)
-    k = int(round(n * percent))
-    return round(sorted_arr[n - k - 1])
+def dump_gfx_info_command(package_name):
+    return 'dumpsys gfxinfo %s' % package_name
 
 
 def cmd_reset_gfx_info(package_name, udid):
-    adb.shell('dumpsys gfxinfo %s reset' % package_name, udid)
+    adb.shell(reset_gfx_info_command(package_name), udid)
 
 
 def cmd_dump_gfx_info(package_name, udid):
-    return adb.shell('dumpsys gfxinfo %s' % package_name, udid)[1]
+    return adb.shell(dump_gfx_info_command(package_name), udid)[1]
+
+
+def summarize(datas):
+    """
+    Summarize the profiling iterations. The values are of all the frames of all iterations, the
+    percentiles are read from the merged frame histograms. The dispersion is the trimmed
+    standard deviation of the per-iteration values. The STAGES of GfxData2 are the mean and the
+    standard deviation of all the frames.
+
+    :param datas: list of GfxData or GfxData2
+    :return: OrderedDict of item name to tuple of the value and the dispersion, the items are
+    'Janky Rate', PERCENTILES and STAGES for GfxData2.
+    """
+    values = OrderedDict()
+    total_frames = sum(d.total_frames for d in datas)
+    janky_frames = sum(d.janky_frames for d in datas)
+    janky_rate = float(janky_frames) / total_frames if total_frames else 0.0
+    values['Janky Rate'] = (janky_rate, trimsd([d.janky_rate for d in datas], 0.1))
+
+    histogram = merge_histograms(d.frame_histogram for d in datas)
+    for item, q in PERCENTILES.items():
+        values[item] = (histogram.percentile(q),
+                        trimsd([d.frame_histogram.percentile(q) for d in datas], 0.1))
+
+    if datas and all(isinstance(d, GfxData2) for d in datas):
+        for item, prop in STAGES.items():
+            moments = Moments()
+            for d in datas:
+                moments.merge(getattr(d, prop))
+            values[item] = (moments.mean, moments.sd)
+    return values
 
 
 class GfxData(object):
+    SUMMARY_KEYS = ['Graphics info for pid', '[', 'Stats since:', 'Total frames rendered:',
+                    'Janky frames:', 'percentile:', 'Number ', 'HISTOGRAM:']
+
     def __init__(self, row_data):
-        self.row_data = row_data
+        """
+        :param row_data: dumpsys gfxinfo output, either a string or an iterable of lines like
+        adb.ShellStream. Only the summary lines of a stream are kept.
+        """
+        if isinstance(row_data, basestring):
+            self.row_data = row_data
+        else:
+            self.row_data = ''.join(line if line.endswith('\n') else line + '\n'
+                                    for line in row_data
+                                    if any(key in line for key in self.SUMMARY_KEYS))
         self.pid = int(self._extract_value('Graphics info for pid', '['))
         self.pkg = self._extract_value('[', ']')
         self.stats_since_ns = int(self._extract_value('Stats since:', 'ns'))
@@ -78,20 +110,28 @@ class GfxData(object):
         else:
             self.janky_rate = 0.0
 
-        self.frame_ms = []
-        for key, value in self.histogram.iteritems():
-            for i in range(value):
-                self.frame_ms += [key]
-
-        self.mean_50th = trimmean(self.frame_ms, 0.25)
-        self.mean_90th = trimmean(self.frame_ms, 0.05)
-        self.mean_95th = trimmean(self.frame_ms, 0.025)
-        self.mean_99th = trimmean(self.frame_ms, 0.005)
-
-        self.sd_50th = trimsd(self.frame_ms, 0.25)
-        self.sd_90th = trimsd(self.frame_ms, 0.05)
-        self.sd_95th = trimsd(self.frame_ms, 0.025)
-        self.sd_99th = trimsd(self.frame_ms, 0.005)
+        # The statistics are computed on the histogram, the frames are not expanded.
+        self.histogram_ms = numpy.array(sorted(self.histogram), dtype=float)
+        self.histogram_counts = numpy.array([self.histogram[k] for k in sorted(self.histogram)],
+                                            dtype=numpy.int64)
+
+        self.mean_50th = weighted_trimmean(self.histogram_ms, self.histogram_counts, 0.25)
+        self.mean_90th = weighted_trimmean(self.histogram_ms, self.histogram_counts, 0.05)
+        self.mean_95th = weighted_trimmean(self.histogram_ms, self.histogram_counts, 0.025)
+        self.mean_99th = weighted_trimmean(self.histogram_ms, self.histogram_counts, 0.005)
+
+        self.sd_50th = weighted_trimsd(self.histogram_ms, self.histogram_counts, 0.25)
+        self.sd_90th = weighted_trimsd(self.histogram_ms, self.histogram_counts, 0.05)
+        self.sd_95th = weighted_trimsd(self.histogram_ms, self.histogram_counts, 0.025)
+        self.sd_99th = weighted_trimsd(self.histogram_ms, self.histogram_counts, 0.005)
+        self.frame_histogram = Histogram().add(self.histogram_ms, self.histogram_counts)
+
+    @property
+    def frame_ms(self):
+        """
+        The frame times expanded from the histogram, one item per frame.
+        """
+        return numpy.repeat(self.histogram_ms, self.histogram_counts).astype(int).tolist()
 
     def _extract_value(self, start_key, end_key='\n'):
         s = self.row_data.index(start_key)
@@ -109,11 +149,27 @@ class GfxInfo(object):
         self._package_name = package_name
         self._datas = []
 
-    def trace_begin(self, udid):
-        cmd_reset_gfx_info(self._package_name, udid)
+    def begin_commands(self):
+        return [reset_gfx_info_command(self._package_name)]
+
+    def end_commands(self):
+        return [dump_gfx_info_command(self._package_name)]
+
+    def trace_begin(self, udid, results=None):
+        if results is None:
+            adb.shell_batch(self.begin_commands(), udid)
 
-    def trace_end(self, udid):
-        self._datas += [GfxData(cmd_dump_gfx_info(self._package_name, udid))]
+    def trace_end(self, udid, results=None):
+        if results is None:
+            results = adb.shell_batch(self.end_commands(), udid)
+        self._datas += [GfxData(results[0][1])]
+
+    @property
+    def histogram(self):
+        """
+        :return: Histogram of the frame times of all iterations.
+        """
+        return merge_histograms(d.frame_histogram for d in self._datas)
 
     def dump_to_metrics(self, metrics):
         MetricsWriter(metrics, self._datas, self).dump()
@@ -123,7 +179,13 @@ class GfxInfo(object):
 
 
 class GfxData2(object):
-    def __init__(self):
+    def __init__(self, streaming=False):
+        """
+        :param streaming: keep the frames in fixed memory sketches only, for profiling without
+        limit of time. The frame lists are empty then, and the trimmed statistics are read from
+        the frame histogram.
+        """
+        self.streaming = streaming
         self.frame_ms = []
         self.ui_draw_ms = []
         self.prepare_ms = []
@@ -144,42 +206,103 @@ class GfxData2(object):
         self.percentile_90th = 0
         self.percentile_95th = 0
         self.percentile_99th = 0
+        self.frame_histogram = Histogram()
+        self.frame_moments = Moments()
+        self.ui_draw_moments = Moments()
+        self.prepare_moments = Moments()
+        self.process_moments = Moments()
+        self.execute_moments = Moments()
+        self.snapshots = []
+        self._janky_count = 0
+        self._snapshot_counts = self.frame_histogram.counts.copy()
+        self._snapshot_janky_count = 0
 
     def add_row_data(self, row_data):
-        profile_data = self._extract_value(row_data, 'Profile data in ms:', 'View hierarchy')
-        frames_ms = profile_data.split('\n')[2:]
-        wash_frames_ms = [frame_ms for frame_ms in frames_ms if len(frame_ms.split('\t')) == 5]
-        ui_draw_ms = [float(frame_ms.split('\t')[1]) for frame_ms in wash_frames_ms]
-        prepare_ms = [float(frame_ms.split('\t')[2]) for frame_ms in wash_frames_ms]
-        process_ms = [float(frame_ms.split('\t')[3]) for frame_ms in wash_frames_ms]
-        execute_ms = [float(frame_ms.split('\t')[4]) for frame_ms in wash_frames_ms]
-        frame_ms = []
-        for i in range(len(ui_draw_ms)):
-            frame_ms += [ui_draw_ms[i] + prepare_ms[i] + process_ms[i] + execute_ms[i]]
-
-        self.frame_ms += frame_ms
-        self.ui_draw_ms += ui_draw_ms
-        self.prepare_ms += prepare_ms
-        self.process_ms += process_ms
-        self.execute_ms += execute_ms
+        """
+        :param row_data: dumpsys gfxinfo output, either a string or an iterable of lines like
+        adb.ShellStream which is parsed while arriving.
+        """
+        if isinstance(row_data, basestring):
+            profile_data = self._extract_value(row_data, 'Profile data in ms:', 'View hierarchy')
+            frames_ms = profile_data.split('\n')[2:]
+        else:
+            frames_ms = self._profile_lines(row_data)
+        rows = [frame_ms.split('\t') for frame_ms in frames_ms]
+        stages = numpy.array([row[1:] for row in rows if len(row) == 5], dtype=float)
+        stages = stages.reshape(-1, 4)
+        frame_ms = stages.sum(axis=1)
+
+        if not self.streaming:
+            self.frame_ms += frame_ms.tolist()
+            self.ui_draw_ms += stages[:, 0].tolist()
+            self.prepare_ms += stages[:, 1].tolist()
+            self.process_ms += stages[:, 2].tolist()
+            self.execute_ms += stages[:, 3].tolist()
+        self.frame_histogram.add(frame_ms)
+        self.frame_moments.add(frame_ms)
+        self.ui_draw_moments.add(stages[:, 0])
+        self.prepare_moments.add(stages[:, 1])
+        self.process_moments.add(stages[:, 2])
+        self.execute_moments.add(stages[:, 3])
+        self._janky_count += int((frame_ms > JANK_THRESHOLD_MS).sum())
 
     def parse_row_data(self):
-        self.total_frames = len(self.frame_ms)
-        self.janky_frames = len([ms for ms in self.frame_ms if ms > 16.666])
+        self.total_frames = self.frame_moments.count
+        self.janky_frames = self._janky_count
         if self.total_frames != 0:
             self.janky_rate = float(self.janky_frames) / self.total_frames
-        self.mean_50th = trimmean(self.frame_ms, 0.25)
-        self.mean_90th = trimmean(self.frame_ms, 0.05)
-        self.mean_95th = trimmean(self.frame_ms, 0.025)
-        self.mean_99th = trimmean(self.frame_ms, 0.005)
-        self.sd_50th = trimsd(self.frame_ms, 0.25)
-        self.sd_90th = trimsd(self.frame_ms, 0.05)
-        self.sd_95th = trimsd(self.frame_ms, 0.025)
-        self.sd_99th = trimsd(self.frame_ms, 0.005)
-        self.percentile_50th = trimmax(self.frame_ms, 0.5)
-        self.percentile_90th = trimmax(self.frame_ms, 0.1)
-        self.percentile_95th = trimmax(self.frame_ms, 0.05)
-        self.percentile_99th = trimmax(self.frame_ms, 0.01)
+        frames = self.frame_histogram if self.streaming else Sample(self.frame_ms)
+        self.mean_50th = frames.trimmean(0.25)
+        self.mean_90th = frames.trimmean(0.05)
+        self.mean_95th = frames.trimmean(0.025)
+        self.mean_99th = frames.trimmean(0.005)
+        self.sd_50th = frames.trimsd(0.25)
+        self.sd_90th = frames.trimsd(0.05)
+        self.sd_95th = frames.trimsd(0.025)
+        self.sd_99th = frames.trimsd(0.005)
+        self.percentile_50th = frames.trimmax(0.5)
+        self.percentile_90th = frames.trimmax(0.1)
+        self.percentile_95th = frames.trimmax(0.05)
+        self.percentile_99th = frames.trimmax(0.01)
+
+    def snapshot(self, timestamp=None):
+        """
+        Summarize the frames since the previous snapshot, to follow a long profiling over time.
+        The snapshot is appended to snapshots.
+
+        :param timestamp: host time in second, None for now.
+        :return: tuple of timestamp, total frames, janky frames and the PERCENTILES values of
+        the frames.
+        """
+        counts = self.frame_histogram.counts.copy()
+        window = Histogram(counts - self._snapshot_counts)
+        snapshot = (timestamp if timestamp is not None else time.time(), window.total,
+                    self._janky_count - self._snapshot_janky_count) + \
+            tuple(window.percentile(q) for q in PERCENTILES.values())
+        self._snapshot_counts = counts
+        self._snapshot_janky_count = self._janky_count
+        self.snapshots.append(snapshot)
+        return snapshot
+
+    @staticmethod
+    def _profile_lines(lines):
+        """
+        Filter the lines of 'Profile data in ms' block, like add_row_data() does for a string.
+        """
+        skip = None
+        for line in lines:
+            if skip is None:
+                if 'Profile data in ms:' in line:
+                    skip = 2
+                continue
+            if 'View hierarchy' in line:
+                break
+            if skip == 2 and not line.strip():
+                continue
+            if skip > 0:
+                skip -= 1
+                continue
+            yield line.strip('\r\n')
 
     def _extract_value(self, row_data, start_key, end_key='\n'):
         s = row_data.index(start_key)
@@ -202,33 +325,68 @@ class GfxThread(threading.Thread):
 
 
 class GfxInfo2(object):
-    def __init__(self, package_name):
+    def __init__(self, package_name, streaming=False, snapshot_interval=None):
+        """
+        :param package_name: the profiled package
+        :param streaming: keep the frames in fixed memory sketches only, see GfxData2.
+        :param snapshot_interval: summarize the frames every this time in second into the
+        snapshots of the GfxData2, None for no snapshot.
+        """
         self._continue_trace = False
         self._package_name = package_name
+        self._streaming = streaming
+        self._snapshot_interval = snapshot_interval
         self._datas = []
         self._gfx_data = None
         self._trace_thread = None
         self._udid = None
 
-    def trace_begin(self, udid):
-        cmd_reset_gfx_info(self._package_name, udid)
+    def begin_commands(self):
+        return [reset_gfx_info_command(self._package_name)]
+
+    def end_commands(self):
+        return []
+
+    def trace_begin(self, udid, results=None):
+        if results is None:
+            adb.shell_batch(self.begin_commands(), udid)
         self._continue_trace = True
-        self._gfx_data = GfxData2()
+        self._gfx_data = GfxData2(self._streaming)
         self._trace_thread = GfxThread(self)
         self._trace_thread.start()
         self._udid = udid
 
-    def trace_end(self, udid):
+    def trace_end(self, udid, results=None):
         self._continue_trace = False
         self._trace_thread.join()
         self._gfx_data.parse_row_data()
         self._datas += [self._gfx_data]
 
     def run_gfx_trace(self):
+        last_snapshot = time.time()
         while self._continue_trace:
-            self._gfx_data.add_row_data(cmd_dump_gfx_info(self._package_name, self._udid))
+            stream = adb.shell_stream(dump_gfx_info_command(self._package_name), self._udid)
+            self._gfx_data.add_row_data(stream)
+            if self._snapshot_interval is not None and \
+                    time.time() - last_snapshot >= self._snapshot_interval:
+                last_snapshot = time.time()
+                self._gfx_data.snapshot(last_snapshot)
             time.sleep(1)
 
+    @property
+    def histogram(self):
+        """
+        :return: Histogram of the frame times of all iterations.
+        """
+        return merge_histograms(d.frame_histogram for d in self._datas)
+
+    @property
+    def snapshots(self):
+        """
+        :return: list of the snapshots of all iterations, see GfxData2.snapshot().
+        """
+        return [snapshot for d in self._datas for snapshot in d.snapshots]
+
     def dump_to_metrics(self, metrics):
         MetricsWriter(metrics, self._datas, self).dump()
 
@@ -243,24 +401,7 @@ class MetricsWriter(object):
         self._gfxinfo = gfxinfo
 
     def dump(self):
-        values = OrderedDict()
-
-        avg_janky_rate = trimmean([d.janky_rate for d in self._datas], 0.1)
-        values['Janky Rate'] = (avg_janky_rate, 0)
-
-        avg_mean_90th = trimmean([d.mean_90th for d in self._datas], 0.1)
-        avg_sd_90th = trimmean([d.sd_90th for d in self._datas], 0.1)
-        values['90th Percentile'] = (avg_mean_90th, avg_sd_90th)
-
-        avg_mean_95th = trimmean([d.mean_95th for d in self._datas], 0.1)
-        avg_sd_95th = trimmean([d.sd_95th for d in self._datas], 0.1)
-        values['95th Percentile'] = (avg_mean_95th, avg_sd_95th)
-
-        avg_mean_99th = trimmean([d.mean_99th for d in self._datas], 0.1)
-        avg_sd_99th = trimmean([d.sd_99th for d in self._datas], 0.1)
-        values['99th Percentile'] = (avg_mean_99th, avg_sd_99th)
-
-        self._metrics.add('gfx', values, self._gfxinfo)
+        self._metrics.add('gfx', summarize(self._datas), self._gfxinfo)
 
 
 class ExcelWriter(object):
@@ -317,14 +458,11 @@ class ExcelWriter(object):
         sum_ws.title = 'summary'
 
         # Summary titles
-        summary_titles = ['Test Case',
-                          'Janky Rate',
-                          '90th Percentile(avg)',
-                          '90th Percentile(sd)',
-                          '95th Percentile(avg)',
-                          '95th Percentile(sd)',
-                          '99th Percentile(avg)',
-                          '99th Percentile(sd)']
+        values = summarize(self._datas)
+        summary_titles = ['Test Case']
+        for item in values:
+            unit = '' if item == 'Janky Rate' else '(ms)'
+            summary_titles += ['%s%s' % (item, unit), '%s(sd)' % item]
 
         for col, name in enumerate(summary_titles):
             col_letter = get_column_letter(col + 1)
@@ -335,30 +473,12 @@ class ExcelWriter(object):
         row = self.sum_row['next']
 
         sum_ws['A%s' % row] = self._name
-        avg_janky_rate = trimmean([d.janky_rate for d in self._datas], 0.1)
-        sum_ws['B%s' % row] = avg_janky_rate
-        sum_ws['B%s' % row].number_format = FORMAT_PERCENTAGE_00
-
-        avg_mean_90th = trimmean([d.mean_90th for d in self._datas], 0.1)
-        avg_sd_90th = trimmean([d.sd_90th for d in self._datas], 0.1)
-        sum_ws['C%s' % row] = avg_mean_90th
-        sum_ws['C%s' % row].number_format = FORMAT_NUMBER_00
-        sum_ws['D%s' % row] = avg_sd_90th
-        sum_ws['D%s' % row].number_format = FORMAT_NUMBER_00
-
-        avg_mean_95th = trimmean([d.mean_95th for d in self._datas], 0.1)
-        avg_sd_95th = trimmean([d.sd_95th for d in self._datas], 0.1)
-        sum_ws['E%s' % row] = avg_mean_95th
-        sum_ws['E%s' % row].number_format = FORMAT_NUMBER_00
-        sum_ws['F%s' % row] = avg_sd_95th
-        sum_ws['F%s' % row].number_format = FORMAT_NUMBER_00
-
-        avg_mean_99th = trimmean([d.mean_99th for d in self._datas], 0.1)
-        avg_sd_99th = trimmean([d.sd_99th for d in self._datas], 0.1)
-        sum_ws['G%s' % row] = avg_mean_99th
-        sum_ws['G%s' % row].number_format = FORMAT_NUMBER_00
-        sum_ws['H%s' % row] = avg_sd_99th
-        sum_ws['H%s' % row].number_format = FORMAT_NUMBER_00
+        for col, (item, value) in enumerate(values.items()):
+            number_format = FORMAT_PERCENTAGE_00 if item == 'Janky Rate' else FORMAT_NUMBER_00
+            for i in range(2):
+                cell = sum_ws['%s%s' % (get_column_letter(col * 2 + i + 2), row)]
+                cell.value = value[i]
+                cell.number_format = number_format
 
         self.sum_row['next'] += 1
 
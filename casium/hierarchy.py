@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+UI hierarchy parsed from the appium page source, By selectors are evaluated on host.
+
+lxml is used for xpath selectors when it is installed, otherwise only the xpath subset of
+xml.etree.ElementTree is supported and other xpath selectors can not be evaluated.
+"""
+
+import re
+
+try:
+    from lxml import etree
+
+    HAS_LXML = True
+except ImportError:
+    import xml.etree.cElementTree as etree
+
+    HAS_LXML = False
+
+_XPATH_ERRORS = (SyntaxError, KeyError) + ((etree.XPathError,) if HAS_LXML else ())
+
+# Node attributes which have an index for looking up.
+_INDEXED_ATTRIBUTES = ('resource-id', 'class', 'text', 'content-desc')
+
+_BOUNDS_PATTERN = re.compile(r'\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]')
+
+# By rule names to the node attribute names of the page source.
+_RULE_ATTRIBUTES = {
+    'clazz': 'class',
+    'desc': 'content-desc',
+    'res': 'resource-id',
+    'text': 'text',
+    'checkable': 'checkable',
+    'checked': 'checked',
+    'clickable': 'clickable',
+    'enabled': 'enabled',
+    'focusable': 'focusable',
+    'focused': 'focused',
+    'longClickable': 'long-clickable',
+    'scrollable': 'scrollable',
+    'selected': 'selected'
+}
+
+
+def parse_bounds(bounds):
+    """
+    Parse the bounds attribute of a node.
+
+    :param bounds: string like '[0,72][1080,1920]'
+    :return: tuple of left, top, right, bottom in pixel
+    """
+    match = _BOUNDS_PATTERN.match(bounds or '')
+    if match is None:
+        return 0, 0, 0, 0
+    return tuple(int(v) for v in match.groups())
+
+
+def node_attributes(node):
+    """
+    The Element attributes of a node.
+
+    :param node: node of Hierarchy
+    :return: dict with 'text', 'description', 'location' and 'size', 'description' is absent
+    when the node has no content description, appium falls back to other values then.
+    """
+    left, top, right, bottom = parse_bounds(node.get('bounds'))
+    attributes = {'text': node.get('text', ''),
+                  'location': (left, top),
+                  'size': (right - left, bottom - top)}
+    if node.get('content-desc'):
+        attributes['description'] = node.get('content-desc')
+    return attributes
+
+
+def _to_unicode(value):
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return value
+
+
+class Hierarchy(object):
+    """
+    A parsed page source, nodes are in document order like the appium search results.
+    Nodes are indexed by resource-id, class, text and content-desc.
+    """
+
+    def __init__(self, page_source):
+        """
+        :param page_source: the xml string of WebDriver.page_source
+        """
+        if isinstance(page_source, unicode):
+            page_source = page_source.encode('utf-8')
+        self._root = etree.fromstring(page_source)
+        self._nodes = list(self._root.iter())[1:]
+        self._order = dict((id(node), i) for i, node in enumerate(self._nodes))
+        # The order of the last descendant of every node, descendants of a node are the nodes
+        # after it up to this order.
+        self._end = {}
+        self._index = dict((attribute, {}) for attribute in _INDEXED_ATTRIBUTES)
+        for node in reversed(self._nodes):
+            children = list(node)
+            self._end[id(node)] = self._end[id(children[-1])] if children else \
+                self._order[id(node)]
+        for node in self._nodes:
+            for attribute, index in self._index.items():
+                value = node.get(attribute)
+                if value:
+                    index.setdefault(_to_unicode(value), []).append(node)
+            res = node.get('resource-id', '')
+            if ':id/' in res:
+                self._index['resource-id'].setdefault(
+                    _to_unicode(res.split(':id/', 1)[1]), []).append(node)
+
+    @property
+    def root(self):
+        return self._root
+
+    @property
+    def nodes(self):
+        return self._nodes
+
+    def find(self, by_selector, parents=None):
+        """
+        Find the nodes matching a By selector.
+
+        :param by_selector: By selector, see class By.
+        :param parents: nodes which searching starts, None to search all the hierarchy.
+        :return: list of nodes. None if the selector can not be evaluated on host.
+        """
+        rules = dict((k, v) for k, v in by_selector._rules.items() if v is not None)
+        xpath = rules.get('xpath')
+        if xpath is not None:
+            return self._find_xpath(xpath, parents)
+
+        if any(rule not in _RULE_ATTRIBUTES for rule in rules):
+            return None
+
+        candidates = None
+        for rule, value in rules.items():
+            nodes = self._lookup(rule, value)
+            if nodes is not None and (candidates is None or len(nodes) < len(candidates)):
+                candidates = nodes
+        if candidates is None:
+            candidates = self._nodes
+        if parents is not None:
+            candidates = [node for node in candidates if self._is_descendant(node, parents)]
+        matchers = [self._matcher(rule, value) for rule, value in rules.items()]
+        return [node for node in candidates if all(m(node) for m in matchers)]
+
+    def _lookup(self, rule, value):
+        """
+        Get the candidate nodes of a rule from the index, None if the rule is not indexed.
+        """
+        attribute = _RULE_ATTRIBUTES[rule]
+        if attribute not in self._index or isinstance(value, bool):
+            return None
+        value = _to_unicode(value)
+        if rule == 'clazz' and value.startswith('.'):
+            value = u'android.widget%s' % value
+        if value == '':
+            return None
+        return self._index[attribute].get(value, [])
+
+    def _is_descendant(self, node, parents):
+        order = self._order[id(node)]
+        for parent in parents:
+            if self._order[id(parent)] < order <= self._end[id(parent)]:
+                return True
+        return False
+
+    def find_by_bounds(self, location, size):
+        """
+        Find the nodes which have the bounds, to locate an Element in the hierarchy.
+
+        :param location: tuple of left and top
+        :param size: tuple of width and height
+        :return: list of nodes
+        """
+        bounds = (location[0], location[1], location[0] + size[0], location[1] + size[1])
+        return [node for node in self._nodes if parse_bounds(node.get('bounds')) == bounds]
+
+    def _find_xpath(self, xpath, parents):
+        if parents is not None and xpath.startswith('/'):
+            xpath = '.' + xpath
+        elif not HAS_LXML and xpath.startswith('/') and not xpath.startswith('//'):
+            # ElementTree has no document node, the first step of an absolute path is the root.
+            step, _, rest = xpath[1:].partition('/')
+            if step not in (self._root.tag, '*') or not rest:
+                return None
+            xpath = './' + rest
+        contexts = [self._root] if parents is None else parents
+        result = []
+        for context in contexts:
+            try:
+                if HAS_LXML:
+                    found = context.xpath(xpath)
+                else:
+                    found = context.findall(xpath if xpath.startswith('.') else '.' + xpath)
+            except _XPATH_ERRORS:
+                return None
+            result.extend(node for node in found if hasattr(node, 'tag') and node is not context)
+        if len(contexts) > 1:
+            return self._document_order(result)
+        return result
+
+    def _document_order(self, nodes):
+        unique = dict((id(node), node) for node in nodes if id(node) in self._order)
+        return sorted(unique.values(), key=lambda node: self._order[id(node)])
+
+    @staticmethod
+    def _matcher(rule, value):
+        attribute = _RULE_ATTRIBUTES[rule]
+        if isinstance(value, bool):
+            expected = 'true' if value else 'false'
+            return lambda node: node.get(attribute) == expected
+        value = _to_unicode(value)
+        if rule == 'clazz' and value.startswith('.'):
+            value = u'android.widget%s' % value
+        if rule == 'res' and ':' not in value:
+            suffix = u':id/%s' % value
+            return lambda node: node.get(attribute, '') == value or \
+                node.get(attribute, '').endswith(suffix)
+        return lambda node: _to_unicode(node.get(attribute, '')) == value
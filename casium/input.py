@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Touch input injected over adb, bypassing appium.
+
+The touch events are written with 'sendevent' into the touchscreen input device through a
+dedicated shell session, every group of events of one sample is one round trip. The injection
+latency of every group, from the scheduled time to the events being written on the device, is
+recorded to report latency and jitter.
+
+The coordinates are in pixel of the display in its natural orientation.
+
+Example::
+    d = Device(package='com.android.launcher3', activity='Launcher', input_backend='sendevent')
+    d.swipe('90%', '50%', '10%', '50%', duration=300)
+    print d.input_backend.stats()
+"""
+
+import re
+import time
+
+import numpy
+
+from casium import adb
+
+EV_SYN = 0
+EV_KEY = 1
+EV_ABS = 3
+
+SYN_REPORT = 0
+BTN_TOUCH = 0x14a
+ABS_MT_SLOT = 0x2f
+ABS_MT_TOUCH_MAJOR = 0x30
+ABS_MT_POSITION_X = 0x35
+ABS_MT_POSITION_Y = 0x36
+ABS_MT_TRACKING_ID = 0x39
+ABS_MT_PRESSURE = 0x3a
+
+TAP_TIME = 0.05
+LONG_PRESS_TIME = 1.0
+# Sleep until this time in second before the scheduled time, then spin to wake up on time.
+SPIN_TIME = 0.002
+
+_DEVICE_PATTERN = re.compile(r'add device \d+: (\S+)')
+_SECTION_PATTERN = re.compile(r'^\s*([A-Z]+) \(([0-9a-f]{4})\):(.*)$')
+_ABS_PATTERN = re.compile(r'([0-9a-f]{4})\s*:\s*value (-?\d+), min (-?\d+), max (-?\d+)')
+
+
+class InputDevice(object):
+    """
+    An input device of 'getevent -p'.
+    """
+
+    def __init__(self, path, name, keys, axes, props):
+        """
+        :param path: device path, like '/dev/input/event2'
+        :param name: device name
+        :param keys: set of supported EV_KEY codes
+        :param axes: dict of EV_ABS code to tuple of min and max
+        :param props: list of input properties, like 'INPUT_PROP_DIRECT'
+        """
+        self.path = path
+        self.name = name
+        self.keys = keys
+        self.axes = axes
+        self.props = props
+
+    @property
+    def is_touchscreen(self):
+        return ABS_MT_POSITION_X in self.axes and ABS_MT_POSITION_Y in self.axes
+
+
+def parse_getevent(output):
+    """
+    Parse the output of 'getevent -p'.
+
+    :param output: the output string
+    :return: list of InputDevice
+    """
+    devices = []
+    for block in output.split('add device')[1:]:
+        block = 'add device' + block
+        path = _DEVICE_PATTERN.match(block).group(1)
+        name = ''
+        keys = set()
+        axes = {}
+        props = []
+        section = None
+        for line in block.splitlines()[1:]:
+            stripped = line.strip()
+            if stripped.startswith('name:'):
+                name = stripped[5:].strip().strip('"')
+                continue
+            if stripped == 'input props:':
+                section = 'PROPS'
+                continue
+            match = _SECTION_PATTERN.match(line)
+            if match is not None:
+                section = match.group(1)
+                stripped = match.group(3)
+            if section == 'KEY':
+                keys.update(int(code, 16) for code in stripped.split()
+                            if re.match(r'^[0-9a-f]{4}$', code))
+            elif section == 'ABS':
+                for code, _, minimum, maximum in _ABS_PATTERN.findall(stripped):
+                    axes[int(code, 16)] = (int(minimum), int(maximum))
+            elif section == 'PROPS' and stripped and stripped != '<none>':
+                props.append(stripped)
+        devices.append(InputDevice(path, name, keys, axes, props))
+    return devices
+
+
+class SendEventInput(object):
+    """
+    Touch input backend writing events with 'sendevent' in a persistent shell session.
+    """
+
+    def __init__(self, udid, display_size):
+        """
+        :param udid: device serial number
+        :param display_size: tuple of display width and height in pixel
+        """
+        self._udid = udid
+        self._display_size = display_size
+        self._device = self._find_touchscreen()
+        self._session = adb.ShellSession(udid)
+        self._tracking_id = 0
+        self._latencies = []
+
+    def _find_touchscreen(self):
+        result = adb.shell('getevent -p', self._udid)
+        if result[0] != 0:
+            raise Exception('Failed to list input devices: %s' % result[1])
+        touchscreens = [d for d in parse_getevent(result[1]) if d.is_touchscreen]
+        if len(touchscreens) < 1:
+            raise Exception('Can not find touchscreen input device.')
+        # Prefer the direct input device, the others may be touchpads or styluses.
+        touchscreens.sort(key=lambda d: 'INPUT_PROP_DIRECT' not in d.props)
+        return touchscreens[0]
+
+    @property
+    def input_device(self):
+        return self._device
+
+    def tap(self, x, y):
+        self.play([(0, x, y), (TAP_TIME, x, y)])
+
+    def long_press(self, x, y, duration=LONG_PRESS_TIME):
+        self.play([(0, x, y), (duration, x, y)])
+
+    def play(self, points):
+        """
+        Touch down at the first point, move through the points at their time and touch up at
+        the last one.
+
+        :param points: list of tuples of time in second from the start, x and y in pixel
+        :return: tuple of requested and achieved duration in second
+        """
+        start = time.time()
+        for i, (t, x, y) in enumerate(points):
+            events = self._position_events(x, y)
+            if i == 0:
+                events = self._down_events() + events
+            self._inject(start + t, events + self._sync_events())
+        self._inject(start + points[-1][0], self._up_events() + self._sync_events())
+        return points[-1][0] - points[0][0], time.time() - start
+
+    def stats(self):
+        """
+        The injection latency and jitter in millisecond. Latency is the time from the scheduled
+        time of a group of events to the events written on the device, jitter is its standard
+        deviation.
+
+        :return: dict with 'count', 'mean', 'p50', 'p90', 'max' and 'jitter'.
+        """
+        if not self._latencies:
+            return {'count': 0}
+        values = numpy.array(self._latencies) * 1000.0
+        p50, p90 = numpy.percentile(values, [50, 90])
+        return {'count': len(values), 'mean': values.mean(), 'p50': p50, 'p90': p90,
+                'max': values.max(), 'jitter': values.std()}
+
+    def reset_stats(self):
+        self._latencies = []
+
+    def close(self):
+        self._session.close()
+
+    def _inject(self, at, events):
+        delay = at - time.time() - SPIN_TIME
+        if delay > 0:
+            time.sleep(delay)
+        while time.time() < at:
+            pass
+        script = '; '.join('sendevent %s %d %d %d' % ((self._device.path,) + e) for e in events)
+        result = self._session.run(script)
+        if result is None:
+            raise Exception('Input shell session is closed.')
+        if result[0] != 0:
+            raise Exception('Failed to inject input events: %s' % result[1])
+        self._latencies.append(time.time() - at)
+
+    def _down_events(self):
+        self._tracking_id = (self._tracking_id + 1) % 0xffff
+        events = []
+        if ABS_MT_SLOT in self._device.axes:
+            events.append((EV_ABS, ABS_MT_SLOT, 0))
+        events.append((EV_ABS, ABS_MT_TRACKING_ID, self._tracking_id))
+        if BTN_TOUCH in self._device.keys:
+            events.append((EV_KEY, BTN_TOUCH, 1))
+        if ABS_MT_TOUCH_MAJOR in self._device.axes:
+            events.append((EV_ABS, ABS_MT_TOUCH_MAJOR, self._axis_middle(ABS_MT_TOUCH_MAJOR)))
+        if ABS_MT_PRESSURE in self._device.axes:
+            events.append((EV_ABS, ABS_MT_PRESSURE, self._axis_middle(ABS_MT_PRESSURE)))
+        return events
+
+    def _position_events(self, x, y):
+        return [(EV_ABS, ABS_MT_POSITION_X, self._raw(ABS_MT_POSITION_X, x, 0)),
+                (EV_ABS, ABS_MT_POSITION_Y, self._raw(ABS_MT_POSITION_Y, y, 1))]
+
+    def _up_events(self):
+        events = [(EV_ABS, ABS_MT_TRACKING_ID, -1)]
+        if BTN_TOUCH in self._device.keys:
+            events.append((EV_KEY, BTN_TOUCH, 0))
+        return events
+
+    @staticmethod
+    def _sync_events():
+        return [(EV_SYN, SYN_REPORT, 0)]
+
+    def _raw(self, code, pixel, axis):
+        # The same scale as the InputReader of android: display size / (max - min + 1)
+        minimum, maximum = self._device.axes[code]
+        raw = minimum + float(pixel) * (maximum - minimum + 1) / self._display_size[axis]
+        return int(min(max(round(raw), minimum), maximum))
+
+    def _axis_middle(self, code):
+        minimum, maximum = self._device.axes[code]
+        return (minimum + maximum) // 2
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Keep appium sessions alive across tests.
+
+Creating a WebDriver session costs several seconds, a DevicePool creates one session per device
+and configuration and hands it out again after the app is restarted through adb. Sessions which
+fail the health check are evicted and created again.
+
+Example::
+    pool = DevicePool(package='com.android.launcher3', activity='Launcher')
+
+    with pool.device() as d:
+        d.press_home()
+
+    pool.close()
+"""
+
+import threading
+from contextlib import contextmanager
+
+from casium import adb
+from casium.device import Device
+
+
+class _PoolEntry(object):
+    def __init__(self, key, device, clear_data):
+        self.key = key
+        self.device = device
+        self.clear_data = clear_data
+        self.in_use = True
+
+
+def _pool_key(device_kwargs):
+    return repr(sorted(device_kwargs.items()))
+
+
+class DevicePool(object):
+    """
+    A pool of connected Device objects, shared by tests and modules.
+    """
+
+    def __init__(self, **device_kwargs):
+        """
+        :param device_kwargs: default arguments to create Device, like package and activity.
+        """
+        self._device_kwargs = device_kwargs
+        self._entries = []
+        self._lock = threading.Lock()
+
+    def acquire(self, reset=True, **device_kwargs):
+        """
+        Take a healthy device from the pool, or connect a new one if there is no idle device with
+        the same arguments.
+
+        :param reset: Restart the test app through adb before handing out a pooled device.
+        :param device_kwargs: arguments to create Device, override the pool defaults.
+        :return: Device
+        """
+        kwargs = dict(self._device_kwargs)
+        kwargs.update(device_kwargs)
+        kwargs.pop('lazy', None)
+        key = _pool_key(kwargs)
+
+        while True:
+            entry = self._take_idle(key)
+            if entry is None:
+                break
+            if not self._is_healthy(entry.device):
+                self._remove(entry)
+                continue
+            if reset:
+                try:
+                    entry.device.restart_app(entry.clear_data)
+                except Exception:
+                    self._remove(entry)
+                    continue
+            return entry.device
+
+        device = Device(**kwargs)
+        with self._lock:
+            self._entries.append(_PoolEntry(key, device, kwargs.get('auto_reset', False)))
+        return device
+
+    def release(self, device, broken=False):
+        """
+        Give a device back to the pool.
+
+        :param device: Device from acquire().
+        :param broken: Close the session instead of reusing it.
+        """
+        entry = self._find(device)
+        if entry is None:
+            return
+        if broken:
+            self._remove(entry)
+        else:
+            entry.in_use = False
+
+    def evict(self, device):
+        """
+        Close the session of a device and remove it from the pool.
+        """
+        self.release(device, broken=True)
+
+    @contextmanager
+    def device(self, reset=True, **device_kwargs):
+        """
+        Acquire a device for a with block, it is evicted if the block raises a WebDriver error.
+        """
+        device = self.acquire(reset, **device_kwargs)
+        broken = False
+        try:
+            yield device
+        except Exception:
+            broken = not self._is_healthy(device)
+            raise
+        finally:
+            self.release(device, broken)
+
+    def close(self):
+        """
+        Close all the sessions in the pool.
+        """
+        with self._lock:
+            entries = self._entries
+            self._entries = []
+        for entry in entries:
+            self._quit(entry.device)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _take_idle(self, key):
+        with self._lock:
+            for entry in self._entries:
+                if entry.key == key and not entry.in_use:
+                    entry.in_use = True
+                    return entry
+        return None
+
+    def _find(self, device):
+        with self._lock:
+            for entry in self._entries:
+                if entry.device is device:
+                    return entry
+        return None
+
+    def _remove(self, entry):
+        with self._lock:
+            if entry in self._entries:
+                self._entries.remove(entry)
+        self._quit(entry.device)
+
+    @staticmethod
+    def _quit(device):
+        try:
+            device.disconnect()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _is_healthy(device):
+        """
+        Check the adb transport and the appium session with one cheap round trip each.
+        """
+        returncode, output = adb.shell('echo ok', device._udid)
+        if returncode != 0 or output.strip() != 'ok':
+            return False
+        try:
+            device._driver.orientation
+        except Exception:
+            return False
+        return True
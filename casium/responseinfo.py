@@ -1,51 +1,41 @@
 from collections import OrderedDict
 from os import path
 
-import numpy
 from openpyxl import load_workbook, Workbook
 from openpyxl.styles import Font
 from openpyxl.styles.numbers import FORMAT_NUMBER_00
 from openpyxl.utils import get_column_letter
 
 from casium import adb
+from casium.stats import trim_mean_sd
 
-def trimmean(arr, percent):
-    if len(arr) == 0:
-        return 0
-
-    sorted_arr = sorted(arr)
-    n = len(sorted_arr)
-    k = int(round(n * percent))
-    return numpy.mean(sorted_arr[k:n - k])
-
-def trimsd(arr, percent):
-    if len(arr) == 0:
-        return 0
-
-    sorted_arr = sorted(arr)
-    n = len(sorted_arr)
-    k = int(round(n * percent))
-    trim_arr = sorted_arr[k:n - k]
-
-    mean = trimmean(arr, percent)
-    deviation_arr = [(v - mean) * (v - mean) for v in trim_arr]
-    return numpy.sqrt(numpy.mean(deviation_arr))
+START_RESPONSE_INFO_COMMAND = 'atrace gfx input --async_start'
+STOP_RESPONSE_INFO_COMMAND = 'atrace gfx input --async_stop'
 
 def cmd_start_response_info(udid):
-    adb.shell('atrace gfx input --async_start', udid)
+    adb.shell(START_RESPONSE_INFO_COMMAND, udid)
 
 def cmd_stop_response_info(udid):
-    return adb.shell('atrace gfx input --async_stop', udid)[1]
+    return adb.shell(STOP_RESPONSE_INFO_COMMAND, udid)[1]
 
 class ResponseData(object):
     def __init__(self, row_data, package):
+        """
+        :param row_data: atrace output, either a string or an iterable of lines like
+        adb.ShellStream which is parsed while arriving and not kept.
+        :param package: the test package name
+        """
         self.row_data = row_data
         self.package = package
         self.input_datas = []
         self.surface_flinger_datas = []
 
     def parse_row_data(self):
-        rows = self.row_data.split('\n')
+        if isinstance(self.row_data, basestring):
+            rows = self.row_data.split('\n')
+        else:
+            rows = self.row_data
+            self.row_data = None
         for row in rows:
             input_pos = row.find('InputDispatcher')
             if input_pos != -1:
@@ -76,11 +66,19 @@ class ResponseInfo(object):
         self._package_name = package_name
         self._datas = []
 
-    def trace_begin(self, udid):
-        cmd_start_response_info(udid)
+    def begin_commands(self):
+        return [START_RESPONSE_INFO_COMMAND]
+
+    def end_commands(self):
+        # The huge trace is streamed in trace_end().
+        return []
 
-    def trace_end(self, udid):
-        data = ResponseData(cmd_stop_response_info(udid), self._package_name)
+    def trace_begin(self, udid, results=None):
+        if results is None:
+            adb.shell_batch(self.begin_commands(), udid)
+
+    def trace_end(self, udid, results=None):
+        data = ResponseData(adb.shell_stream(STOP_RESPONSE_INFO_COMMAND, udid), self._package_name)
         self._datas += [data]
         data.parse_row_data()
 
@@ -99,16 +97,15 @@ class MetricsWriter(object):
     def dump(self):
         values = OrderedDict()
 
-        avg_response = trimmean([d.response_time for d in self._datas], 0.1)
-        sd_response = trimsd([d.response_time for d in self._datas], 0.1)
+        avg_response, sd_response = trim_mean_sd([d.response_time for d in self._datas], 0.1)
         values['Response'] = (avg_response, sd_response)
 
-        avg_surface_flinger = trimmean([d.surface_flinger_time for d in self._datas], 0.1)
-        sd_surface_flinger = trimsd([d.surface_flinger_time for d in self._datas], 0.1)
+        avg_surface_flinger, sd_surface_flinger = trim_mean_sd(
+            [d.surface_flinger_time for d in self._datas], 0.1)
         values['Surface Flinger'] = (avg_surface_flinger, sd_surface_flinger)
 
-        avg_total = trimmean([(d.response_time + d.surface_flinger_time) for d in self._datas], 0.1)
-        sd_total = trimsd([(d.response_time + d.surface_flinger_time) for d in self._datas], 0.1)
+        avg_total, sd_total = trim_mean_sd(
+            [(d.response_time + d.surface_flinger_time) for d in self._datas], 0.1)
         values['Total'] = (avg_total, sd_total)
 
         self._metrics.add('response', values, self._responseinfo)
@@ -168,30 +165,20 @@ class ExcelWriter(object):
 
         row = self.sum_row['next']
 
-
-
-
-        avg_surface_flinger = trimmean([d.surface_flinger_time for d in self._datas], 0.1)
-        sd_surface_flinger = trimsd([d.surface_flinger_time for d in self._datas], 0.1)
-
-        avg_total = trimmean([(d.response_time + d.surface_flinger_time) for d in self._datas], 0.1)
-        sd_total = trimsd([(d.response_time + d.surface_flinger_time) for d in self._datas], 0.1)
-
         sum_ws['A%s' % row] = self._name
-        avg_response = trimmean([d.response_time for d in self._datas], 0.1)
-        sd_response = trimsd([d.response_time for d in self._datas], 0.1)
+        avg_response, sd_response = trim_mean_sd([d.response_time for d in self._datas], 0.1)
         sum_ws['B%s' % row] = avg_response
         sum_ws['B%s' % row].number_format = FORMAT_NUMBER_00
         sum_ws['C%s' % row] = sd_response
         sum_ws['C%s' % row].number_format = FORMAT_NUMBER_00
-        avg_surface_flinger = trimmean([d.surface_flinger_time for d in self._datas], 0.1)
-        sd_surface_flinger = trimsd([d.surface_flinger_time for d in self._datas], 0.1)
+        avg_surface_flinger, sd_surface_flinger = trim_mean_sd(
+            [d.surface_flinger_time for d in self._datas], 0.1)
         sum_ws['D%s' % row] = avg_surface_flinger
         sum_ws['D%s' % row].number_format = FORMAT_NUMBER_00
         sum_ws['E%s' % row] = sd_surface_flinger
         sum_ws['E%s' % row].number_format = FORMAT_NUMBER_00
-        avg_total = trimmean([(d.response_time + d.surface_flinger_time) for d in self._datas], 0.1)
-        sd_total = trimsd([(d.response_time + d.surface_flinger_time) for d in self._datas], 0.1)
+        avg_total, sd_total = trim_mean_sd(
+            [(d.response_time + d.surface_flinger_time) for d in self._datas], 0.1)
         sum_ws['F%s' % row] = avg_total
         sum_ws['F%s' % row].number_format = FORMAT_NUMBER_00
         sum_ws['G%s' % row] = sd_total
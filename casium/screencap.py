@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Screenshots from the raw framebuffer output of 'adb exec-out screencap'.
+
+The raw output is a small header and the pixels, which are mapped into a NumPy array without
+copying, so no PNG is encoded on the device, base64-encoded by appium and decoded on host.
+A PNG is only encoded on host when it is written to a file.
+
+Example::
+    image = d.screenshot()  # numpy array of height x width x channels
+    d.screenshot('failure.png')
+
+    capture = d.start_screen_capture(frames=30)
+    ...
+    for timestamp, image in d.stop_screen_capture():
+        ...
+"""
+
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+import numpy
+
+from casium import adb
+
+SCREENCAP_COMMAND = 'screencap'
+
+# Pixel format of the header to bytes per pixel: RGBA_8888, RGBX_8888, RGB_888 and RGB_565.
+PIXEL_FORMATS = {1: 4, 2: 4, 3: 3, 4: 2}
+PIXEL_FORMAT_RGB_565 = 4
+
+# Width, height and format, Android P and later appends the color space.
+HEADER_SIZES = (12, 16)
+
+PNG_COMPRESS_LEVEL = 1
+DEFAULT_CAPTURE_FRAMES = 30
+
+_PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+_PNG_COLOR_TYPES = {1: 0, 3: 2, 4: 6}
+
+
+def parse_screencap(data):
+    """
+    Parse the raw output of screencap.
+
+    :param data: the output string, the returned array shares its memory.
+    :return: read-only uint8 numpy array of height x width x channels, RGBA for RGBA_8888 and
+    RGBX_8888, RGB for RGB_888 and RGB_565, which is converted.
+    """
+    if len(data) < HEADER_SIZES[0]:
+        raise Exception('Invalid screencap output of %d bytes' % len(data))
+    width, height, pixel_format = struct.unpack_from('<III', data)
+    if pixel_format not in PIXEL_FORMATS:
+        raise Exception('Unsupported screencap pixel format %d' % pixel_format)
+    size = width * height * PIXEL_FORMATS[pixel_format]
+    offset = len(data) - size
+    if offset not in HEADER_SIZES:
+        raise Exception('Invalid screencap output of %d bytes for %dx%d' %
+                        (len(data), width, height))
+
+    pixels = numpy.frombuffer(data, numpy.uint8, size, offset)
+    if pixel_format == PIXEL_FORMAT_RGB_565:
+        return _rgb565_to_rgb(pixels.view('<u2').reshape(height, width))
+    return pixels.reshape(height, width, PIXEL_FORMATS[pixel_format])
+
+
+def _rgb565_to_rgb(pixels):
+    image = numpy.empty(pixels.shape + (3,), numpy.uint8)
+    image[..., 0] = (pixels >> 11 & 0x1f) * 255 // 0x1f
+    image[..., 1] = (pixels >> 5 & 0x3f) * 255 // 0x3f
+    image[..., 2] = (pixels & 0x1f) * 255 // 0x1f
+    return image
+
+
+def encode_png(image, level=PNG_COMPRESS_LEVEL):
+    """
+    Encode an image as PNG.
+
+    :param image: uint8 numpy array of height x width (x channels), 1, 3 or 4 channels.
+    :param level: zlib compression level, the default favors speed over size.
+    :return: PNG data string
+    """
+    height, width = image.shape[:2]
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    if channels not in _PNG_COLOR_TYPES:
+        raise Exception('Can not encode image of %d channels as PNG' % channels)
+    # Every row starts with the filter type byte, 0 for no filter.
+    rows = numpy.zeros((height, width * channels + 1), numpy.uint8)
+    rows[:, 1:] = image.reshape(height, width * channels)
+    header = struct.pack('>IIBBBBB', width, height, 8, _PNG_COLOR_TYPES[channels], 0, 0, 0)
+    return ''.join([_PNG_SIGNATURE, _png_chunk('IHDR', header),
+                    _png_chunk('IDAT', zlib.compress(rows.tostring(), level)),
+                    _png_chunk('IEND', '')])
+
+
+def _png_chunk(chunk_type, data):
+    crc = zlib.crc32(chunk_type + data) & 0xffffffff
+    return ''.join([struct.pack('>I', len(data)), chunk_type, data, struct.pack('>I', crc)])
+
+
+def write_png(filename, image):
+    """
+    Write an image into a PNG file.
+
+    :param filename: the PNG file path
+    :param image: numpy array, see encode_png()
+    """
+    with open(filename, 'wb') as png_file:
+        png_file.write(encode_png(image))
+
+
+def screenshot(udid=None):
+    """
+    Take a raw screenshot.
+
+    :param udid: device serial number
+    :return: numpy array, see parse_screencap()
+    """
+    result = adb.exec_out(SCREENCAP_COMMAND, udid)
+    if result[0] != 0:
+        raise Exception('Failed to take screenshot: %s' % result[1])
+    return parse_screencap(result[1])
+
+
+class ScreenCapture(object):
+    """
+    Continuous raw screenshots in a background thread, the last frames are kept in a ring
+    buffer.
+    """
+
+    def __init__(self, udid=None, frames=DEFAULT_CAPTURE_FRAMES, interval=0, transform=None):
+        """
+        :param udid: device serial number
+        :param frames: the number of the last frames to keep
+        :param interval: the minimal time between two captures in second, 0 to capture as fast
+        as the device can.
+        :param transform: function to apply to every captured numpy array before it is kept,
+        like reducing it to save memory. None to keep the screenshots.
+        """
+        self._udid = udid
+        self._interval = interval
+        self._transform = transform
+        self._frames = deque(maxlen=frames)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.error = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return self
+        self._stopped.clear()
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name='screen-capture-%s' % self._udid)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop capturing, the captured frames are kept.
+
+        :return: list of tuples of timestamp and numpy array, see frames().
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self.frames()
+
+    def frames(self):
+        """
+        :return: list of tuples of the host time in second when the capture was requested and
+        the numpy array, the oldest first.
+        """
+        with self._lock:
+            return list(self._frames)
+
+    def latest(self):
+        """
+        :return: tuple of timestamp and numpy array of the last frame, None if no frame.
+        """
+        with self._lock:
+            return self._frames[-1] if self._frames else None
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            start = time.time()
+            try:
+                image = screenshot(self._udid)
+                if self._transform is not None:
+                    image = self._transform(image)
+            except Exception as e:
+                self.error = str(e)
+                return
+            with self._lock:
+                self._frames.append((start, image))
+            delay = start + self._interval - time.time()
+            if delay > 0:
+                self._stopped.wait(delay)
@@ -0,0 +1,345 @@
+"""
+Trimmed statistics of profiling samples.
+
+The samples are sorted once into a Sample, then any number of trimmed means, trimmed standard
+deviations and percentiles are read from it. Histograms are supported without expanding them
+into samples by the weighted functions, and Histogram keeps the distribution of any number of
+samples in fixed buckets which merge across iterations, devices and runs.
+
+Example::
+    sample = Sample(frame_ms)
+    mean_90th, sd_90th = sample.trimmean(0.05), sample.trimsd(0.05)
+    mean, sd = trim_mean_sd(response_ms, 0.1)
+    percentile_90th = merge_histograms([histogram1, histogram2]).percentile(90)
+"""
+
+import numpy
+
+
+class Sample(object):
+    """
+    Values sorted once for trimmed statistics.
+    """
+
+    def __init__(self, values):
+        """
+        :param values: list or numpy array of numbers
+        """
+        self.values = numpy.sort(numpy.asarray(values, dtype=float), kind='mergesort')
+
+    def __len__(self):
+        return len(self.values)
+
+    def trimmed(self, percent):
+        """
+        :param percent: the ratio to trim at both ends
+        :return: numpy array of the sorted values left after trimming.
+        """
+        n = len(self.values)
+        k = int(round(n * percent))
+        return self.values[k:n - k]
+
+    def trimmean(self, percent):
+        """
+        :return: the mean after trimming percent at both ends, 0 if no value.
+        """
+        if len(self.values) == 0:
+            return 0
+        return numpy.mean(self.trimmed(percent))
+
+    def trimsd(self, percent):
+        """
+        :return: the standard deviation after trimming percent at both ends, 0 if no value.
+        """
+        if len(self.values) == 0:
+            return 0
+        return numpy.std(self.trimmed(percent))
+
+    def trimmax(self, percent):
+        """
+        :return: the rounded maximum after trimming percent at the top, like the percentile of
+        1 - percent. 0 if no value.
+        """
+        n = len(self.values)
+        if n == 0:
+            return 0
+        k = int(round(n * percent))
+        return round(self.values[n - k - 1])
+
+    def percentiles(self, q):
+        """
+        :param q: list of percentiles in 0 to 100
+        :return: numpy array of the linear interpolated percentiles like numpy.percentile(),
+        zeros if no value.
+        """
+        n = len(self.values)
+        if n == 0:
+            return numpy.zeros(len(q))
+        # Interpolate on the sorted values, numpy.percentile() would partition them again.
+        return numpy.interp(numpy.asarray(q, dtype=float) / 100 * (n - 1), numpy.arange(n),
+                            self.values)
+
+
+def trimsd(arr, percent):
+    return Sample(arr).trimsd(percent)
+
+
+def trim_mean_sd(arr, percent):
+    """
+    :return: tuple of trimmean() and trimsd() with one sort.
+    """
+    sample = Sample(arr)
+    return sample.trimmean(percent), sample.trimsd(percent)
+
+
+def _trimmed_counts(counts, percent):
+    """
+    The counts of every value left after trimming, like Sample.trimmed() on the values expanded
+    by their counts.
+    """
+    n = counts.sum()
+    k = int(round(n * percent))
+    ends = numpy.cumsum(counts)
+    starts = ends - counts
+    return numpy.clip(numpy.minimum(ends, n - k) - numpy.maximum(starts, k), 0, None)
+
+
+def weighted_trimmean(values, counts, percent):
+    """
+    trimmean() of a histogram without expanding it.
+
+    :param values: sorted numpy array of the distinct values
+    :param counts: numpy array of the count of every value
+    :param percent: the ratio to trim at both ends
+    """
+    if counts.sum() == 0:
+        return 0
+
+    weights = _trimmed_counts(counts, percent)
+    if weights.sum() == 0:
+        return float('nan')
+    return float((values * weights).sum()) / weights.sum()
+
+
+def weighted_trimsd(values, counts, percent):
+    """
+    trimsd() of a histogram without expanding it, see weighted_trimmean().
+    """
+    if counts.sum() == 0:
+        return 0
+
+    weights = _trimmed_counts(counts, percent)
+    if weights.sum() == 0:
+        return float('nan')
+    mean = float((values * weights).sum()) / weights.sum()
+    return numpy.sqrt(((values - mean) ** 2 * weights).sum() / weights.sum())
+
+
+def weighted_trimmax(values, counts, percent):
+    """
+    trimmax() of a histogram without expanding it, see weighted_trimmean().
+    """
+    n = counts.sum()
+    if n == 0:
+        return 0
+    k = int(round(n * percent))
+    # The value at rank n - k - 1 is in the first bucket which ends after it.
+    return round(values[numpy.searchsorted(numpy.cumsum(counts), n - k)])
+
+
+# Values are counted in units of 1 / HISTOGRAM_UNITS_PER_MS ms, exactly below
+# 10 ** HISTOGRAM_DIGITS units and with HISTOGRAM_DIGITS significant decimal digits above, like
+# HdrHistogram. Decimal buckets keep the integer ms values of 'dumpsys gfxinfo' exact up to 999ms
+# and the multiples of 10ms up to 9990ms, other values are rounded down by less than 1%.
+HISTOGRAM_UNITS_PER_MS = 100
+HISTOGRAM_DIGITS = 3
+HISTOGRAM_MAX = 60000
+_EXACT_UNITS = 10 ** HISTOGRAM_DIGITS
+_DECADE_BUCKETS = _EXACT_UNITS - _EXACT_UNITS // 10
+_DECADES = 10 ** numpy.arange(HISTOGRAM_DIGITS, 18, dtype=numpy.int64)
+
+
+def _bucket_index(units):
+    digits = numpy.searchsorted(_DECADES, units, side='right')
+    significand = units // 10 ** digits
+    return numpy.where(digits == 0, units,
+                       _EXACT_UNITS + (digits - 1) * _DECADE_BUCKETS +
+                       significand - _EXACT_UNITS // 10)
+
+
+def _bucket_value(index):
+    digits = numpy.maximum((index - _EXACT_UNITS) // _DECADE_BUCKETS + 1, 0)
+    significand = (index - _EXACT_UNITS) % _DECADE_BUCKETS + _EXACT_UNITS // 10
+    units = numpy.where(digits == 0, index, significand * 10 ** digits)
+    return units / float(HISTOGRAM_UNITS_PER_MS)
+
+
+_HISTOGRAM_MAX_UNITS = HISTOGRAM_MAX * HISTOGRAM_UNITS_PER_MS
+_HISTOGRAM_BUCKETS = int(_bucket_index(numpy.array([_HISTOGRAM_MAX_UNITS]))[0]) + 1
+_BUCKET_VALUES = _bucket_value(numpy.arange(_HISTOGRAM_BUCKETS))
+
+
+class Histogram(object):
+    """
+    Histogram of fixed decimal log-linear buckets like HdrHistogram, which keeps the distribution
+    of any number of values in constant memory. Histograms of iterations, devices or runs are
+    merged by adding their counts, so the statistics of all the values do not need the values.
+
+    The values are in ms, rounded to the unit, up to HISTOGRAM_MAX, the values out of it are
+    counted in the first or the last bucket. The statistics use the lowest value of the buckets,
+    which is the value itself for the exact values, see HISTOGRAM_DIGITS.
+    """
+
+    def __init__(self, counts=None):
+        """
+        :param counts: numpy array of the bucket counts, None for an empty histogram.
+        """
+        if counts is None:
+            counts = numpy.zeros(_HISTOGRAM_BUCKETS, dtype=numpy.int64)
+        self.counts = counts
+
+    def add(self, values, counts=None):
+        """
+        :param values: list or numpy array of values
+        :param counts: the count of every value, None to count every value once.
+        :return: self
+        """
+        values = numpy.asarray(values, dtype=float)
+        units = numpy.clip(numpy.round(values * HISTOGRAM_UNITS_PER_MS), 0, _HISTOGRAM_MAX_UNITS)
+        index = _bucket_index(units.astype(numpy.int64))
+        self.counts += numpy.bincount(index, counts, _HISTOGRAM_BUCKETS).astype(numpy.int64)
+        return self
+
+    def merge(self, other):
+        """
+        Add the counts of another histogram.
+
+        :return: self
+        """
+        self.counts += other.counts
+        return self
+
+    def __add__(self, other):
+        return Histogram(self.counts + other.counts)
+
+    def copy(self):
+        return Histogram(self.counts.copy())
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    def count_above(self, threshold):
+        """
+        :return: the count of the values in the buckets above threshold.
+        """
+        return int(self.counts[_BUCKET_VALUES > threshold].sum())
+
+    def trimmean(self, percent):
+        return weighted_trimmean(_BUCKET_VALUES, self.counts, percent)
+
+    def trimsd(self, percent):
+        return weighted_trimsd(_BUCKET_VALUES, self.counts, percent)
+
+    def trimmax(self, percent):
+        """
+        :return: Sample.trimmax() of the values.
+        """
+        return round(self._value_at(int(round(self.total * percent))))
+
+    def percentile(self, q):
+        """
+        :param q: percentile in 0 to 100
+        :return: the value at the rank of Sample.trimmax((100 - q) / 100.0), not rounded. 0 if
+        empty.
+
+        Example::
+            >>> values = [1, 2, 3, 4, 5]
+            >>> Histogram().add(values).percentile(90) == Sample(values).trimmax(0.1)
+            True
+        """
+        # Trim from the exact count, 1 - q / 100.0 is not exact and rounds to the other rank.
+        return self._value_at(int(round(self.total * (100 - q) / 100.0)))
+
+    def _value_at(self, k):
+        """
+        :return: the value left at the top after trimming k values, 0 if empty.
+        """
+        n = self.total
+        if n == 0:
+            return 0
+        rank = max(n - k, 1)
+        return _BUCKET_VALUES[numpy.searchsorted(numpy.cumsum(self.counts), rank)]
+
+    def percentiles(self, q):
+        """
+        :param q: list of percentiles in 0 to 100
+        :return: list of the values, see percentile().
+        """
+        return [self.percentile(p) for p in q]
+
+
+def merge_histograms(histograms):
+    """
+    :param histograms: iterable of Histogram
+    :return: new Histogram of all the values.
+    """
+    merged = Histogram()
+    for histogram in histograms:
+        merged.merge(histogram)
+    return merged
+
+
+class Moments(object):
+    """
+    Running count, mean, standard deviation, minimum and maximum in constant memory. Batches of
+    values and other Moments are merged with the parallel algorithm of Chan et al., which is
+    numerically stable unlike summing the squares.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def add(self, values):
+        """
+        :param values: list or numpy array of values
+        :return: self
+        """
+        values = numpy.asarray(values, dtype=float)
+        if len(values) == 0:
+            return self
+        batch = Moments()
+        batch.count = len(values)
+        batch.mean = float(values.mean())
+        batch.m2 = float(((values - batch.mean) ** 2).sum())
+        batch.min = float(values.min())
+        batch.max = float(values.max())
+        return self.merge(batch)
+
+    def merge(self, other):
+        """
+        Add the values of another Moments.
+
+        :return: self
+        """
+        count = self.count + other.count
+        if other.count == 0:
+            return self
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def sd(self):
+        """
+        :return: the population standard deviation like numpy.std(), 0 if no value.
+        """
+        return numpy.sqrt(self.m2 / self.count) if self.count else 0
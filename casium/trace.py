@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in tracing of Device actions, adb commands and WebDriver requests.
+
+Every traced call records a span with its wall time. Spans nest per thread, so an action span
+is the parent of the adb commands and WebDriver requests it made, and the fixed auto wait sleep
+is recorded as a 'wait' child and summed into the 'wait' field of its parent.
+
+Example::
+    from casium import trace
+
+    trace.enable(output='trace.jsonl')
+    d = Device(package='com.android.launcher3', activity='Launcher')
+    d.swipe('90%', '50%', '10%', '50%')
+    print trace.summary()
+"""
+
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy
+
+# Histogram bucket upper bounds in millisecond, the last bucket is unbounded.
+HISTOGRAM_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+_enabled = False
+_keep = True
+_output = None
+_spans = []
+_lock = threading.Lock()
+_local = threading.local()
+_ids = itertools.count(1)
+
+
+class Span(object):
+    """
+    A timed step, like a Device action, an adb command or a WebDriver request.
+    """
+
+    __slots__ = ('id', 'parent_id', 'name', 'category', 'thread', 'start', 'duration', 'wait',
+                 'attrs')
+
+    def __init__(self, name, category, parent_id, attrs):
+        self.id = next(_ids)
+        self.parent_id = parent_id
+        self.name = name
+        self.category = category
+        self.thread = threading.current_thread().name
+        self.start = time.time()
+        self.duration = None
+        self.wait = 0.0
+        self.attrs = attrs
+
+    def set(self, key, value):
+        """
+        Set an attribute of the span, like the bytes transferred.
+        """
+        self.attrs[key] = value
+
+    def to_dict(self):
+        result = OrderedDict([('id', self.id), ('parent', self.parent_id), ('name', self.name),
+                              ('category', self.category), ('thread', self.thread),
+                              ('start', self.start), ('duration', self.duration)])
+        if self.wait:
+            result['wait'] = self.wait
+        result.update(self.attrs)
+        return result
+
+
+class _NullSpan(object):
+    """
+    The span returned when tracing is disabled, all methods do nothing.
+    """
+
+    def set(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+class _SpanContext(object):
+    def __init__(self, name, category, attrs):
+        self._name = name
+        self._category = category
+        self._attrs = attrs
+        self._span = None
+
+    def __enter__(self):
+        stack = _stack()
+        parent_id = stack[-1].id if stack else None
+        self._span = Span(self._name, self._category, parent_id, self._attrs)
+        stack.append(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        span = self._span
+        span.duration = time.time() - span.start
+        if exc_type is not None:
+            span.attrs['error'] = exc_type.__name__
+        stack = _stack()
+        stack.pop()
+        if span.category == 'wait' and stack:
+            stack[-1].wait += span.duration
+        _finish(span)
+        return False
+
+
+def enable(enabled=True, output=None, keep=True):
+    """
+    Enable or disable tracing.
+
+    :param enabled: False to stop recording spans.
+    :param output: JSON lines file path, every finished span is appended to it.
+    :param keep: Keep the finished spans in memory for histograms(), turn off for very long runs
+    which only need the output file.
+    """
+    global _enabled, _keep, _output
+    with _lock:
+        if _output is not None:
+            _output.close()
+            _output = None
+        if enabled and output is not None:
+            _output = open(output, 'a', 1)
+        _keep = keep
+        _enabled = enabled
+
+
+def is_enabled():
+    return _enabled
+
+
+def span(name, category, **attrs):
+    """
+    Record a span around a with block.
+
+    Example::
+        with trace.span('launch', 'step', page=1) as s:
+            ...
+            s.set('items', 3)
+
+    :param name: span name, spans are aggregated by name.
+    :param category: span category, like 'device', 'adb', 'webdriver' or 'wait'.
+    :param attrs: extra attributes of the span.
+    :return: context manager which gives the Span
+    """
+    if not _enabled:
+        return _null_span
+    return _SpanContext(name, category, attrs)
+
+
+def current():
+    """
+    :return: the innermost unfinished span of the current thread, None if no span.
+    """
+    if not _enabled:
+        return None
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+def add_bytes(sent=0, received=0):
+    """
+    Count bytes transferred into the innermost span of the current thread.
+    """
+    if not _enabled:
+        return
+    stack = _stack()
+    if stack:
+        attrs = stack[-1].attrs
+        if sent:
+            attrs['bytes_sent'] = attrs.get('bytes_sent', 0) + sent
+        if received:
+            attrs['bytes_received'] = attrs.get('bytes_received', 0) + received
+
+
+def traced(category):
+    """
+    Decorator to record a span for every call of a method, named as 'Class.method'.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not _enabled:
+                return func(self, *args, **kwargs)
+            with _SpanContext('%s.%s' % (type(self).__name__, func.__name__), category, {}):
+                return func(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def instrument_webdriver(driver):
+    """
+    Record a span for every request of a WebDriver, including the requests of its elements.
+
+    :param driver: appium webdriver.Remote
+    :return: the driver
+    """
+    execute = driver.execute
+
+    def traced_execute(driver_command, params=None):
+        if not _enabled:
+            return execute(driver_command, params)
+        with _SpanContext('webdriver.%s' % driver_command, 'webdriver', {}):
+            return execute(driver_command, params)
+
+    driver.execute = traced_execute
+    return driver
+
+
+def spans(category=None, name=None):
+    """
+    :param category: only spans of this category.
+    :param name: only spans of this name.
+    :return: list of the finished Span.
+    """
+    with _lock:
+        result = list(_spans)
+    if category is not None:
+        result = [s for s in result if s.category == category]
+    if name is not None:
+        result = [s for s in result if s.name == name]
+    return result
+
+
+def clear():
+    """
+    Drop all the finished spans kept in memory.
+    """
+    with _lock:
+        del _spans[:]
+
+
+def histograms(category=None, exclude_wait=False):
+    """
+    Aggregate the finished spans by name.
+
+    :param category: only spans of this category.
+    :param exclude_wait: subtract the auto wait sleep from the span duration.
+    :return: OrderedDict of span name to dict with 'count', 'total', 'mean', 'min', 'p50',
+    'p90', 'p99', 'max' in millisecond and 'buckets', the counts for HISTOGRAM_BUCKETS.
+    """
+    groups = OrderedDict()
+    for s in spans(category):
+        duration = s.duration - s.wait if exclude_wait else s.duration
+        groups.setdefault(s.name, []).append(duration * 1000.0)
+
+    result = OrderedDict()
+    for name, durations in sorted(groups.items(), key=lambda g: -sum(g[1])):
+        values = numpy.array(durations)
+        p50, p90, p99 = numpy.percentile(values, [50, 90, 99])
+        buckets = numpy.bincount(numpy.searchsorted(HISTOGRAM_BUCKETS, values),
+                                 minlength=len(HISTOGRAM_BUCKETS) + 1)
+        result[name] = OrderedDict([('count', len(values)), ('total', values.sum()),
+                                    ('mean', values.mean()), ('min', values.min()),
+                                    ('p50', p50), ('p90', p90), ('p99', p99),
+                                    ('max', values.max()), ('buckets', buckets.tolist())])
+    return result
+
+
+def summary(category=None, exclude_wait=False):
+    """
+    :return: table string of histograms(), the slowest steps in total first.
+    """
+    output = '%-40s %8s %10s %8s %8s %8s %8s\n' % ('name', 'count', 'total(ms)', 'mean', 'p50',
+                                                   'p90', 'max')
+    for name, h in histograms(category, exclude_wait).items():
+        row = '%-40s %8d %10.1f %8.1f %8.1f %8.1f %8.1f\n' % (
+            name, h['count'], h['total'], h['mean'], h['p50'], h['p90'], h['max'])
+        output = ''.join([output, row])
+    return output
+
+
+def export(path):
+    """
+    Write the finished spans kept in memory into a JSON lines file.
+
+    :param path: output file path.
+    """
+    with open(path, 'w') as f:
+        for s in spans():
+            f.write(json.dumps(s.to_dict()))
+            f.write('\n')
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None or _local.pid != os.getpid():
+        stack = _local.stack = []
+        _local.pid = os.getpid()
+    return stack
+
+
+def _finish(span):
+    with _lock:
+        if _keep:
+            _spans.append(span)
+        if _output is not None:
+            _output.write(json.dumps(span.to_dict()))
+            _output.write('\n')
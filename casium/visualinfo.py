@@ -0,0 +1,189 @@
+"""
+Visual response time measured from the screen content.
+
+The screen is captured continuously with raw screenshots while profiling, and the frames are
+compared on host. The response time is from the input to the first frame which differs from the
+screen before the input, the complete time is from the input to the last frame which differs
+from its previous frame. It does not depend on the trace markers of the app, but the time
+resolution is the screenshot interval of the device, usually 30ms to 100ms, and capturing
+costs CPU of the device.
+
+Example::
+    d.start_profiling('visual')
+    d.click('50%', '50%')
+    d.pause_profiling()
+    print d.end_profiling()
+"""
+
+import time
+from collections import OrderedDict
+from os import path
+
+import numpy
+from openpyxl import load_workbook, Workbook
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+
+from casium.screencap import ScreenCapture
+from casium.stats import trim_mean_sd
+
+# Frames are reduced to one channel of every SAMPLE_STRIDE pixel in both axes before comparing.
+SAMPLE_STRIDE = 4
+# A pixel is changed when its value differs more than this in the sum of RGB.
+PIXEL_THRESHOLD = 24
+# A frame is changed when this ratio of pixels changed, to ignore the cursor blinking and noise.
+CHANGE_RATIO = 0.002
+# The reduced frames kept for one profiling iteration, about one minute of capturing.
+MAX_FRAMES = 600
+
+
+def reduce_frame(image):
+    """
+    Reduce a screenshot for frame differencing.
+
+    :param image: numpy array of height x width x channels
+    :return: int16 numpy array of the sum of RGB of the sampled pixels.
+    """
+    return image[::SAMPLE_STRIDE, ::SAMPLE_STRIDE, :3].sum(axis=2, dtype=numpy.int16)
+
+
+def changed_frames(frames, reference=None):
+    """
+    Compare frames with frame differencing.
+
+    :param frames: numpy array of reduced frames, frames x height x width.
+    :param reference: reduced frame to compare all frames with, None to compare every frame
+    with its previous one, the first frame is unchanged then.
+    :return: bool numpy array, True for changed frames.
+    """
+    if reference is None:
+        diff = numpy.abs(numpy.diff(frames, axis=0)) > PIXEL_THRESHOLD
+        changed = diff.reshape(len(diff), -1).mean(axis=1) > CHANGE_RATIO
+        return numpy.concatenate([[False], changed])
+    diff = numpy.abs(frames - reference) > PIXEL_THRESHOLD
+    return diff.reshape(len(diff), -1).mean(axis=1) > CHANGE_RATIO
+
+
+class VisualData(object):
+    def __init__(self, timestamps, frames, input_time):
+        """
+        :param timestamps: list of the capture time of the frames in second
+        :param frames: list of reduced frames
+        :param input_time: the input time in second, None if no input was marked.
+        """
+        self.frame_count = len(frames)
+        self.input_time = input_time
+        self.response_time = -1
+        self.complete_time = -1
+        if input_time is None or not frames:
+            return
+
+        timestamps = numpy.array(timestamps)
+        frames = numpy.array(frames)
+        # The screen before the input is the last frame captured before it.
+        before = numpy.searchsorted(timestamps, input_time) - 1
+        if before < 0:
+            return
+        after = slice(before + 1, None)
+        from_input = numpy.flatnonzero(changed_frames(frames[after], frames[before]))
+        if len(from_input) == 0:
+            return
+        self.response_time = (timestamps[after][from_input[0]] - input_time) * 1000
+        from_previous = numpy.flatnonzero(changed_frames(frames[before:]))
+        complete_time = (timestamps[before:][from_previous[-1]] - input_time) * 1000 \
+            if len(from_previous) else -1
+        self.complete_time = max(complete_time, self.response_time)
+
+
+class VisualInfo(object):
+    def __init__(self):
+        self._capture = None
+        self._input_time = None
+        self._datas = []
+
+    def begin_commands(self):
+        return []
+
+    def end_commands(self):
+        return []
+
+    def trace_begin(self, udid, results=None):
+        self._input_time = None
+        self._capture = ScreenCapture(udid, MAX_FRAMES, transform=reduce_frame).start()
+        # The screen before the input is needed, wait for the first frame.
+        while self._capture.latest() is None and self._capture.running:
+            time.sleep(0.005)
+
+    def mark_input(self, timestamp=None):
+        """
+        Record the time of the first input of the profiling iteration, called by Device actions.
+
+        :param timestamp: host time in second, None for now.
+        """
+        if self._capture is not None and self._input_time is None:
+            self._input_time = timestamp if timestamp is not None else time.time()
+
+    def trace_end(self, udid, results=None):
+        if self._capture is None:
+            return
+        frames = self._capture.stop()
+        if self._capture.error is not None and not frames:
+            raise Exception('Failed to capture screen: %s' % self._capture.error)
+        self._capture = None
+        self._datas += [VisualData([f[0] for f in frames], [f[1] for f in frames],
+                                   self._input_time)]
+
+    def dump_to_metrics(self, metrics):
+        MetricsWriter(metrics, self._datas, self).dump()
+
+    def write_to_excel(self, name, device=None):
+        ExcelWriter(name, self._datas).dump()
+
+
+class MetricsWriter(object):
+    def __init__(self, metrics, datas, visualinfo):
+        self._metrics = metrics
+        self._datas = datas
+        self._visualinfo = visualinfo
+
+    def dump(self):
+        # Iterations without input or visual change have no time.
+        response = [d.response_time for d in self._datas if d.response_time >= 0]
+        complete = [d.complete_time for d in self._datas if d.complete_time >= 0]
+
+        values = OrderedDict()
+        values['Response'] = trim_mean_sd(response, 0.1)
+        values['Complete'] = trim_mean_sd(complete, 0.1)
+        # Metrics values are (mean, sd), the ratio of the iterations with a response time.
+        values['Measured'] = (float(len(response)) / len(self._datas) if self._datas else 0.0, 0)
+        self._metrics.add('visual', values, self._visualinfo)
+
+
+class ExcelWriter(object):
+    def __init__(self, name, datas):
+        self._file_name = 'visualinfo.xlsx'
+        self._name = name
+        self._datas = datas
+
+    def dump(self):
+        col_titles = ['Response Time(ms)', 'Complete Time(ms)', 'Frames']
+
+        if path.isfile(self._file_name):
+            wb = load_workbook(self._file_name)
+        else:
+            wb = Workbook()
+        ws = wb.create_sheet(title=self._name)
+
+        ft_bold = Font(bold=True)
+        for col, name in enumerate(col_titles):
+            col_letter = get_column_letter(col + 1)
+            ws['%s%s' % (col_letter, 1)] = name
+            ws['%s%s' % (col_letter, 1)].font = ft_bold
+            ws.column_dimensions[col_letter].width = len(name) + 4
+
+        for row, data in enumerate(self._datas):
+            ws['A%s' % (row + 2)] = data.response_time
+            ws['B%s' % (row + 2)] = data.complete_time
+            ws['C%s' % (row + 2)] = data.frame_count
+
+        wb.save(self._file_name)
@@ -3,6 +3,7 @@ import traceback
 from urllib2 import URLError
 
 from casium import Device
+from casium.fleet import Fleet
 
 
 def test_launcher(device, package, activity, repeat, output):
@@ -29,12 +30,25 @@ def test_launcher(device, package, activity, repeat, output):
     print metrics
 
 
+def test_launcher_fleet(package, activity, repeat):
+    def scenario(device):
+        for i in range(repeat):
+            device.start_profiling('gfx')
+            device.swipe('90%', '50%', '50%', '50%', duration=100)
+            device.swipe('50%', '50%', '90%', '50%', duration=100)
+            device.pause_profiling()
+
+    print 'Start profiling on all devices %s times' % repeat
+    print Fleet(scenario, start_appium=True, package=package, activity=activity).run()
+
+
 def print_usage_and_exit():
     print 'Usage: test_launcher [-d DEVICE_NAME]\n' \
           '                     [-p PACKAGE_NAME]\n' \
           '                     [-a ACTIVITY_NAME]\n' \
           '                     [-n REPEAT_TIMES]\n' \
           '                     [-o OUTPUT_NAME]\n' \
+          '                     [-f]\n' \
           '                     [-h]\n'
     sys.exit(1)
 
@@ -45,6 +59,7 @@ if __name__ == "__main__":
     activity_name = 'Launcher'
     repeat_times = 10
     output_name = None
+    fleet_mode = False
 
     try:
         for index, arg in enumerate(sys.argv):
@@ -60,8 +75,13 @@ if __name__ == "__main__":
                 repeat_times = int(sys.argv[index + 1])
             elif arg == '-o':
                 output_name = sys.argv[index + 1]
+            elif arg == '-f':
+                fleet_mode = True
     except Exception, e:
         traceback.print_exc()
         print_usage_and_exit()
 
-    test_launcher(device_name, package_name, activity_name, repeat_times, output_name)
+    if fleet_mode:
+        test_launcher_fleet(package_name, activity_name, repeat_times)
+    else:
+        test_launcher(device_name, package_name, activity_name, repeat_times, output_name)
@@ -1,13 +1,18 @@
 import pytest
 
-from test_launcher.launcher import Launcher
+from test_launcher.launcher import Launcher, DEVICE_POOL
 
 
 @pytest.fixture(scope='module', autouse=True)
 def auto_connect():
     l = Launcher()
+    l.connect()
     yield l
-    l.device.disconnect()
+    l.disconnect()
+
+
+def pytest_sessionfinish(session, exitstatus):
+    DEVICE_POOL.close()
 
 
 def pytest_addoption(parser):
@@ -3,10 +3,14 @@ import time
 
 from selenium.common.exceptions import NoSuchElementException
 
-from casium import Device, By
+from casium import By
+from casium.pool import DevicePool
 
 VIEW_GROUP = 'android.view.ViewGroup'
 
+DEVICE_POOL = DevicePool(device='Tecno', package='com.transsion.hilauncher',
+                         activity='Launcher', auto_reset=True)
+
 
 def singleton(cls, *args, **kw):
     instances = {}
@@ -24,8 +28,16 @@ class Launcher(object):
     MAX_PAGES = 7
 
     def __init__(self):
-        self._device = Device(device='Tecno', package='com.transsion.hilauncher',
-                              activity='Launcher', auto_reset=True)
+        self._device = None
+        self.connect()
+
+    def connect(self):
+        """
+        Take the device from the pool, the app data is cleared if it was used by another module.
+        """
+        if self._device is not None:
+            return
+        self._device = DEVICE_POOL.acquire()
 
         self._skipped = {key: False for key in
                          ['option_menu', 'notification', 'edit_mode', 'hotseat']}
@@ -41,6 +53,14 @@ class Launcher(object):
             self._init_grid_size()
             self._init_page_count()
 
+    def disconnect(self):
+        """
+        Give the device back to the pool, its appium session is kept for the next module.
+        """
+        if self._device is not None:
+            DEVICE_POOL.release(self._device)
+            self._device = None
+
     def _init_page_count(self):
         if self._has_init_page_count:
             return
@@ -180,15 +200,18 @@ class Launcher(object):
 
     def get_current_page_apps(self):
         ws = self._device.find_element(By().res('workspace'))
-        return ws.find_elements(By().xpath('//%s/android.widget.TextView' % VIEW_GROUP))
+        return ws.find_elements(By().xpath('//%s/android.widget.TextView' % VIEW_GROUP),
+                                attributes=['center'])
 
     def get_current_page_folder(self):
         ws = self._device.find_element(By().res('workspace'))
-        return ws.find_elements(By().xpath('//%s/android.widget.FrameLayout' % VIEW_GROUP))
+        return ws.find_elements(By().xpath('//%s/android.widget.FrameLayout' % VIEW_GROUP),
+                                attributes=['center'])
 
     def get_current_page_widgets(self):
         ws = self._device.find_element(By().res('workspace'))
-        return ws.find_elements(By().xpath('//%s/android.appwidget.AppWidgetHostView' % VIEW_GROUP))
+        return ws.find_elements(By().xpath('//%s/android.appwidget.AppWidgetHostView' % VIEW_GROUP),
+                                attributes=['location', 'size'])
 
     def get_current_page_cells(self):
         cells = [[None for i in range(self._row_num)] for i in range(self._col_num)]